@@ -0,0 +1,114 @@
+"""Compare benchmark reports
+
+Compare two reports written by `run.py`:
+
+    python benchmarks/compare.py base.json head.json
+
+or run the benchmarks for two checkouts of promus and compare them:
+
+    python benchmarks/compare.py --checkout ../promus-master .
+
+A phase is a regression when its median time grows by more than the
+threshold or when it starts more subprocesses. The exit status is 1
+if there is at least one regression.
+
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from os.path import dirname, abspath
+
+RUN = '%s/run.py' % dirname(abspath(__file__))
+
+
+def parse_options():
+    "Interpret the command line inputs and options. "
+    argp = argparse.ArgumentParser(description='compare promus benchmarks')
+    argp.add_argument('base', type=str,
+                      help='base report (or checkout with --checkout)')
+    argp.add_argument('head', type=str,
+                      help='new report (or checkout with --checkout)')
+    argp.add_argument('--checkout', action='store_true',
+                      help='arguments are promus source directories')
+    argp.add_argument('-t', '--threshold', type=float, default=0.10,
+                      help='allowed relative slowdown (default: 0.10)')
+    argp.add_argument('-n', '--repeat', type=int, default=5,
+                      help='number of runs of each phase (--checkout)')
+    return argp.parse_args()
+
+
+def run_checkout(path, repeat):
+    "Run the benchmarks with the promus found in `path`. "
+    env = dict(os.environ)
+    env['PYTHONPATH'] = abspath(path)
+    tmpfd, output = tempfile.mkstemp(suffix='.json')
+    os.close(tmpfd)
+    try:
+        subprocess.check_call([sys.executable, RUN, '-n', str(repeat),
+                               '-o', output], env=env)
+        return load(output)
+    finally:
+        os.remove(output)
+
+
+def load(path):
+    "Read a report. "
+    with open(path) as tmpf:
+        return json.load(tmpf)
+
+
+def compare(base, head, threshold):
+    "Print the comparison and return the number of regressions. "
+    regressions = 0
+    fmt = '%-26s %10s %10s %8s %6s %6s  %s\n'
+    sys.stdout.write(fmt % ('phase', 'base ms', 'head ms', 'change',
+                            'procs', 'procs', ''))
+    for name in sorted(set(base['phases']) & set(head['phases'])):
+        old = base['phases'][name]
+        new = head['phases'][name]
+        change = new['wall_median'] / max(old['wall_median'], 1e-9) - 1
+        flag = ''
+        if change > threshold or new['subprocesses'] > old['subprocesses']:
+            flag = 'REGRESSION'
+            regressions += 1
+        sys.stdout.write(fmt % (name, '%.1f' % (old['wall_median'] * 1e3),
+                                '%.1f' % (new['wall_median'] * 1e3),
+                                '%+.0f%%' % (change * 100),
+                                old['subprocesses'], new['subprocesses'],
+                                flag))
+    for name in sorted(set(base.get('micro', {})) &
+                       set(head.get('micro', {}))):
+        for (size, old), (_, new) in zip(base['micro'][name],
+                                         head['micro'][name]):
+            change = new / max(old, 1e-12) - 1
+            flag = ''
+            if change > threshold:
+                flag = 'REGRESSION'
+                regressions += 1
+            sys.stdout.write(fmt % ('%s[%d]' % (name, size),
+                                    '%.3f' % (old * 1e3),
+                                    '%.3f' % (new * 1e3),
+                                    '%+.0f%%' % (change * 100), '', '',
+                                    flag))
+    return regressions
+
+
+def main():
+    "Compare the reports. "
+    opts = parse_options()
+    if opts.checkout:
+        base = run_checkout(opts.base, opts.repeat)
+        head = run_checkout(opts.head, opts.repeat)
+    else:
+        base = load(opts.base)
+        head = load(opts.head)
+    if compare(base, head, opts.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Fixtures
+
+Build a synthetic promus host: a home directory with the git
+configuration, the authorized_keys file, a bare repository with
+commits, an acl and profiles, and a clone with staged changes.
+
+"""
+
+import os
+import subprocess
+
+MASTER = 'master'
+MASTER_EMAIL = 'master@promus.bench'
+FAKE_KEY = 'AAAAC3NzaC1lZDI1NTE5AAAAI%s'
+
+
+def git(args, cwd, env):
+    "Run git and return its output. "
+    return subprocess.check_output(['git'] + args, cwd=cwd, env=env,
+                                   stderr=subprocess.STDOUT).decode('utf-8')
+
+
+def user_email(num):
+    "Email of the synthetic user `num`. "
+    return 'user%d@promus.bench' % num
+
+
+def authorized_keys_line(num):
+    "A greet entry for the synthetic user `num`. "
+    return ('command="python -m promus greet \'%s,user%d,User %d,alias%d\'" '
+            'ssh-ed25519 %s user%d@bench\n' %
+            (user_email(num), num, num, num, FAKE_KEY % ('%020d' % num), num))
+
+
+def acl_string(users, rules):
+    "Return an acl with `rules` path and name rules. "
+    lines = ['admin: %s, user0' % MASTER,
+             'user: %s' % ', '.join(['user%d' % num
+                                     for num in range(1, users)])]
+    for num in range(rules):
+        other = 'user%d' % (num % max(users, 1))
+        if num % 2:
+            lines.append('name: *.ext%d | !allow, %s' % (num, other))
+        else:
+            lines.append('path: locked%d/ | !deny, %s' % (num, other))
+    return '\n'.join(lines) + '\n'
+
+
+def profile_string(num):
+    "Profile for the synthetic user `num`. "
+    if num % 2:
+        return 'email: %s\nnotify: track\ntrack-files: src/f1*, docs\n' % \
+            user_email(num)
+    return 'email: %s\nnotify: all\ntrack-files:\n' % user_email(num)
+
+
+def write_gitconfig(home, smtp):
+    "Write the global git configuration promus reads. "
+    with open('%s/.gitconfig' % home, 'w') as cfg:
+        cfg.write('[user]\n\tname = Master\n\temail = %s\n' % MASTER_EMAIL)
+        cfg.write('[host]\n\talias = bench\n\temail = %s\n' % MASTER_EMAIL)
+        cfg.write('\tusername = master\n\tsmtpserver = %s\n' % smtp)
+        cfg.write('\tsmtpssl = false\n')
+        cfg.write('[init]\n\tdefaultBranch = master\n')
+
+
+def make_host(root, opts, smtp):
+    """Create the synthetic host in `root`. Returns a dictionary with
+    the environment and the paths used by the benchmarks. """
+    home = '%s/home' % root
+    os.makedirs('%s/.ssh' % home)
+    os.makedirs('%s/.promus' % home)
+    env = dict(os.environ)
+    env.update({'HOME': home, 'USER': MASTER, 'GIT_CONFIG_NOSYSTEM': '1'})
+    write_gitconfig(home, smtp)
+    # The keys of the account, promus creates them when missing
+    for name, ktype in [('id_rsa', 'rsa'), ('master-bench-git', 'ed25519')]:
+        subprocess.check_call(['ssh-keygen', '-q', '-t', ktype, '-N', '',
+                               '-C', name, '-f', '%s/.ssh/%s' % (home, name)])
+    with open('%s/.ssh/authorized_keys' % home, 'w') as akf:
+        for num in range(opts.users):
+            akf.write(authorized_keys_line(num))
+
+    bare = '%s/git/bench.git' % home
+    work = '%s/work' % root
+    git(['init', '-q', '--bare', bare], root, env)
+    git(['init', '-q', work], root, env)
+    with open('%s/.acl' % work, 'w') as aclf:
+        aclf.write(acl_string(opts.users, opts.acl_rules))
+    for num in range(min(opts.profiles, opts.users)):
+        # profiles are named after the email of the user
+        profile = '%s/.%s.profile' % (work, user_email(num))
+        with open(profile, 'w') as prof:
+            prof.write(profile_string(num))
+    os.makedirs('%s/src' % work)
+    os.makedirs('%s/docs' % work)
+    for num in range(opts.files):
+        folder = 'src' if num % 3 else 'docs'
+        with open('%s/%s/f%d.txt' % (work, folder, num), 'w') as tmpf:
+            tmpf.write('file %d\n' % num)
+    git(['add', '-A'], work, env)
+    git(['commit', '-q', '-m', 'initial'], work, env)
+    first = git(['rev-parse', 'HEAD'], work, env).strip()
+    for num in range(opts.commits):
+        for fnum in range(num % opts.files, opts.files, max(opts.commits, 1)):
+            folder = 'src' if fnum % 3 else 'docs'
+            with open('%s/%s/f%d.txt' % (work, folder, fnum), 'a') as tmpf:
+                tmpf.write('commit %d\n' % num)
+        git(['commit', '-q', '-a', '--allow-empty', '-m',
+             'commit %d' % num], work, env)
+    last = git(['rev-parse', 'HEAD'], work, env).strip()
+    git(['push', '-q', bare, 'master'], work, env)
+    for num in range(0, opts.files, max(1, opts.files // opts.staged)):
+        folder = 'src' if num % 3 else 'docs'
+        with open('%s/%s/f%d.txt' % (work, folder, num), 'a') as tmpf:
+            tmpf.write('staged\n')
+    git(['add', '-A'], work, env)
+    return {
+        'env': env,
+        'home': home,
+        'bare': bare,
+        'work': work,
+        'oldrev': first,
+        'newrev': last,
+    }
@@ -0,0 +1,329 @@
+"""Promus benchmarks
+
+Run the code paths executed on every ssh connection and every push
+against a synthetic host and report the results as json:
+
+    PYTHONPATH=. python benchmarks/run.py -o report.json
+
+Each measurement runs in a forked process so that modules imported
+and caches filled by one phase do not make another one look faster.
+For each phase the report contains the wall time, the number of
+subprocesses started and the peak memory of the process and of its
+children. Use `compare.py` to compare two reports.
+
+The run fails when `python -m promus greet`, started on every ssh
+login, takes longer than `--import-budget` milliseconds. `make
+check-import` runs only that check.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import traceback
+import subprocess
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(abspath(__file__)))
+# pylint: disable=C0413
+import fixtures
+from smtpsink import SinkServer
+
+
+# Milliseconds allowed to `python -m promus greet`, interpreter startup
+# included, before the benchmarks fail
+IMPORT_BUDGET = 60.0
+
+
+def parse_options():
+    "Interpret the command line inputs and options. "
+    argp = argparse.ArgumentParser(description='promus benchmarks')
+    argp.add_argument('-o', '--output', type=str, default=None,
+                      help='write the json report to this file')
+    argp.add_argument('-n', '--repeat', type=int, default=5,
+                      help='number of runs of each phase')
+    argp.add_argument('-p', '--phase', type=str, action='append',
+                      help='run only the given phases')
+    argp.add_argument('--users', type=int, default=50,
+                      help='number of users in authorized_keys')
+    argp.add_argument('--profiles', type=int, default=20,
+                      help='number of user profiles in the repository')
+    argp.add_argument('--acl-rules', type=int, default=20,
+                      help='number of path and name rules in the acl')
+    argp.add_argument('--commits', type=int, default=20,
+                      help='number of commits in a push')
+    argp.add_argument('--files', type=int, default=60,
+                      help='number of files in the repository')
+    argp.add_argument('--staged', type=int, default=10,
+                      help='number of staged files for pre-commit')
+    argp.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                      help='fail if `python -m promus greet` takes more '
+                           'ms, 0 to disable (default: %(default)s)')
+    argp.add_argument('--keep', action='store_true',
+                      help='do not remove the synthetic host')
+    return argp.parse_args()
+
+
+class Counter(object):
+    "Count the subprocesses started in this process. "
+
+    def __init__(self):
+        self.count = 0
+        self._init = subprocess.Popen.__init__
+
+    def install(self):
+        "Wrap `Popen.__init__`. "
+        counter = self
+        original = self._init
+
+        def init(popen, *args, **kwargs):
+            "Count and start the subprocess. "
+            counter.count += 1
+            original(popen, *args, **kwargs)
+        subprocess.Popen.__init__ = init
+
+
+def maxrss(who):
+    "Peak resident memory in kilobytes. "
+    return resource.getrusage(who).ru_maxrss
+
+
+def in_child(setup, body, host):
+    """Run `setup` and then time `body` in a forked process. Returns
+    the measurements or raises RuntimeError with the child traceback.
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        result = dict()
+        try:
+            devnull = os.open(os.devnull, os.O_RDWR)
+            os.dup2(devnull, 0)
+            os.dup2(devnull, 1)
+            os.dup2(devnull, 2)
+            os.environ.clear()
+            os.environ.update(host['env'])
+            state = setup(host) if setup else None
+            counter = Counter()
+            counter.install()
+            start = time.time()
+            try:
+                body(host, state)
+            except SystemExit as exc:
+                result['status'] = exc.code
+            result['wall'] = time.time() - start
+            result['subprocesses'] = counter.count
+            result['maxrss'] = maxrss(resource.RUSAGE_SELF)
+            result['maxrss_children'] = maxrss(resource.RUSAGE_CHILDREN)
+        except BaseException:
+            result = {'error': traceback.format_exc()}
+        with os.fdopen(wfd, 'w') as pipe:
+            pipe.write(json.dumps(result))
+        os._exit(0)
+    os.close(wfd)
+    with os.fdopen(rfd, 'r') as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    result = json.loads(data)
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+def summarize(runs):
+    "Reduce the runs of a phase to a single entry. "
+    walls = sorted(run['wall'] for run in runs)
+    return {
+        'runs': len(runs),
+        'wall_min': walls[0],
+        'wall_median': walls[len(walls) // 2],
+        'subprocesses': max(run['subprocesses'] for run in runs),
+        'maxrss': max(run['maxrss'] for run in runs),
+        'maxrss_children': max(run['maxrss_children'] for run in runs),
+        'status': runs[-1].get('status'),
+    }
+
+
+def write_last(host, cmd):
+    "Write the `promus.last` file the server side hooks read. "
+    with open('%s/.promus/promus.last' % host['home'], 'w') as tmpf:
+        tmpf.write('%s\nuser0\nUser 0\nalias0\n%s' %
+                   (fixtures.user_email(0), cmd))
+
+
+def import_body(host, _):
+    """Start `python -m promus greet`, the command run on every ssh
+    login, in a new interpreter and stop at the help of the command.
+    The time includes the interpreter startup. """
+    subprocess.check_call([sys.executable, '-m', 'promus', 'greet',
+                           '--help'])
+
+
+def greet_body(host, _):
+    "A guest asking to fetch the repository. "
+    os.environ['SSH_ORIGINAL_COMMAND'] = "git-upload-pack '%s'" % \
+        host['bare']
+    os.chdir(host['home'])
+    from promus.command import greet
+    greet.run(argparse.Namespace(info='%s,user0,User 0,alias0' %
+                                 fixtures.user_email(0)))
+
+
+def update_setup(host):
+    "Prepare the environment git gives to the update hook. "
+    write_last(host, "git-receive-pack '%s'" % host['bare'])
+    os.chdir(host['bare'])
+    os.environ['GIT_DIR'] = '.'
+    sys.argv = ['hooks/update', 'refs/heads/master',
+                host['oldrev'], host['newrev']]
+
+
+def update_body(host, _):
+    "The update hook checking a push. "
+    import promus.core as prc
+    from promus.command import import_mod
+    prs = prc.Promus()
+    import_mod('promus.hooks.update').run(prs)
+    prs.dismiss("update>> done...", 0)
+
+
+def post_receive_setup(host):
+    "Run the update hook to produce the list of files to notify. "
+    update_setup(host)
+    pid = os.fork()
+    if pid == 0:
+        try:
+            update_body(host, None)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def post_receive_body(host, _):
+    "The post-receive hook sending the notifications. "
+    import promus.core as prc
+    from promus.command import import_mod
+    prs = prc.Promus()
+    import_mod('promus.hooks.post_receive').run(prs)
+    prs.dismiss("post-receive>> done...", 0)
+
+
+def pre_commit_setup(host):
+    "Move to the working tree with the staged files. "
+    write_last(host, 'commit')
+    os.chdir(host['work'])
+
+
+def pre_commit_body(host, _):
+    "The pre-commit hook checking the staged files. "
+    import promus.core as prc
+    from promus.command import import_mod
+    prs = prc.Promus()
+    prs.guest = 'user0'
+    import_mod('promus.hooks.pre_commit').run(prs)
+    prs.dismiss("pre-commit>> done...", 0)
+
+
+def micro_body(host, state):
+    """Time the parsers with inputs of increasing size. The results
+    are stored in `state` and written to a file by the child. """
+    import promus.core as prc
+    curves = {'parse_acl': [], 'parse_profile': [],
+              'read_authorized_keys': []}
+    for size in (10, 100, 1000):
+        acl = fixtures.acl_string(size, size)
+        curves['parse_acl'].append([size, timeit(prc.parse_acl, acl)])
+        profile = 'email: a@b.c\nnotify: track\ntrack-files: %s\n' % \
+            ', '.join(['dir%d/*.tex' % num for num in range(size)])
+        curves['parse_profile'].append([size, timeit(prc.parse_profile,
+                                                     profile)])
+        with open('%s/.ssh/authorized_keys' % host['home'], 'w') as akf:
+            for num in range(size):
+                akf.write(fixtures.authorized_keys_line(num))
+        curves['read_authorized_keys'].append(
+            [size, timeit(prc.read_authorized_keys)])
+    with open(state, 'w') as tmpf:
+        json.dump(curves, tmpf)
+
+
+def micro_setup(host):
+    "File where the scaling curves are written. "
+    return '%s/micro.json' % host['home']
+
+
+def timeit(func, *args):
+    "Average time of a call in seconds. "
+    num = 0
+    start = time.time()
+    while True:
+        func(*args)
+        num += 1
+        elapsed = time.time() - start
+        if elapsed > 0.2 and num >= 3:
+            return elapsed / num
+
+
+PHASES = [
+    ('import', None, import_body),
+    ('greet', None, greet_body),
+    ('update', update_setup, update_body),
+    ('post_receive', post_receive_setup, post_receive_body),
+    ('pre_commit', pre_commit_setup, pre_commit_body),
+]
+
+
+def run_phases(opts, host):
+    "Run the phases and return the report. "
+    report = {'phases': dict()}
+    for name, setup, body in PHASES:
+        if opts.phase and name not in opts.phase:
+            continue
+        runs = [in_child(setup, body, host) for _ in range(opts.repeat)]
+        report['phases'][name] = summarize(runs)
+        sys.stderr.write('%-14s %8.1f ms  %3d subprocesses\n' %
+                         (name, report['phases'][name]['wall_median'] * 1e3,
+                          report['phases'][name]['subprocesses']))
+    if not opts.phase or 'micro' in opts.phase:
+        in_child(micro_setup, micro_body, host)
+        with open(micro_setup(host)) as tmpf:
+            report['micro'] = json.load(tmpf)
+    return report
+
+
+def main():
+    "Build the synthetic host and run the benchmarks. "
+    opts = parse_options()
+    root = tempfile.mkdtemp(prefix='promus-bench-')
+    sink = SinkServer().start()
+    try:
+        host = fixtures.make_host(root, opts, sink.address)
+        report = run_phases(opts, host)
+    finally:
+        sink.stop()
+        if not opts.keep:
+            shutil.rmtree(root)
+    report['options'] = vars(opts)
+    report['emails'] = len(sink.messages)
+    if opts.output:
+        with open(opts.output, 'w') as tmpf:
+            json.dump(report, tmpf, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    imp = report['phases'].get('import')
+    if opts.import_budget and imp:
+        if imp['wall_median'] * 1e3 > opts.import_budget:
+            sys.stderr.write('python -m promus greet took %.1f ms, the '
+                             'budget is %.1f ms\n' %
+                             (imp['wall_median'] * 1e3, opts.import_budget))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""SMTP sink
+
+A minimal SMTP server accepting every message and discarding it. It
+only understands what `smtplib` sends without authentication and
+without TLS, which is what promus does when `host.smtpssl` is false.
+
+"""
+
+import threading
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+class SinkHandler(socketserver.StreamRequestHandler):
+    "Handle a single SMTP session. "
+
+    def reply(self, msg):
+        "Send a reply line to the client. "
+        self.wfile.write(('%s\r\n' % msg).encode('ascii'))
+
+    def handle(self):
+        self.reply('220 promus-benchmark sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode('ascii', 'replace').strip().upper()
+            if cmd.startswith('EHLO') or cmd.startswith('HELO'):
+                self.reply('250 promus-benchmark')
+            elif cmd.startswith('DATA'):
+                self.reply('354 end data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(line)
+                self.server.messages.append(size)
+                self.reply('250 queued')
+            elif cmd.startswith('QUIT'):
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class SinkServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    "SMTP server running in a background thread. "
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        socketserver.TCPServer.__init__(self, ('127.0.0.1', 0), SinkHandler)
+        self.messages = list()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def address(self):
+        "The `host:port` string to give to smtplib. "
+        return '%s:%d' % self.server_address
+
+    def start(self):
+        "Start serving in the background. "
+        self.thread.start()
+        return self
+
+    def stop(self):
+        "Stop the server. "
+        self.shutdown()
+        self.server_close()
@@ -8,12 +8,15 @@ Use the option --help for more information.
 
 """
 
+import os
+import sys
 import argparse
 import textwrap
 from os.path import split, abspath
 from glob import iglob
 from promus.__version__ import VERSION
 from promus.command import import_mod
+from promus.core.profile import profile_call
 try:
     import argcomplete
 except ImportError:
@@ -59,20 +62,29 @@ version:
     return argp.parse_args()
 
 
+def command_names():
+    "Return the names of the modules in `promus.command`. "
+    rootpath = split(abspath(__file__))[0]
+    return [split(name)[1][:-3]
+            for name in iglob('%s/command/*.py' % rootpath)]
+
+
 def run():
     """Run promus from the command line. """
+    names = command_names()
+    # Only the module of the command is imported when it is known,
+    # `greet` runs on every ssh connection. Completion needs them all.
+    if len(sys.argv) > 1 and sys.argv[1] in names and \
+            '_ARGCOMPLETE' not in os.environ:
+        names = [sys.argv[1]]
     mod = dict()
-    rootpath = split(abspath(__file__))[0]
-
-    mod_names = [name for name in iglob('%s/command/*.py' % rootpath)]
-    for name in mod_names:
-        tmp_name = split(name)[1][:-3]
-        tmp_mod = import_mod('promus.command.%s' % tmp_name)
+    for name in names:
+        tmp_mod = import_mod('promus.command.%s' % name)
         if hasattr(tmp_mod, 'add_parser'):
-            mod[tmp_name] = tmp_mod
+            mod[name] = tmp_mod
 
     arg = parse_options(mod)
-    mod[arg.parser_name].run(arg)
+    profile_call(arg.parser_name, mod[arg.parser_name].run, arg)
 
 if __name__ == '__main__':
     run()
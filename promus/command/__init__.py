@@ -5,12 +5,15 @@ Collection of functions to create the command line utility.
 """
 
 import os
+import re
 import sys
 import os.path as pth
-from dateutil import parser
 from datetime import datetime
 from subprocess import Popen, PIPE
 
+# The program run by a shell command, see `exec_cmd`
+RE_PROGRAM = re.compile(r'\s*(cd \S+;\s*)?(?P<prog>[^\s;]*)')
+
 
 def error(msg):
     "Print a message to the standard error stream and exit. "
@@ -38,16 +41,19 @@ def import_mod(name):
 
 def exec_cmd(cmd, verbose=False):
     "Run a subprocess and return its output and errors. "
+    # Imported here since `promus.core` imports this module
+    from promus.core.metrics import timer
     if verbose:
         out = sys.stdout
         err = sys.stderr
     else:
         out = PIPE
         err = PIPE
-    process = Popen(cmd, shell=True,
-                    universal_newlines=True, executable="/bin/bash",
-                    stdout=out, stderr=err)
-    out, err = process.communicate()
+    with timer('exec:%s' % RE_PROGRAM.match(cmd).group('prog')):
+        process = Popen(cmd, shell=True,
+                        universal_newlines=True, executable="/bin/bash",
+                        stdout=out, stderr=err)
+        out, err = process.communicate()
     return out, err, process.returncode
 
 
@@ -57,6 +63,7 @@ def exec_cmd(cmd, verbose=False):
 def date(short=False):
     "Return the current date as a string. "
     if isinstance(short, str):
+        from dateutil import parser
         now = parser.parse(str(short))
         return now.strftime("%a %b %d, %Y %r")
     now = datetime.now()
@@ -13,6 +13,9 @@ DESC = """
 Reset the git hooks. Note that this version does not create a backup
 of the current hooks. Also you must be in the git repository.
 
+With the option --shared the repository is configured to use the
+hooks in ~/.promus/hooks instead.
+
 """
 
 
@@ -24,33 +27,41 @@ def add_parser(subp, raw):
                            description=textwrap.dedent(DESC))
     tmpp.add_argument('--bare', action='store_true',
                       help="Use this option for bare repositories")
+    tmpp.add_argument('--shared', action='store_true',
+                      help="use the shared hooks in ~/.promus/hooks")
 
 
 def reset_hooks():
     """Command to rest hooks in a repository. """
     print("resetting hooks:")
-    hooks = ['commit-msg', 'post-checkout', 'post-commit', 'post-merge',
-             'pre-commit', 'pre-rebase',
-             'prepare-commit-msg']
-    for hook in hooks:
-        print("  %s" % hook)
-        path = './.git/hooks'
-        prc.make_hook(hook, path)
+    for hook in prc.CLIENT_HOOKS:
+        if prc.make_hook(hook, './.git/hooks'):
+            print("  %s" % hook)
+        else:
+            print("  %s (skipped, it does nothing)" % hook)
 
 
 def reset_hooks_bare():
     """Command to reset hooks in a bare repository. """
     print("resetting hooks in bare repository:")
-    hooks = ['post-receive', 'update']
-    for hook in hooks:
+    for hook in prc.BARE_HOOKS:
         print("  %s" % hook)
         path = './hooks'
         prc.make_hook(hook, path)
 
 
+def reset_hooks_shared():
+    """Command to make a repository use the shared hooks. """
+    path = prc.make_shared_hooks()
+    print("using shared hooks in %s" % path)
+    prc.use_shared_hooks('.', path)
+
+
 def run(arg):
     """Run command. """
-    if arg.bare:
+    if arg.shared:
+        reset_hooks_shared()
+    elif arg.bare:
         reset_hooks_bare()
     else:
         reset_hooks()
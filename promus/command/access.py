@@ -0,0 +1,47 @@
+"""Access
+
+Display the repositories a user can reach.
+
+"""
+
+import sys
+import textwrap
+from promus.core.access import access, user_names
+
+DESC = """
+display the repositories under ~/git (or the directory given with
+--dir) in which a user, given by user name or email, appears in the
+acl along with the roles of the user: admin, user, rsync and the path
+and name rules. For instance
+
+    promus access jmlopez
+    promus access jmlopez@example.com --quiet
+
+the second form only prints the paths of the repositories. The answer
+comes from an index updated when an acl is pushed.
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('access', help='repositories a user can reach',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('user', type=str,
+                      help='user name or email')
+    tmpp.add_argument('-d', '--dir', type=str, default=None,
+                      help='directory holding the repositories')
+    tmpp.add_argument('-q', '--quiet', action='store_true',
+                      help='only display the paths of the repositories')
+
+
+def run(arg):
+    """Run command. """
+    found = access(user_names(arg.user), arg.dir)
+    disp = sys.stdout.write
+    for repo in sorted(found):
+        if arg.quiet:
+            disp('%s\n' % repo)
+        else:
+            disp('%s: %s\n' % (repo, ', '.join(found[repo])))
@@ -52,17 +52,21 @@ def add_host(arg):
                      alias=alias, pub=pub_key[-20:])
     sys.stderr.write('Contacting %s ... \n' % arg.host)
     out, err, code = exec_cmd(cmd)
-    print out
-    print err
+    sys.stdout.write(out)
+    sys.stderr.write(err)
     if code != 0:
         error("ERROR: Remote did not accept the request.")
     os.remove(arg.host)
     config = prc.read_config()
+    persist = prc.control_persist()
     found = False
     for entry in config:
         if arg.host.replace('@', '-') in entry.split():
             found = True
             sys.stderr.write('Existing entry: `Host %s`\n' % entry)
+            if persist:
+                prc.multiplex(config[entry], persist)
+                prc.write_config(config)
             break
     if not found:
         _, gitkey = prc.get_keys()
@@ -72,6 +76,8 @@ def add_host(arg):
         config[entry]['HostName'] = host
         config[entry]['User'] = user
         config[entry]['IdentityFile'] = gitkey
+        if persist:
+            prc.multiplex(config[entry], persist)
         prc.write_config(config)
     sys.stderr.write('done...\n')
 
@@ -100,27 +106,26 @@ def add_user(_):
     info = os.environ['SSH_ORIGINAL_COMMAND']
     pub, key, email, user, username, host, alias = info.split(',')
     sys.stderr.write('Welcome %s, please wait...\n' % username)
-    users, pending, unknown = prc.read_authorized_keys()
-    # Remove access from private key
-    for entry in pending:
-        if entry[-20:] == pub:
-            pub = entry
-            break
-    sent_to = pending[pub][0]  # Email must match user email
-    if sent_to != email:
-        error("ERROR: Email mismatch, private key is not \
-              being used by intended recipient.")
-    del pending[pub]
-    if email not in users:
-        users[email] = dict()
-    key_type, key_val = key.split()
-    content = [user,
-               username,
-               alias,
-               key_type,
-               '%s@%s' % (user, host)]
-    users[email][key_val] = content
-    prc.write_authorized_keys(users, pending, unknown)
+    with prc.edit_authorized_keys() as (users, pending, unknown):
+        # Remove access from private key
+        for entry in pending:
+            if entry[-20:] == pub:
+                pub = entry
+                break
+        sent_to = pending[pub][0]  # Email must match user email
+        if sent_to != email:
+            error("ERROR: Email mismatch, private key is not \
+                  being used by intended recipient.")
+        del pending[pub]
+        if email not in users:
+            users[email] = dict()
+        key_type, key_val = key.split()
+        content = [user,
+                   username,
+                   alias,
+                   key_type,
+                   '%s@%s' % (user, host)]
+        users[email][key_val] = content
     sys.stderr.write('Connection successful ...\n')
     prc.send_mail([email, prc.config('host.email')],
                   'Connection successful',
@@ -22,8 +22,10 @@ def add_parser(subp, raw):
                            description=textwrap.dedent(DESC))
     tmpp.add_argument('repo', type=str,
                       help='the repository to clone')
+    tmpp.add_argument('-s', '--shared', action='store_true',
+                      help='use the shared hooks in ~/.promus/hooks')
 
 
 def run(arg):
     """Run command. """
-    prc.clone(arg.repo)
+    prc.clone(arg.repo, arg.shared)
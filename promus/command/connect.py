@@ -5,9 +5,9 @@ Aids in the process of creating a passwordless ssh connection.
 
 import os
 import sys
-import pysftp
 import getpass
 import textwrap
+from multiprocessing.pool import ThreadPool
 import promus.core.ssh as ssh
 import promus.core.git as git
 
@@ -28,6 +28,18 @@ instead of
 
     ssh user@some-server
 
+use the option --persist to share a single ssh connection among all
+the sessions to the host, the connection stays open for the given
+time after the last session ends (i.e. 10m). The default value is
+taken from `git config --global host.controlpersist`. The option
+--warm opens the shared connections in advance:
+
+    promus connect --warm some-shortcut
+
+to connect to several hosts at once list them in a file, one
+`user@host alias` pair per line, and use the option --hosts. The same
+password is used for all of them.
+
 """
 
 
@@ -37,72 +49,187 @@ def add_parser(subp, raw):
                            help='make a passwordless ssh connection',
                            formatter_class=raw,
                            description=textwrap.dedent(DESC))
-    tmpp.add_argument('host', type=str,
+    tmpp.add_argument('host', type=str, nargs='?',
                       help='host to connect to')
-    tmpp.add_argument('alias', type=str,
+    tmpp.add_argument('alias', type=str, nargs='?',
                       help='host alias')
-
-
-def check_ssh_config(user, host, alias):
-    """Ajust the ssh configuration file. """
-    config = ssh.read_config()
-    found = False
+    tmpp.add_argument('-p', '--persist', type=str, default=None,
+                      help='keep a shared connection open for this time')
+    tmpp.add_argument('-w', '--warm', type=str, nargs='+', metavar='ALIAS',
+                      help='open the shared connections to the hosts')
+    tmpp.add_argument('-f', '--hosts', type=str, metavar='FILE',
+                      help='file with one `user@host alias` per line')
+    tmpp.add_argument('-j', '--jobs', type=int, default=8,
+                      help='number of hosts to contact at the same time')
+
+
+def add_entry(config, user, host, alias, persist=''):
+    """Add the host to the ssh configuration dictionary. Returns False
+    if the dictionary was not modified. """
     for entry in config:
         if alias in entry.split():
-            found = True
             sys.stdout.write('Alias already in use: `Host %s`\n' % entry)
-            break
-    if not found:
-        entry = '%s %s' % (alias, host)
-        config[entry] = dict()
-        config[entry]['HostName'] = host
-        config[entry]['User'] = user
+            if persist:
+                ssh.multiplex(config[entry], persist)
+                return True
+            return False
+    entry = '%s %s' % (alias, host)
+    config[entry] = dict()
+    config[entry]['HostName'] = host
+    config[entry]['User'] = user
+    if persist:
+        ssh.multiplex(config[entry], persist)
+    return True
+
+
+def check_ssh_config(user, host, alias, persist=''):
+    """Ajust the ssh configuration file. """
+    config = ssh.read_config()
+    if add_entry(config, user, host, alias, persist):
         ssh.write_config(config)
 
 
-def run(arg):
-    """Run command. """
-    host = arg.host
-    alias = arg.alias
+def warm_hosts(aliases):
+    """Open the shared connections to the hosts. """
+    failed = False
+    for alias in aliases:
+        sys.stdout.write('opening connection to %s ... ' % alias)
+        status = ssh.warm(alias)
+        if status is None:
+            sys.stdout.write('skipped, connection sharing is off '
+                             '(see --persist)\n')
+        elif status == 0:
+            sys.stdout.write('ok\n')
+        else:
+            failed = True
+            sys.stdout.write('failed\n')
+    if failed:
+        sys.exit(1)
+
+
+def split_host(host):
+    "Return the user and the host name of `user@host`. "
     tmp = host.split('@')
     if len(tmp) == 2:
-        user = tmp[0]
-        host = tmp[1]
-    else:
-        user = os.environ['USER']
-        host = tmp[0]
+        return tmp[0], tmp[1]
+    return os.environ['USER'], tmp[0]
+
+
+def read_hosts(fname):
+    """Return a list of (host, alias) tuples from a file with one
+    `user@host alias` pair per line. """
+    hosts = list()
+    with open(fname, 'r') as hostsf:
+        for line in hostsf:
+            tmp = line.split()
+            if not tmp or tmp[0][0] == '#':
+                continue
+            if len(tmp) != 2:
+                sys.stderr.write('ERROR: invalid line: %s' % line)
+                sys.exit(2)
+            hosts.append((tmp[0], tmp[1]))
+    return hosts
+
+
+def public_key_line():
+    "Return the line to add to the remote authorized_keys file. "
     idkey, _ = ssh.get_keys()
     idkey = ssh.get_public_key(idkey)
-    key = idkey.split()[1]
-    cn_ = pysftp.Connection(host,
-                            username=user,
-                            password=getpass.getpass())
+    return "%s %s@%s\n" % (idkey, os.environ['USER'],
+                           git.config('host.alias'))
+
+
+def send_key(user, host, password, line):
+    """Append the public key to the remote authorized_keys file unless
+    it is already there. Returns a message describing the result and
+    raises IOError if the file cannot be written. """
+    # pysftp loads paramiko and cryptography, only needed here
+    import pysftp
+    key = line.split()[1]
+    cn_ = pysftp.Connection(host, username=user, password=password)
     try:
-        with cn_.open('.ssh/authorized_keys', 'r') as fp_:
-            authorized_keys = fp_.read()
-    except IOError:
-        authorized_keys = ''
-    disp = sys.stdout.write
-    if key in authorized_keys:
-        disp("Connection has been previously established\n")
-    else:
+        try:
+            with cn_.open('.ssh/authorized_keys', 'r') as fp_:
+                authorized_keys = fp_.read()
+        except IOError:
+            authorized_keys = b''
+        if not isinstance(authorized_keys, str):
+            authorized_keys = authorized_keys.decode('utf-8', 'replace')
+        if key in authorized_keys:
+            return "Connection has been previously established"
         try:
             cn_.mkdir('.ssh')
         except IOError:
             pass
         cn_.chmod('.ssh', 700)
         if authorized_keys and authorized_keys[-1] != '\n':
-            authorized_keys += '\n'
-        line = "%s %s@%s\n" % (idkey,
-                               os.environ['USER'],
-                               git.config('host.alias'))
-        authorized_keys += line
+            line = '\n' + line
+        with cn_.open('.ssh/authorized_keys', 'a') as fp_:
+            fp_.write(line)
+        cn_.chmod('.ssh/authorized_keys', 700)
+        return "Public key added"
+    finally:
+        cn_.close()
+
+
+def connect_hosts(hosts, persist, jobs):
+    """Send the public key to several hosts concurrently using the
+    same password and write the ssh configuration once. """
+    line = public_key_line()
+    password = getpass.getpass()
+
+    def connect_host(item):
+        "Send the key to a single host. "
+        user, host = split_host(item[0])
         try:
-            with cn_.open('.ssh/authorized_keys', 'w') as fp_:
-                fp_.write(authorized_keys)
-            cn_.chmod('.ssh/authorized_keys', 700)
-        except IOError:
-            disp("ERROR: unable to write the authorized_keys file\n")
-        finally:
-            check_ssh_config(user, host, alias)
-            disp('You may now connect to %s using: `ssh %s`\n' % (host, alias))
+            return user, host, item[1], True, send_key(user, host,
+                                                       password, line)
+        except Exception as exc:  # pylint: disable=W0703
+            return user, host, item[1], False, str(exc)
+
+    pool = ThreadPool(max(1, min(jobs, len(hosts))))
+    try:
+        results = pool.map(connect_host, hosts)
+    finally:
+        pool.close()
+        pool.join()
+    config = ssh.read_config()
+    modified = False
+    failed = False
+    for user, host, alias, success, msg in results:
+        sys.stdout.write('%s@%s (%s): %s\n' % (user, host, alias, msg))
+        if success:
+            modified = add_entry(config, user, host, alias, persist) or \
+                modified
+        else:
+            failed = True
+    if modified:
+        ssh.write_config(config)
+    if failed:
+        sys.exit(1)
+
+
+def run(arg):
+    """Run command. """
+    if arg.warm:
+        warm_hosts(arg.warm)
+        return
+    persist = arg.persist
+    if persist is None:
+        persist = ssh.control_persist()
+    if arg.hosts:
+        connect_hosts(read_hosts(arg.hosts), persist, arg.jobs)
+        return
+    if arg.host is None or arg.alias is None:
+        sys.stderr.write('ERROR: host and alias are required\n')
+        sys.exit(2)
+    alias = arg.alias
+    user, host = split_host(arg.host)
+    disp = sys.stdout.write
+    try:
+        disp("%s\n" % send_key(user, host, getpass.getpass(),
+                               public_key_line()))
+    except IOError:
+        disp("ERROR: unable to write the authorized_keys file\n")
+    check_ssh_config(user, host, alias, persist)
+    disp('You may now connect to %s using: `ssh %s`\n' % (host, alias))
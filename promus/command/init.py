@@ -1,17 +1,26 @@
 """Init
 
-Creates a new repository.
+Creates new repositories.
 
 """
 
 import textwrap
 import promus.core as prc
+from promus.command import error
 
 
 DESC = """
 create a new git repository in the directory ~/git. You may create a
 new repository in another directory by providing the option --dir.
 
+several repositories may be created at once by listing their names or
+by providing a manifest file with the option --file. The manifest
+contains one repository name per line, empty lines and lines starting
+with '#' are ignored.
+
+use the option --shared to make the repositories run the hooks
+installed in ~/.promus/hooks instead of having their own copy.
+
 """
 
 
@@ -21,12 +30,38 @@ def add_parser(subp, raw):
                            help='create a base repository (the hub)',
                            formatter_class=raw,
                            description=textwrap.dedent(DESC))
-    tmpp.add_argument('repo', type=str,
-                      help='the repository name')
+    tmpp.add_argument('repo', type=str, nargs='*',
+                      help='the repository names')
     tmpp.add_argument('-d', '--dir', type=str,
                       help='directory where to store the respository')
+    tmpp.add_argument('-f', '--file', type=str,
+                      help='manifest file with repository names')
+    tmpp.add_argument('-s', '--shared', action='store_true',
+                      help='use the shared hooks in ~/.promus/hooks')
+
+
+def read_manifest(fname):
+    "Return the list of repository names in the manifest file. "
+    try:
+        with open(fname, 'r') as manifest:
+            lines = manifest.readlines()
+    except IOError:
+        error("INIT-ERROR>> no such file: '%s'\n" % fname)
+    return [line.strip() for line in lines
+            if line.strip() != '' and line.strip()[0] != '#']
 
 
 def run(arg):
     """Run command. """
-    prc.init(arg.repo, arg.dir)
+    repos = list(arg.repo)
+    if arg.file:
+        repos.extend(read_manifest(arg.file))
+    if not repos:
+        error("INIT-ERROR>> no repository names given\n")
+    hooks_path = None
+    if arg.shared:
+        hooks_path = prc.make_shared_hooks()
+    if len(repos) == 1:
+        prc.init(repos[0], arg.dir, hooks_path=hooks_path)
+    else:
+        prc.init_many(repos, arg.dir, hooks_path)
@@ -9,6 +9,7 @@ import sys
 import site
 import textwrap
 import os.path as pth
+import promus.core as prc
 from promus.command import disp, make_dir, append_variable
 
 DESC = """
@@ -67,7 +68,18 @@ def promusrc():
     disp('done\n')
 
 
+def shared_hooks():
+    """Refresh the shared hooks dispatcher if it has been created. """
+    hooks_path = pth.expandvars('$HOME/.promus/hooks')
+    if not pth.exists(hooks_path):
+        return
+    disp('updating %s ... ' % hooks_path)
+    prc.make_shared_hooks(hooks_path)
+    disp('done\n')
+
+
 def run(_):
     """Run the command. """
     source_promusrc()
     promusrc()
+    shared_hooks()
@@ -0,0 +1,79 @@
+"""List
+
+List the repositories served by this account.
+
+"""
+
+import sys
+import time
+import textwrap
+from promus.command import error
+import promus.core.inventory as inv
+from promus.core.metrics import parse_time
+from promus.core.access import user_names
+
+DESC = """
+list the repositories under ~/git (or the directory given with --dir)
+along with their size, the time of the last push, the commit in HEAD,
+their admins and description. The information is cached and only the
+repositories that changed since the last listing are read again.
+
+    promus list --user jmlopez
+    promus list --stale 90d
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('list', help='list the repositories',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('-d', '--dir', type=str, default=None,
+                      help='directory holding the repositories')
+    tmpp.add_argument('-u', '--user', type=str, default=None,
+                      help='repositories in which USER is in the acl')
+    tmpp.add_argument('-s', '--stale', type=str, default=None,
+                      help='repositories without pushes since STALE')
+    tmpp.add_argument('-r', '--rebuild', action='store_true',
+                      help='read every repository again')
+
+
+def human_size(size):
+    "Return a size in bytes as a short string. "
+    for unit in ['B', 'K', 'M', 'G']:
+        if size < 1024:
+            return '%d%s' % (size, unit)
+        size /= 1024.0
+    return '%dT' % size
+
+
+def run(arg):
+    """Run command. """
+    inventory, _ = inv.refresh(arg.dir, arg.rebuild)
+    before = None
+    if arg.stale:
+        try:
+            before = parse_time(arg.stale)
+        except (ValueError, OverflowError):
+            error("LIST-ERROR>> invalid time: '%s'\n" % arg.stale)
+    names = user_names(arg.user) if arg.user else None
+    disp = sys.stdout.write
+    root = inventory['root']
+    for repo in sorted(inventory['repos']):
+        entry = inventory['repos'][repo]
+        acl = entry['acl']
+        if before is not None and entry['last_push'] >= before:
+            continue
+        if names is not None:
+            if acl is None or not names & set(acl['user']):
+                continue
+        if acl is None:
+            admins = '(%s)' % entry['acl_error']
+        else:
+            admins = ', '.join(sorted(acl['admin']))
+        disp('%-30s %6s  %s  %s  %s%s\n' % (
+            repo[len(root) + 1:], human_size(entry['size']),
+            time.strftime('%Y-%m-%d', time.localtime(entry['last_push'])),
+            (entry['head'] or '-------')[:7], admins,
+            '  # %s' % entry['description'] if entry['description'] else ''))
@@ -0,0 +1,59 @@
+"""Log
+
+Search the promus log.
+
+"""
+
+import sys
+import textwrap
+from promus.command import error
+import promus.core.logindex as logindex
+from promus.core.metrics import parse_time
+
+DESC = """
+display the entries of the promus log written by a guest, for a
+command or for a repository within a time range. The time range is
+given as a date or as a span of time such as 30m, 12h or 7d:
+
+    promus log --guest jmlopez --repo project --since 7d
+
+the log is indexed as it grows (see ~/.promus/promus.log.idx) so
+that searches only read the matching entries.
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('log', help='search the promus log',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('-g', '--guest', type=str, default=None,
+                      help='entries of this guest')
+    tmpp.add_argument('-c', '--cmd', type=str, default=None,
+                      help='entries of this command, i.e. git-receive-pack')
+    tmpp.add_argument('-r', '--repo', type=str, default=None,
+                      help='entries of this repository')
+    tmpp.add_argument('-s', '--since', type=str, default=None,
+                      help='ignore entries before this time')
+    tmpp.add_argument('-u', '--until', type=str, default=None,
+                      help='ignore entries after this time')
+
+
+def run(arg):
+    """Run command. """
+    times = list()
+    for val in [arg.since, arg.until]:
+        try:
+            times.append(parse_time(val) if val else None)
+        except (ValueError, OverflowError):
+            error("LOG-ERROR>> invalid time: '%s'\n" % val)
+    repo = arg.repo
+    if repo is not None:
+        repo = logindex.repo_name(repo)
+    entries = logindex.search(arg.guest, arg.cmd, repo, times[0], times[1])
+    try:
+        for entry in entries:
+            sys.stdout.write(entry)
+    except IOError:
+        pass  # output closed, i.e. piped to head
@@ -0,0 +1,113 @@
+"""Maintain
+
+Repack the hosted repositories and write their commit-graph and
+bitmaps.
+
+"""
+
+import os
+import sys
+import textwrap
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from promus.command import error
+import promus.core.maintenance as mnt
+
+DESC = """
+maintain the bare repositories under ~/git (or the directory given
+with --dir). The packs created by each push are rolled into larger
+ones, the commit-graph and the reachability bitmaps are written and
+loose objects already packed are removed. The repositories pushed to
+the most since their last maintenance go first, several of them are
+maintained in parallel with the lowest cpu and io priority.
+
+use --schedule to run the maintenance with cron:
+
+    promus maintain --schedule "30 3 * * *"
+    promus maintain --unschedule
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('maintain', help='maintain the repositories',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('-d', '--dir', type=str, default=None,
+                      help='directory holding the repositories')
+    tmpp.add_argument('-j', '--jobs', type=int, default=None,
+                      help='repositories maintained at the same time')
+    tmpp.add_argument('-a', '--all', action='store_true',
+                      help='also maintain repositories without activity')
+    tmpp.add_argument('-l', '--limit', type=int, default=0,
+                      help='maintain at most LIMIT repositories')
+    tmpp.add_argument('-n', '--dry-run', action='store_true',
+                      help='only display the repositories in order')
+    tmpp.add_argument('-q', '--quiet', action='store_true',
+                      help='only report errors')
+    tmpp.add_argument('--schedule', type=str, default=None,
+                      metavar='CRON',
+                      help='install a crontab entry with this schedule')
+    tmpp.add_argument('--unschedule', action='store_true',
+                      help='remove the crontab entry')
+
+
+def cron(arg):
+    "Install or remove the crontab entry. "
+    args = '--quiet '
+    if arg.dir:
+        args += '--dir %s ' % os.path.abspath(arg.dir)
+    if arg.jobs:
+        args += '--jobs %d ' % arg.jobs
+    spec = '' if arg.unschedule else arg.schedule
+    try:
+        status = mnt.schedule(spec, args)
+    except OSError as exc:
+        error("MAINTAIN-ERROR>> crontab: %s\n" % exc)
+    if status != 0:
+        error("MAINTAIN-ERROR>> unable to update the crontab\n")
+    if spec:
+        sys.stdout.write('MAINTAIN>> scheduled: %s' %
+                         mnt.crontab_line(spec, args))
+    else:
+        sys.stdout.write('MAINTAIN>> schedule removed\n')
+
+
+def run(arg):
+    """Run command. """
+    if arg.schedule or arg.unschedule:
+        return cron(arg)
+    root = arg.dir or '%s/git' % os.environ['HOME']
+    queue = mnt.prioritize(mnt.find_repos(root), arg.all)
+    if arg.limit > 0:
+        queue = queue[:arg.limit]
+    if arg.dry_run:
+        for repo, score in queue:
+            sys.stdout.write('%8.1f  %s\n' % (score, repo))
+        return
+    if not queue:
+        if not arg.quiet:
+            sys.stdout.write('MAINTAIN>> nothing to do\n')
+        return
+    steps = mnt.maintenance_steps(mnt.git_version())
+    prefix = mnt.niceness()
+    jobs = arg.jobs or max(multiprocessing.cpu_count() // 2, 1)
+    pool = ThreadPool(min(jobs, len(queue)))
+    failed = 0
+    try:
+        results = pool.imap(lambda item: mnt.maintain(item[0], steps,
+                                                      prefix), queue)
+        for (repo, _), (elapsed, errors) in zip(queue, results):
+            if errors:
+                failed += 1
+                sys.stderr.write('MAINTAIN-ERROR>> %s:\n    %s\n' %
+                                 (repo, '\n    '.join(errors)))
+            elif not arg.quiet:
+                sys.stdout.write('MAINTAIN>> %s (%.1f s)\n' % (repo,
+                                                              elapsed))
+    finally:
+        pool.close()
+        pool.join()
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,78 @@
+"""Packcache
+
+Turn the cache of the packs sent to the guests on or off.
+
+"""
+
+import os
+import sys
+import textwrap
+import promus.core.packcache as pcache
+from promus.core.maintenance import find_repos
+
+DESC = """
+cache the packs sent to the guests when they clone or fetch. Many
+guests fetching the same refs after a push get a pack computed once
+instead of one each. The packs of a repository are removed when it
+receives a push.
+
+    promus packcache enable
+    promus packcache enable ~/git/project.git
+    promus packcache status
+    promus packcache disable
+
+enable installs the hook git runs instead of `git pack-objects` and
+turns the cache on for the given repositories or, by default, for all
+the repositories under ~/git (or the directory given with --dir). Run
+it again for the repositories created afterwards. git only reads the
+hook from ~/.gitconfig, so every fetch from any repository of this
+account, not only the promus ones, starts python to decide whether to
+use the cache. disable with repositories only turns them off, without
+repositories it removes the hook and all the cached packs.
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('packcache', help='cache the packs sent',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('action', type=str, metavar='ACTION',
+                      choices=['enable', 'disable', 'status'],
+                      help='One of the following: enable, disable, status')
+    tmpp.add_argument('repos', type=str, nargs='*', metavar='REPO',
+                      help='repositories to enable or disable')
+    tmpp.add_argument('-d', '--dir', type=str, default=None,
+                      help='directory holding the repositories')
+
+
+def repositories(arg):
+    "Return the repositories given or the ones in the directory. "
+    if arg.repos:
+        return [os.path.realpath(repo) for repo in arg.repos]
+    return find_repos(arg.dir or '%s/git' % os.environ['HOME'])
+
+
+def run(arg):
+    """Run command. """
+    disp = sys.stdout.write
+    if arg.action == 'enable':
+        pcache.install_hook()
+        for repo in repositories(arg):
+            pcache.enable(repo)
+            disp('PACKCACHE>> enabled %s\n' % repo)
+    elif arg.action == 'disable':
+        if not arg.repos:
+            pcache.remove_hook()
+            disp('PACKCACHE>> hook removed\n')
+            return
+        for repo in repositories(arg):
+            pcache.disable(repo)
+            disp('PACKCACHE>> disabled %s\n' % repo)
+    else:
+        disp('PACKCACHE>> hook %s\n' %
+             ('installed' if pcache.hook_installed() else 'not installed'))
+        for repo in repositories(arg):
+            if pcache.repo_enabled(repo):
+                disp('  %s\n' % repo)
@@ -0,0 +1,107 @@
+"""Profile
+
+Turn profiling of promus commands and hooks on or off and report the
+hot spots found in the captures.
+
+"""
+
+import sys
+import textwrap
+import promus.core.profile as prof
+
+DESC = """
+profile the promus commands and hooks executed in this account, this
+includes the ones run by your guests. The captures are written to
+~/.promus/profiles and can be aggregated by command and hook:
+
+    promus profile on
+    promus profile report
+    promus profile report update --top 30
+
+use `promus profile on --memory` to also record memory allocations
+with tracemalloc. A single process may be profiled by setting the
+environment variable PROMUS_PROFILE to cpu or memory.
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('profile', help='profile commands and hooks',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('action', type=str, metavar='ACTION',
+                      choices=['on', 'off', 'report', 'clear'],
+                      help='One of the following: on, off, report, clear')
+    tmpp.add_argument('name', type=str, nargs='?', default=None,
+                      help='report only this command or hook')
+    tmpp.add_argument('-m', '--memory', action='store_true',
+                      help='also record memory allocations')
+    tmpp.add_argument('-n', '--top', type=int, default=15,
+                      help='number of functions to display')
+    tmpp.add_argument('-s', '--sort', type=str, default='cumulative',
+                      choices=['cumulative', 'tottime', 'ncalls'],
+                      help='order of the functions')
+    tmpp.add_argument('--since', type=str, default=None,
+                      help='ignore captures before YYYYmmddHHMMSS')
+
+
+def report(arg):
+    """Display a summary of the captures of each command and hook
+    followed by the functions where the time was spent. """
+    disp = sys.stdout.write
+    found = prof.captures(arg.name, arg.since)
+    if not found:
+        disp('PROFILE>> no captures found in %s\n' % prof.profiles_path())
+        return
+    stats = dict()
+    disp('\n%-20s %6s %12s %12s\n' % ('name', 'runs', 'total (s)',
+                                      'mean (ms)'))
+    for name in sorted(found):
+        stats[name] = prof.cpu_stats(found[name])
+        if stats[name] is None:
+            continue
+        runs = len(found[name])
+        total = stats[name].total_tt
+        disp('%-20s %6d %12.3f %12.1f\n' % (name, runs, total,
+                                            total * 1e3 / runs))
+    for name in sorted(found):
+        if stats[name] is None:
+            continue
+        disp('\n==> %s (%d runs)\n' % (name, len(found[name])))
+        stats[name].stream = sys.stdout
+        stats[name].strip_dirs().sort_stats(arg.sort).print_stats(arg.top)
+        memory = prof.memory_stats(found[name], arg.top)
+        if memory:
+            disp('  memory allocated by line (all runs):\n')
+            for size, count, where in memory:
+                disp('  %10.1f KiB %8d blocks  %s\n' % (size / 1024.0,
+                                                      count, where))
+
+
+def clear(arg):
+    "Remove the captures. "
+    import os
+    removed = 0
+    for paths in prof.captures(arg.name, arg.since).values():
+        for path in paths:
+            for ext in ['.prof', '.mem']:
+                if os.path.exists(path + ext):
+                    os.remove(path + ext)
+            removed += 1
+    sys.stdout.write('PROFILE>> removed %d captures\n' % removed)
+
+
+def run(arg):
+    """Run command. """
+    if arg.action == 'on':
+        prof.enable('memory' if arg.memory else 'cpu')
+        sys.stdout.write('PROFILE>> writing captures to %s\n' %
+                         prof.profiles_path())
+    elif arg.action == 'off':
+        prof.disable()
+        sys.stdout.write('PROFILE>> disabled\n')
+    elif arg.action == 'report':
+        report(arg)
+    else:
+        clear(arg)
@@ -12,6 +12,7 @@ import textwrap
 import promus.core.ssh as ssh
 import promus.core.git as git
 import promus.core.util as util
+from promus.command import exec_cmd, error, make_dir
 
 DESC = """
 To be able to collaborate first you need to let your collaborators be
@@ -32,6 +33,15 @@ or
 
 Please note that to send an invite you must call the command from the
 repository, i.e. your current working directory must be a repository.
+Without a user every collaborator in the acl is invited. Users that
+were already invited to the repository are skipped unless `--force`
+is given.
+
+Requests may be sent to many collaborators at once by giving a file
+with one collaborator per line, either as a csv file with the columns
+email and name or as an email optionally followed by the name:
+
+    promus send request --file class.csv
 
 """
 
@@ -44,10 +54,19 @@ def add_parser(subp, raw):
     tmpp.add_argument('type', metavar='TYPE', type=str,
                       choices=['request', 'invite'],
                       help='One of the following: request, invite')
-    tmpp.add_argument('email', type=str,
+    tmpp.add_argument('email', type=str, nargs='?',
                       help="collaborators email")
     tmpp.add_argument('name', type=str, nargs='?',
                       help="collaborators name")
+    tmpp.add_argument('-f', '--file', type=str, default=None,
+                      help="csv file or list of collaborators")
+    tmpp.add_argument('-j', '--jobs', type=int, default=8,
+                      help="number of keys generated at the same time")
+    tmpp.add_argument('-u', '--user', type=str, action='append',
+                      default=[],
+                      help="only invite this user, may be repeated")
+    tmpp.add_argument('--force', action='store_true',
+                      help="invite users that were already invited")
 
 REQUEST_TXT = """Hello {name},
 
@@ -93,36 +112,253 @@ running the command verifying that the connection was successful.</p>
 </p>
 """
 
+INVITE_TXT = """Hello {name},
 
-def send_request(arg):
-    """Sends an email to request for a public key. """
-    home = os.environ['HOME']
+{master} has given you access to the repository {repo}. If you
+have not added the host yet please follow the instructions in the
+collaboration request sent by {master}. To obtain a copy of the
+repository type:
+
+    promus clone {url}
+
+- Promus
+"""
+
+INVITE_HTML = """<p>Hello {name},</p>
+<p>{master} has given you access to the repository <strong>{repo}
+</strong>. If you have not added the host yet please follow the
+instructions in the collaboration request sent by {master}. To obtain a
+copy of the repository type:</p>
+<pre><code>    promus clone {url}
+</code></pre>
+<p>
+<strong>- Promus</strong>
+</p>
+"""
+
+
+def read_recipients(fname):
+    """Return a list of tuples with the email and name of each of the
+    collaborators listed in a file. The name is None when missing. """
+    import csv
+    recipients = list()
+    with open(fname, 'r') as tmpf:
+        for row in csv.reader(tmpf):
+            row = [col.strip() for col in row if col.strip()]
+            if not row or row[0].startswith('#') or '@' not in row[0]:
+                continue
+            if len(row) == 1:
+                row = row[0].split(None, 1)
+            recipients.append((row[0], row[1] if len(row) > 1 else None))
+    return recipients
+
+
+def request_keys(recipients, jobs):
+    """Create a key for each recipient in a temporary directory. The
+    keys are generated in parallel. Returns the directory and the path
+    to the keys. """
+    from tempfile import mkdtemp
+    from multiprocessing.pool import ThreadPool
+    master = os.environ['USER']
+    host = socket.gethostname()
+    tmpdir = mkdtemp(prefix='requests-',
+                     dir='%s/.promus' % os.environ['HOME'])
+    names = list()
+    for num in range(len(recipients)):
+        # The name of the attachment is used by `promus add host`
+        os.mkdir('%s/%d' % (tmpdir, num))
+        names.append('%s/%d/%s@%s' % (tmpdir, num, master, host))
+    pool = ThreadPool(max(min(jobs, len(names)), 1))
+    try:
+        keys = pool.map(ssh.make_key, names)
+    finally:
+        pool.close()
+        pool.join()
+    return tmpdir, keys
+
+
+def send_requests(recipients, jobs=8):
+    """Send a collaboration request to each of the recipients, a list
+    of tuples with the email and the name. The keys are added to the
+    authorized keys file at once and the emails are sent through a
+    single connection to the smtp server. Returns a list with the
+    email and the error message (None if sent) of each recipient. """
+    import shutil
     host = socket.gethostname()
     master = os.environ['USER']
-    key = ssh.make_key('%s/.promus/%s@%s' % (home, master, host))
-    users, pending, unknown = ssh.read_authorized_keys()
-    key_type, ssh_key = ssh.get_public_key(key).split()
-    pending[ssh_key] = [arg.email, key_type, arg.email]
-    ssh.write_authorized_keys(users, pending, unknown)
-    if arg.name is None:
-        name = 'future collaborator'
-    else:
-        name = arg.name
     mastername = git.config('user.name')
-    util.send_mail([arg.email],
-                   'Collaboration request from %s' % mastername,
-                   REQUEST_TXT.format(name=name, masteruser=master,
-                                      master=mastername, host=host),
-                   REQUEST_HTML.format(name=name, masteruser=master,
-                                       master=mastername, host=host),
-                   [key])
-    os.remove(key)
-    sys.stdout.write('done...\n')
+    tmpdir, keys = request_keys(recipients, jobs)
+    try:
+        entries = dict()
+        for (email, _), key in zip(recipients, keys):
+            key_type, ssh_key = ssh.get_public_key(key).split()
+            entries[ssh_key] = [email, key_type, email]
+        ssh.add_pending(entries)
+        status = list()
+        failed = list()
+        with util.MailSession() as session:
+            for (email, name), key in zip(recipients, keys):
+                name = name or 'future collaborator'
+                info = dict(name=name, masteruser=master,
+                            master=mastername, host=host)
+                try:
+                    session.send([email],
+                                 'Collaboration request from %s' % mastername,
+                                 REQUEST_TXT.format(**info),
+                                 REQUEST_HTML.format(**info), [key])
+                    status.append((email, None))
+                except Exception as exc:
+                    status.append((email, str(exc) or type(exc).__name__))
+                    failed.append(ssh.get_public_key(key).split()[1])
+        if failed:
+            # Nobody will be able to use the keys that were not sent
+            with ssh.edit_authorized_keys() as (_, pending, _):
+                for ssh_key in failed:
+                    pending.pop(ssh_key, None)
+    finally:
+        shutil.rmtree(tmpdir)
+    return status
+
+
+def send_request(arg):
+    """Sends an email to request for a public key. """
+    if arg.file:
+        try:
+            recipients = read_recipients(arg.file)
+        except IOError as exc:
+            error("SEND-ERROR>> %s\n" % exc)
+    elif arg.email:
+        recipients = [(arg.email, arg.name)]
+    else:
+        error("SEND-ERROR>> provide an email or a file\n")
+    if not recipients:
+        error("SEND-ERROR>> no email addresses found\n")
+    status = send_requests(recipients, arg.jobs)
+    failed = 0
+    for email, err in status:
+        if err is None:
+            sys.stdout.write('  %s: sent\n' % email)
+        else:
+            failed += 1
+            sys.stdout.write('  %s: FAILED (%s)\n' % (email, err))
+    sys.stdout.write('done... %d sent, %d failed\n' % (len(status) - failed,
+                                                      failed))
+    if failed:
+        sys.exit(1)
+
+
+def ledger_path():
+    "Return the path to the record of the invites sent. "
+    return '%s/.promus/invites.json' % os.environ['HOME']
+
+
+def read_ledger():
+    "Return a dictionary mapping repositories to the emails invited. "
+    import json
+    try:
+        with open(ledger_path(), 'r') as tmpf:
+            return json.load(tmpf)
+    except (IOError, ValueError):
+        return dict()
+
+
+def write_ledger(ledger):
+    "Replace the record of the invites sent. "
+    import json
+    make_dir(os.path.dirname(ledger_path()))
+    tmp = '%s.%d' % (ledger_path(), os.getpid())
+    with open(tmp, 'w') as tmpf:
+        json.dump(ledger, tmpf)
+    os.rename(tmp, ledger_path())
+
+
+def hosted_repo():
+    """Return the path of the bare repository the collaborators clone,
+    either the current repository or the one it was cloned from. """
+    out, _, status = exec_cmd('git rev-parse --is-bare-repository '
+                              '--git-dir')
+    if status != 0:
+        error("SEND-ERROR>> not in a git repository\n")
+    bare, git_dir = out.split()
+    if bare == 'true':
+        return os.path.realpath(git_dir)
+    url = git.config('remote.origin.url', global_setting=False)
+    if url and os.path.isdir(url):
+        return os.path.realpath(url)
+    error("SEND-ERROR>> '%s' is not hosted in this account\n" % git_dir)
+
+
+def invitees(acl, names=None):
+    """Return a dictionary mapping the emails of the collaborators in
+    the acl to their authorized keys entry. Users in the acl may be
+    given by email or by user name. Only the users in `names` are
+    returned if given. """
+    users, _, _ = ssh.read_authorized_keys()
+    by_name = dict()
+    for email, keys in users.items():
+        for content in keys.values():
+            by_name.setdefault(content[0], set()).add(email)
+    found = dict()
+    for user in acl['admin'] + acl['user']:
+        if names and user not in names:
+            continue
+        emails = [user] if user in users else by_name.get(user, [])
+        for email in emails:
+            found[email] = list(users[email].values())[0]
+    return found
 
 
 def send_invite(arg):
     """Sends instructions on how to connect to a repository. """
-    pass
+    acl = git.read_acl()
+    if isinstance(acl, str):
+        error("SEND-ERROR>> %s\n" % acl)
+    repo = hosted_repo()
+    names = set(arg.user)
+    if arg.email:
+        names.add(arg.email)
+    found = invitees(acl, names)
+    for name in names:
+        if name not in found and \
+                not any(entry[0] == name for entry in found.values()):
+            sys.stdout.write('  %s: not a collaborator\n' % name)
+    ledger = read_ledger()
+    invited = set(ledger.get(repo, []))
+    pending = sorted(email for email in found
+                     if arg.force or email not in invited)
+    host = socket.gethostname()
+    master = os.environ['USER']
+    mastername = git.config('user.name')
+    path = repo
+    if path.startswith(os.environ['HOME'] + '/'):
+        path = path[len(os.environ['HOME']) + 1:]
+    failed = 0
+    with util.MailSession() as session:
+        for email in pending:
+            user, name = found[email][0], found[email][1]
+            info = dict(name=name or user, user=user, master=mastername,
+                        repo=os.path.basename(repo)[:-4],
+                        url='%s-%s:%s' % (master, host, path))
+            try:
+                session.send([email],
+                             'Invitation to %s' % info['repo'],
+                             INVITE_TXT.format(**info),
+                             INVITE_HTML.format(**info))
+            except Exception as exc:
+                failed += 1
+                sys.stdout.write('  %s: FAILED (%s)\n' %
+                                 (email, str(exc) or type(exc).__name__))
+                continue
+            invited.add(email)
+            sys.stdout.write('  %s: sent\n' % email)
+    if len(invited) > len(ledger.get(repo, [])):
+        ledger[repo] = sorted(invited)
+        write_ledger(ledger)
+    sys.stdout.write('done... %d sent, %d failed, %d already invited\n' %
+                     (len(pending) - failed, failed,
+                      len(found) - len(pending)))
+    if failed:
+        sys.exit(1)
 
 
 def run(arg):
@@ -24,14 +24,20 @@ password. Note however, that if you entered something other than the
 email provided by your server (i.e. gmail, hotmail, yahoo) then you
 must enter your password.
 
+the password is encrypted with a key that stays decrypted in memory
+for a few minutes after it is used, use the option --forget to remove
+it right away.
+
 """
 
 
 def add_parser(subp, raw):
     "Add a parser to the main subparser. "
-    subp.add_parser('setup', help='git configuration wizard',
-                    formatter_class=raw,
-                    description=textwrap.dedent(DESC))
+    tmpp = subp.add_parser('setup', help='git configuration wizard',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('--forget', action='store_true',
+                      help='only remove the decrypted keys kept in memory')
 
 
 def configure_git(prompt, entry, default=''):
@@ -43,8 +49,11 @@ def configure_git(prompt, entry, default=''):
     return prc.config(entry, val)
 
 
-def run(_):
+def run(arg):
     """Run command. """
+    if arg.forget:
+        prc.forget_keys()
+        return
     prc.check_promus_dependencies()
     prc.config('host.name', socket.gethostname())
     configure_git("Full name", 'user.name')
@@ -54,12 +63,11 @@ def run(_):
     id_key, _ = prc.get_keys()
     password = getpass.getpass()
     prc.make_dir('%s/.promus' % os.environ['HOME'])
-    passfile = '%s/.promus/password.pass' % os.environ['HOME']
     if password != '':
-        prc.encrypt_to_file(password, passfile, id_key)
+        prc.store_secret('password', password, id_key)
     else:
-        if not os.path.exists(passfile):
-            prc.encrypt_to_file('', passfile, id_key)
+        if prc.load_secret('password', id_key) is None:
+            prc.store_secret('password', '', id_key)
     host_email = email.split(':')[0]
     [username, server] = email.split('@')
     prc.config('host.email', host_email)
@@ -39,10 +39,10 @@ def show_keys():
     alias = git.config('host.alias')
     id_key, git_key = ssh.get_keys()
     id_key = ssh.get_public_key(id_key)
-    display('# ID_RSA:\n')
+    display('# ID_RSA: %s\n' % ssh.fingerprint(id_key))
     display('%s %s@%s - %s\n' % (id_key, master, host, alias))
     git_key = ssh.get_public_key(git_key)
-    display('# GIT_KEY:\n')
+    display('# GIT_KEY: %s\n' % ssh.fingerprint(git_key))
     display('%s %s@%s - %s - git\n' % (git_key, master, host, alias))
 
 
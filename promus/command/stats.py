@@ -0,0 +1,78 @@
+"""Stats
+
+Report the latency of the phases recorded in the metrics file.
+
+"""
+
+import sys
+import textwrap
+from promus.command import error
+import promus.core.metrics as metrics
+
+DESC = """
+display the number of calls and the 50th, 95th and 99th percentiles
+of the time spent in each of the phases recorded by promus (greeting a
+guest, reading the acl, checking files, sending emails, running
+subprocesses, ...). The time window is given as a date or as a span
+of time such as 30m, 12h or 7d:
+
+    promus stats --since 7d
+    promus stats --since 2015-03-01 --until 2015-03-08 --by repo
+
+the timings are read from ~/.promus/metrics.log and metrics.log.1.
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('stats', help='latency report',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('-s', '--since', type=str, default=None,
+                      help='ignore timings before this time')
+    tmpp.add_argument('-u', '--until', type=str, default=None,
+                      help='ignore timings after this time')
+    tmpp.add_argument('-b', '--by', type=str, default=None,
+                      choices=['repo', 'guest'],
+                      help='report each repository or guest separately')
+    tmpp.add_argument('-p', '--phase', type=str, default=None,
+                      help='report only phases starting with PHASE')
+    tmpp.add_argument('-r', '--repo', type=str, default=None,
+                      help='only timings of this repository')
+    tmpp.add_argument('-g', '--guest', type=str, default=None,
+                      help='only timings of this guest')
+
+
+def select(arg):
+    "Yield the records matching the options. "
+    try:
+        since = metrics.parse_time(arg.since) if arg.since else None
+        until = metrics.parse_time(arg.until) if arg.until else None
+    except (ValueError, OverflowError):
+        error("STATS-ERROR>> invalid time: '%s'\n" %
+              (arg.since if arg.until is None else arg.until))
+    for rec in metrics.read_records(since, until):
+        if arg.phase and not rec[1].startswith(arg.phase):
+            continue
+        if arg.repo and rec[3] != arg.repo:
+            continue
+        if arg.guest and rec[4] != arg.guest:
+            continue
+        yield rec
+
+
+def run(arg):
+    """Run command. """
+    summary = metrics.summarize(select(arg), arg.by)
+    disp = sys.stdout.write
+    if not summary:
+        disp('STATS>> no timings found in %s\n' % metrics.metrics_path())
+        return
+    fmt = '%-16s %-16s %8s %10s %10s %10s %10s\n'
+    disp(fmt % ('phase', arg.by or '', 'count', 'p50 ms', 'p95 ms',
+                'p99 ms', 'max ms'))
+    for (phase, key), values in sorted(summary.items()):
+        count, p50, p95, p99, top = values
+        disp(fmt % (phase, key if arg.by else '', count, '%.1f' % p50,
+                    '%.1f' % p95, '%.1f' % p99, '%.1f' % top))
@@ -0,0 +1,123 @@
+"""Tex
+
+Utilities for LaTeX documents kept in a repository.
+
+"""
+
+import sys
+import textwrap
+from promus.command import error
+from promus.core import tex
+
+DESC = """
+generate the differences between versions of a LaTeX document. A
+revision is given as the number of commits to go back (0 is the last
+commit) or as C for the file you are currently editing. For instance
+
+    promus tex diff doc 1 3 5
+
+compares the current draft of doc.tex against 1, 3 and 5 commits ago.
+Use A:B to compare two specific revisions and --last N to compare the
+current draft against each of the last N commits. The diffs are
+written to doc-diff-A-B.tex and are generated in parallel.
+
+the build action compiles the document only when one of the files it
+includes (or its bibliography) changed since the last build. bibtex
+and extra compiler passes only run when they are needed. With the
+option --watch the document is rebuilt every time a file changes.
+
+    promus tex build doc --watch
+
+"""
+
+
+def add_parser(subp, raw):
+    "Add a parser to the main subparser. "
+    tmpp = subp.add_parser('tex', help='LaTeX utilities',
+                           formatter_class=raw,
+                           description=textwrap.dedent(DESC))
+    tmpp.add_argument('action', type=str, metavar='ACTION',
+                      choices=['diff', 'build'],
+                      help='One of the following: diff, build')
+    tmpp.add_argument('texfile', type=str,
+                      help='the main tex file')
+    tmpp.add_argument('revs', type=str, nargs='*',
+                      help='revisions to compare (REV or OLD:NEW)')
+    tmpp.add_argument('-n', '--last', type=int, default=0,
+                      help='compare against each of the last N commits')
+    tmpp.add_argument('-j', '--jobs', type=int, default=None,
+                      help='number of latexdiff processes')
+    tmpp.add_argument('-c', '--compiler', type=str, default='pdflatex',
+                      help='the tex compiler (build only)')
+    tmpp.add_argument('-f', '--force', action='store_true',
+                      help='compile even if nothing changed (build only)')
+    tmpp.add_argument('-w', '--watch', action='store_true',
+                      help='rebuild when a file changes (build only)')
+
+
+def parse_pairs(revs, last):
+    "Return the list of revision pairs to compare. "
+    pairs = list()
+    for rev in revs:
+        tmp = rev.split(':')
+        if len(tmp) == 1:
+            pairs.append((tmp[0], 'C'))
+        elif len(tmp) == 2:
+            pairs.append((tmp[0], tmp[1]))
+        else:
+            error("TEX-ERROR>> invalid revision: '%s'\n" % rev)
+    for num in range(last):
+        pairs.append((str(num), 'C'))
+    if not pairs:
+        pairs.append(('0', 'C'))
+    return sorted(set(pairs), key=pairs.index)
+
+
+def tex_file(arg):
+    "Return the name of the main tex file without the extension. "
+    if arg.texfile.endswith('.tex'):
+        return arg.texfile[:-4]
+    return arg.texfile
+
+
+def diff(arg):
+    """Generate the diffs for all the pairs of revisions. """
+    texfile = tex_file(arg)
+    pairs = parse_pairs(arg.revs, arg.last)
+    failed = False
+    for output, status, err in tex.diff_revisions(texfile, pairs, arg.jobs):
+        if status == 0:
+            sys.stdout.write('TEX>> %s\n' % output)
+        else:
+            failed = True
+            sys.stderr.write('TEX-ERROR>> %s: %s\n' % (output, err.strip()))
+    if failed:
+        sys.exit(1)
+
+
+def build(arg):
+    """Compile the document if needed. """
+    texfile = tex_file(arg)
+    if arg.watch:
+        try:
+            tex.watch(texfile, arg.compiler)
+        except KeyboardInterrupt:
+            return
+    try:
+        passes = tex.build(texfile, arg.compiler, arg.force)
+    except RuntimeError as exc:
+        error('TEX-ERROR>> %s\n' % exc)
+    if passes:
+        sys.stdout.write('TEX>> %s.pdf built (%d passes)\n' % (texfile,
+                                                              passes))
+    else:
+        sys.stdout.write('TEX>> %s.pdf is up to date\n' % texfile)
+
+
+def run(arg):
+    """Run command. """
+    func = {
+        'diff': diff,
+        'build': build,
+    }
+    func[arg.action](arg)
@@ -9,51 +9,95 @@ import re
 import os
 import sys
 import socket
-from promus.command import exec_cmd, date
-from promus.core.ssh import (
-    make_key,
-    get_keys,
-    get_public_key,
-    read_config,
-    write_config,
-    read_authorized_keys,
-    write_authorized_keys,
-)
-from promus.core.git import (
-    config,
-    describe,
-    repo_name,
-    local_path,
-    remote_path,
-    make_hook,
-    init,
-    parse_dir,
-    parse_acl,
-    check_acl,
-    read_acl,
-    parse_profile,
-    check_profile,
-    read_profile,
-    file_in_path,
-    has_access,
-    file_match,
-    clone,
-)
-from promus.core.util import (
-    is_exe,
-    external_executables,
-    check_promus_dependencies,
-    user_input,
-    encrypt_to_file,
-    decrypt_from_file,
-    wrap_msg,
-    make_dir,
-    parse_list,
-    tokenizer,
-    merge_lines,
-    strip,
-    send_mail,
-)
+from importlib import import_module
+from promus.command import exec_cmd, date, make_dir
+
+# Names provided by the submodules. They are imported the first time
+# they are requested so that `import promus.core` stays cheap.
+_EXPORTS = {
+    'make_key': 'ssh',
+    'get_keys': 'ssh',
+    'get_public_key': 'ssh',
+    'fingerprint': 'ssh',
+    'read_config': 'ssh',
+    'write_config': 'ssh',
+    'control_persist': 'ssh',
+    'multiplex': 'ssh',
+    'warm': 'ssh',
+    'read_authorized_keys': 'ssh',
+    'write_authorized_keys': 'ssh',
+    'edit_authorized_keys': 'ssh',
+    'add_pending': 'ssh',
+    'BARE_HOOKS': 'git',
+    'CLIENT_HOOKS': 'git',
+    'BlobReader': 'git',
+    'object_ids': 'git',
+    'staged_files': 'git',
+    'config': 'git',
+    'describe': 'git',
+    'repo_name': 'git',
+    'local_path': 'git',
+    'remote_path': 'git',
+    'make_hook': 'git',
+    'is_noop_hook': 'git',
+    'make_shared_hooks': 'git',
+    'shared_hooks_path': 'git',
+    'use_shared_hooks': 'git',
+    'init': 'git',
+    'init_many': 'git',
+    'make_template': 'git',
+    'parse_dir': 'git',
+    'parse_acl': 'git',
+    'check_acl': 'git',
+    'read_acl': 'git',
+    'parse_profile': 'git',
+    'check_profile': 'git',
+    'read_profile': 'git',
+    'file_in_path': 'git',
+    'has_access': 'git',
+    'file_match': 'git',
+    'clone': 'git',
+    'store_secret': 'cred',
+    'load_secret': 'cred',
+    'forget_keys': 'cred',
+    'is_exe': 'util',
+    'external_executables': 'util',
+    'check_promus_dependencies': 'util',
+    'user_input': 'util',
+    'encrypt_to_file': 'util',
+    'decrypt_from_file': 'util',
+    'wrap_msg': 'util',
+    'parse_list': 'util',
+    'tokenizer': 'util',
+    'merge_lines': 'util',
+    'strip': 'util',
+    'send_mail': 'util',
+    'mail_message': 'util',
+    'MailSession': 'util',
+}
+
+
+def __getattr__(name):
+    "Import the submodule providing `name` on first access. "
+    try:
+        module = _EXPORTS[name]
+    except KeyError:
+        raise AttributeError("module 'promus.core' has no attribute "
+                             "'%s'" % name)
+    value = getattr(import_module('promus.core.%s' % module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    "List the names available in the module. "
+    return sorted(set(globals()) | set(_EXPORTS))
+
+
+# Module level `__getattr__` is only supported since python 3.7
+if sys.version_info < (3, 7):
+    for _name in _EXPORTS:
+        __getattr__(_name)
 
 
 # pylint: disable=R0902
@@ -61,13 +105,12 @@ class Promus(object):
     "An instance of this object manages the commands issued over ssh. "
 
     def __init__(self):
-        # Host information
+        # Host information, the entries from the git configuration
+        # are only read when they are needed (see `_get_config`).
         self.host = socket.gethostname()
-        self.alias = config('host.alias')
         self.home = os.environ['HOME']
         self.master = os.environ['USER']
-        self.master_name = config('user.name')
-        self.master_email = config('user.email')
+        self._config = dict()
 
         # Guest information
         self.guest = None
@@ -77,17 +120,36 @@ class Promus(object):
         self.cmd = None
         self.cmd_token = None
         self.cmd_name = None
+        self.admission = None
 
-        # Setting up log file
+        # The log file is opened on the first call to `log`
         self.path = '%s/.promus' % self.home
-        make_dir(self.path)
-        self.log_file = open('%s/promus.log' % self.path, 'a')
+        self._log_file = None
 
         # Setting up functions based on command name
         self._exec = dict()
         self._exec['git-receive-pack'] = exec_git
         self._exec['git-upload-pack'] = exec_git
 
+    def _get_config(self, entry):
+        "Return a global git configuration entry, reading it only once. "
+        if entry not in self._config:
+            from promus.core.git import config
+            self._config[entry] = config(entry)
+        return self._config[entry]
+
+    alias = property(lambda self: self._get_config('host.alias'))
+    master_name = property(lambda self: self._get_config('user.name'))
+    master_email = property(lambda self: self._get_config('user.email'))
+
+    @property
+    def log_file(self):
+        "The log file, opened in append mode on first access. "
+        if self._log_file is None:
+            make_dir(self.path)
+            self._log_file = open('%s/promus.log' % self.path, 'a')
+        return self._log_file
+
     def log(self, msg):
         "Write a message to the log file. "
         sys.stderr.write("[PROMUS]: %s\n" % msg)
@@ -131,6 +193,34 @@ class Promus(object):
          self.guest_alias, self.cmd] = info.split('\n')
         self.cmd_token = self.cmd.split()
         self.cmd_name = self.cmd_token[0]
+        self._set_metrics_context()
+
+    def admit(self):
+        """Wait for a free slot before running a git command, see
+        `promus.core.admission`. The slots are held until the process
+        exits. Guests are only admitted once they passed the acl check
+        of the repository so that they never take a slot they cannot
+        use. """
+        if self.cmd_name not in self._exec:
+            return
+        from promus.core.admission import Admission
+        from promus.core.metrics import record
+        repo = self.cmd_token[1] if len(self.cmd_token) > 1 else None
+        self.admission = Admission()
+        waited = self.admission.acquire(self.cmd_name, self.guest, repo)
+        if waited is None:
+            msg = "ADMISSION-ERROR>> server busy, waited %.0f seconds"
+            self.dismiss(msg % self.admission.limits['timeout'], 1)
+        record('queue', waited * 1e3)
+        self.log("ADMISSION>> admitted after %.3f seconds" % waited)
+
+    def _set_metrics_context(self):
+        "Attach the guest and the repository to the timings. "
+        from promus.core.metrics import set_context
+        repo = None
+        if len(self.cmd_token) > 1:
+            repo = self.cmd_token[1].strip("'\"")
+        set_context(repo, self.guest)
 
     def _get_cmd(self):
         "Check to see if a command was given. Exit if it is not present. "
@@ -144,14 +234,18 @@ class Promus(object):
             self.dismiss(msg, 1)
         self.cmd_token = self.cmd.split()
         self.cmd_name = self.cmd_token[0]
+        self._set_metrics_context()
 
     def greet(self, info):
         "Handle the guest request. "
-        [self.guest_email, self.guest,
-         self.guest_name, self.guest_alias] = info.split(',')
-        self.log("GREET>> Connected as %s" % self.guest_email)
-        self._get_cmd()
+        from promus.core.metrics import timer
+        with timer('greet'):
+            [self.guest_email, self.guest,
+             self.guest_name, self.guest_alias] = info.split(',')
+            self.log("GREET>> Connected as %s" % self.guest_email)
+            self._get_cmd()
         if self.guest_email == self.master_email:
+            self.admit()
             self.exec_cmd(self.cmd, True)
         else:
             self.execute(self.cmd_name)
@@ -166,12 +260,14 @@ def deny(prs):
 
 def exec_git(prs):
     """Executes a git command. """
+    from promus.core.git import read_acl
     git_dir = os.path.expanduser(prs.cmd_token[1][1:-1])
     acl = read_acl(git_dir)
     if isinstance(acl, str):
         msg = "EXEC_GIT-ERROR>> acl error: %s" % acl
         prs.dismiss(msg, 1)
     if prs.guest in acl['user']:  # acl['user'] contains acl['admin']
+        prs.admit()
         prs.exec_cmd(prs.cmd, True)
     else:
         msg = "EXEC_GIT-ERROR>> not in acl for `%s`" % git_dir
@@ -0,0 +1,155 @@
+"""Access index
+
+Reverse index of the acls of all the repositories: for each user name
+the repositories in which it appears and with which roles. The roles
+are `admin`, `user`, `rsync` and the `path` and `name` rules, i.e.
+`path:docs/:deny`. The index is kept in `~/.promus/access.json` and
+is built from the inventory (see `promus.core.inventory`) so that only
+the repositories that changed are read again. The post-receive hook
+updates it when an `.acl` is pushed.
+
+"""
+
+import os
+import json
+import promus.core.inventory as inv
+from promus.command import make_dir
+from promus.core.git import has_access
+
+
+def index_path():
+    "Return the path to the access index. "
+    return '%s/.promus/access.json' % os.environ['HOME']
+
+
+def rule_roles(kind, rules):
+    """Return a dictionary mapping user names to their roles in the
+    `path` or `name` rules of an acl. A rule is given as a list of
+    patterns followed by a list of users, the mode of each user is the
+    one given by `promus.core.git.has_access`: `listed` when the rule
+    has no keyword, `allow` or `deny` otherwise. """
+    modes = {None: 'listed', True: 'allow', False: 'deny'}
+    roles = dict()
+    for patterns, users in zip(rules[0::2], rules[1::2]):
+        for user in users:
+            if user.startswith('!'):
+                continue
+            mode = modes[has_access(user, users)]
+            for pattern in patterns:
+                roles.setdefault(user, []).append('%s:%s:%s' %
+                                                  (kind, pattern, mode))
+    return roles
+
+
+def acl_roles(acl):
+    """Return a dictionary mapping user names to their roles in an
+    acl, see `promus.core.inventory`. """
+    roles = dict()
+    if acl is None:
+        return roles
+    for user in acl['admin']:
+        roles.setdefault(user, []).append('admin')
+    for user in acl['user']:
+        if user not in acl['admin']:
+            roles.setdefault(user, []).append('user')
+    for user in acl['rsync']:
+        roles.setdefault(user, []).append('rsync')
+    for kind in ['path', 'name']:
+        for user, rules in rule_roles(kind, acl[kind]).items():
+            roles.setdefault(user, []).extend(rules)
+    return roles
+
+
+def read_index():
+    "Return the cached index. "
+    try:
+        with open(index_path(), 'r') as tmpf:
+            return json.load(tmpf)
+    except (IOError, ValueError):
+        return {'root': None, 'repos': {}, 'users': {}, 'stamps': {}}
+
+
+def write_index(index):
+    "Replace the cached index. "
+    make_dir(os.path.dirname(index_path()))
+    tmp = '%s.%d' % (index_path(), os.getpid())
+    with open(tmp, 'w') as tmpf:
+        json.dump(index, tmpf)
+    os.rename(tmp, index_path())
+
+
+def _forget(index, repo):
+    "Remove a repository from the index. "
+    for user in index['repos'].pop(repo, {}):
+        repos = index['users'].get(user, {})
+        repos.pop(repo, None)
+        if not repos:
+            index['users'].pop(user, None)
+
+
+def _add(index, repo, entry):
+    "Add the roles in the acl of an inventory entry to the index. "
+    roles = acl_roles(entry['acl'])
+    index['stamps'][repo] = entry['stamp']
+    index['repos'][repo] = roles
+    for user, user_roles in roles.items():
+        index['users'].setdefault(user, {})[repo] = user_roles
+
+
+def refresh(root=None, force=False):
+    """Return the index of the repositories in `root` after refreshing
+    the inventory. Only the repositories whose inventory entry changed
+    since they were indexed are indexed again. """
+    inventory, _ = inv.refresh(root, force)
+    index = read_index()
+    if index['root'] != inventory['root'] or force:
+        index = {'root': inventory['root'], 'repos': {}, 'users': {},
+                 'stamps': {}}
+    repos = inventory['repos']
+    changed = [repo for repo in repos
+               if index['stamps'].get(repo) != repos[repo]['stamp']]
+    removed = [repo for repo in index['repos'] if repo not in repos]
+    for repo in removed:
+        _forget(index, repo)
+        index['stamps'].pop(repo, None)
+    for repo in changed:
+        _forget(index, repo)
+        _add(index, repo, repos[repo])
+    if changed or removed or not os.path.exists(index_path()):
+        write_index(index)
+    return index
+
+
+def update_repo(repo):
+    """Index the acl of a repository again, used after an `.acl` has
+    been pushed. Repositories not in the inventory are left for the
+    next refresh. """
+    repo = os.path.realpath(repo)
+    entry = inv.update_repo(repo)
+    if entry is None:
+        return
+    index = read_index()
+    _forget(index, repo)
+    _add(index, repo, entry)
+    write_index(index)
+
+
+def user_names(user):
+    """Return the user names of a guest. An email address is mapped to
+    the user names of its keys in the authorized_keys file. """
+    if '@' not in user:
+        return set([user])
+    from promus.core.ssh import read_authorized_keys
+    users, _, _ = read_authorized_keys()
+    return set(content[0] for content in users.get(user, {}).values())
+
+
+def access(names, root=None):
+    """Return a dictionary mapping the repositories the users can
+    reach to their roles. """
+    index = refresh(root)
+    found = dict()
+    for name in names:
+        for repo, roles in index['users'].get(name, {}).items():
+            found.setdefault(repo, []).extend(roles)
+    return found
@@ -0,0 +1,139 @@
+"""Admission control
+
+Limit the number of git commands running at the same time for all
+guests, for each guest and for each repository. A command needs a
+free slot in each of the three scopes. A slot is a file in
+`~/.promus/slots` locked with `flock`, the lock is released by the
+kernel when the process holding it exits so that slots are never
+leaked. `git-receive-pack` may use all the global slots while
+`git-upload-pack` leaves some of them free, this way pushes are not
+stuck behind a burst of fetches.
+
+The limits are read from the global git configuration:
+
+    admission.global    slots for all guests (default: 4 per cpu)
+    admission.guest     slots for each guest (default: 0, unlimited)
+    admission.repo      slots for each repository (default: 0)
+    admission.reserved  global slots only for receive-pack (default:
+                        a quarter of the global slots)
+    admission.timeout   seconds to wait for a slot (default: 60)
+
+"""
+
+import os
+import re
+import time
+import fcntl
+from promus.command import exec_cmd, make_dir
+
+RE_SCOPE = re.compile(r'[^\w.@-]')
+PRIORITY = ['git-receive-pack']
+
+
+def slots_path():
+    "Return the directory holding the slot files. "
+    return '%s/.promus/slots' % os.environ['HOME']
+
+
+def read_limits():
+    "Return the limits, read with a single call to git. "
+    # os.cpu_count avoids importing multiprocessing, missing in python 2
+    cpus = getattr(os, 'cpu_count', lambda: None)()
+    if cpus is None:
+        import multiprocessing
+        try:
+            cpus = multiprocessing.cpu_count()
+        except NotImplementedError:
+            cpus = 1
+    limits = {'global': 4 * cpus, 'guest': 0, 'repo': 0,
+              'reserved': None, 'timeout': 60.0}
+    out, _, _ = exec_cmd("git config --global --get-regexp '^admission\\.'")
+    for line in out.splitlines():
+        try:
+            key, val = line.split(None, 1)
+            key = key.split('.', 1)[1].lower()
+            if key in limits:
+                limits[key] = float(val) if key == 'timeout' else int(val)
+        except ValueError:
+            continue
+    if limits['reserved'] is None:
+        limits['reserved'] = limits['global'] // 4
+    return limits
+
+
+class Admission(object):
+    "Slots held by this process. "
+
+    def __init__(self, limits=None):
+        self.limits = read_limits() if limits is None else limits
+        self.held = list()
+
+    def scopes(self, cmd_name, guest, repo):
+        """Return the scopes and the range of slots the command may
+        take in each one of them. """
+        scopes = list()
+        total = self.limits['global']
+        if total > 0:
+            last = total
+            if cmd_name not in PRIORITY:
+                last = max(total - self.limits['reserved'], 1)
+            scopes.append(('global', last))
+        if self.limits['guest'] > 0 and guest:
+            scopes.append(('guest-%s' % guest, self.limits['guest']))
+        if self.limits['repo'] > 0 and repo:
+            repo = os.path.basename(repo.strip('\'"').rstrip('/'))
+            if repo.endswith('.git'):
+                repo = repo[:-4]
+            scopes.append(('repo-%s' % repo, self.limits['repo']))
+        return [(RE_SCOPE.sub('_', name), last) for name, last in scopes]
+
+    def _take(self, scope, last):
+        "Lock one of the first `last` slots of the scope. "
+        for num in range(last):
+            path = '%s/%s.%d' % (slots_path(), scope, num)
+            slot = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                os.close(slot)
+                continue
+            return slot
+        return None
+
+    def try_acquire(self, scopes):
+        "Take a slot in each scope or none at all. "
+        taken = list()
+        for scope, last in scopes:
+            slot = self._take(scope, last)
+            if slot is None:
+                for fd in taken:
+                    os.close(fd)
+                return False
+            taken.append(slot)
+        self.held.extend(taken)
+        return True
+
+    def acquire(self, cmd_name, guest=None, repo=None):
+        """Wait for the slots needed to run the command. Returns the
+        time waited in seconds or None if no slot was freed in time.
+        """
+        scopes = self.scopes(cmd_name, guest, repo)
+        if not scopes:
+            return 0.0
+        make_dir(slots_path())
+        start = time.time()
+        deadline = start + self.limits['timeout']
+        delay = 0.01
+        while not self.try_acquire(scopes):
+            if time.time() >= deadline:
+                return None
+            # Fetches back off for longer so that pushes get in first
+            time.sleep(delay if cmd_name in PRIORITY else 2 * delay)
+            delay = min(2 * delay, 0.25)
+        return time.time() - start
+
+    def release(self):
+        "Free the slots. "
+        for slot in self.held:
+            os.close(slot)
+        self.held = list()
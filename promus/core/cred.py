@@ -0,0 +1,217 @@
+"""Credential store
+
+Secrets such as the smtp password are encrypted with AES using a
+random data key. The data key is encrypted once with the RSA key of
+the account (`~/.ssh/id_rsa`) and, once decrypted, it is kept for a
+short time in a file only readable by the user in a memory backed
+directory. This way sending many emails does not require an RSA
+private key operation for each one of them.
+
+"""
+
+import os
+import hmac
+import errno
+import time
+import hashlib
+import binascii
+from os.path import exists
+from promus.command import make_dir
+
+MAGIC = b'PROMUS-CRED-1'
+CACHE_TTL = 900
+
+
+def store_path():
+    "Return the directory where the encrypted credentials are kept. "
+    path = '%s/.promus/credentials' % os.environ['HOME']
+    if make_dir(path):
+        os.chmod(path, 0o700)
+    return path
+
+
+def cache_path():
+    """Return the private directory where the decrypted data key is
+    cached. It uses `$XDG_RUNTIME_DIR` or `/dev/shm` when available so
+    that the key never reaches the disk. """
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if not base or not os.path.isdir(base):
+        base = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    path = '%s/promus-%d' % (base, os.getuid())
+    if not exists(path):
+        os.mkdir(path, 0o700)
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise OSError("insecure credential cache: '%s'" % path)
+    return path
+
+
+def load_rsa_key(keyfile):
+    """Return the `rsa.PrivateKey` stored in `keyfile`. Keys in the
+    OpenSSH format are converted with the `cryptography` package. """
+    import rsa
+    with open(keyfile, 'rb') as keyfp:
+        keydata = keyfp.read()
+    try:
+        return rsa.PrivateKey.load_pkcs1(keydata)
+    except ValueError:
+        from cryptography.hazmat.primitives import serialization as ser
+        key = ser.load_ssh_private_key(keydata, None)
+        keydata = key.private_bytes(ser.Encoding.PEM,
+                                    ser.PrivateFormat.TraditionalOpenSSL,
+                                    ser.NoEncryption())
+        return rsa.PrivateKey.load_pkcs1(keydata)
+
+
+def read_cached_key(name, ttl):
+    "Return the data key from the cache or None if it expired. "
+    path = '%s/%s' % (cache_path(), name)
+    try:
+        if time.time() - os.stat(path).st_mtime > ttl:
+            os.remove(path)
+            return None
+        with open(path, 'rb') as keyfp:
+            return keyfp.read()
+    except (IOError, OSError):
+        return None
+
+
+def prune_cache(ttl):
+    "Remove the data keys cached for longer than `ttl` seconds. "
+    path = cache_path()
+    now = time.time()
+    for name in os.listdir(path):
+        if not name.startswith('datakey-'):
+            continue
+        try:
+            if now - os.stat('%s/%s' % (path, name)).st_mtime > ttl:
+                os.remove('%s/%s' % (path, name))
+        except OSError:
+            continue
+
+
+def write_cached_key(name, key, ttl=CACHE_TTL):
+    "Store the data key in the cache, removing the expired ones. "
+    prune_cache(ttl)
+    path = '%s/%s' % (cache_path(), name)
+    tmp = '%s.%d' % (path, os.getpid())
+    keyfd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(keyfd, 'wb') as keyfp:
+        keyfp.write(key)
+    os.rename(tmp, path)
+
+
+def unwrap_key(wrapped, keyfile, ttl):
+    "Return the data key encrypted in `wrapped`, caching it. "
+    import rsa
+    name = 'datakey-%s' % hashlib.sha1(wrapped).hexdigest()[:16]
+    key = read_cached_key(name, ttl)
+    if key is None:
+        key = rsa.decrypt(wrapped, load_rsa_key(keyfile))
+        write_cached_key(name, key, ttl)
+    return key
+
+
+def data_key(keyfile, ttl=CACHE_TTL):
+    """Return the key used to encrypt the credentials. It is created
+    the first time and stored encrypted with the RSA key in `keyfile`.
+    The decrypted key is cached for `ttl` seconds. """
+    import rsa
+    path = '%s/datakey.rsa' % store_path()
+    try:
+        with open(path, 'rb') as keyfp:
+            wrapped = keyfp.read()
+    except IOError:
+        wrapped = None
+    if wrapped is not None:
+        return unwrap_key(wrapped, keyfile, ttl)
+    key = os.urandom(32)
+    private = load_rsa_key(keyfile)
+    wrapped = rsa.encrypt(key, rsa.PublicKey(private.n, private.e))
+    # Write to a temporary file and link it so that the file is never
+    # partially written and only the first of two processes wins.
+    tmp = '%s.%d' % (path, os.getpid())
+    keyfd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(keyfd, 'wb') as keyfp:
+        keyfp.write(wrapped)
+    try:
+        os.link(tmp, path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+        with open(path, 'rb') as keyfp:
+            wrapped = keyfp.read()
+        return unwrap_key(wrapped, keyfile, ttl)
+    finally:
+        os.remove(tmp)
+    write_cached_key('datakey-%s' % hashlib.sha1(wrapped).hexdigest()[:16],
+                     key, ttl)
+    return key
+
+
+def _subkeys(key):
+    "Derive the encryption and authentication keys from the data key. "
+    enc = hmac.new(key, b'promus-encrypt', hashlib.sha256).digest()
+    mac = hmac.new(key, b'promus-authenticate', hashlib.sha256).digest()
+    return enc, mac
+
+
+def _cipher(key, nonce):
+    "Return an AES cipher in counter mode. "
+    from Crypto.Cipher import AES
+    from Crypto.Util import Counter
+    counter = Counter.new(128, initial_value=int(binascii.hexlify(nonce), 16))
+    return AES.new(key, AES.MODE_CTR, counter=counter)
+
+
+def encrypt(secret, key):
+    "Encrypt and authenticate a string with the data key. "
+    enc, mac = _subkeys(key)
+    nonce = os.urandom(16)
+    data = _cipher(enc, nonce).encrypt(secret.encode('utf-8'))
+    tag = hmac.new(mac, MAGIC + nonce + data, hashlib.sha256).digest()
+    return MAGIC + nonce + data + tag
+
+
+def decrypt(blob, key):
+    """Decrypt a string encrypted by `encrypt`. Raises ValueError if
+    the data has been modified or was encrypted with another key. """
+    if not blob.startswith(MAGIC) or len(blob) < len(MAGIC) + 48:
+        raise ValueError("not a promus credential")
+    enc, mac = _subkeys(key)
+    nonce = blob[len(MAGIC):len(MAGIC) + 16]
+    data = blob[len(MAGIC) + 16:-32]
+    tag = hmac.new(mac, blob[:-32], hashlib.sha256).digest()
+    if not hmac.compare_digest(tag, blob[-32:]):
+        raise ValueError("credential authentication failed")
+    return _cipher(enc, nonce).decrypt(data).decode('utf-8')
+
+
+def store_secret(name, secret, keyfile):
+    "Encrypt a secret and store it under the given name. "
+    blob = encrypt(secret, data_key(keyfile))
+    path = '%s/%s.cred' % (store_path(), name)
+    credfd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(credfd, 'wb') as credfp:
+        credfp.write(blob)
+
+
+def load_secret(name, keyfile):
+    "Return a stored secret or None if there is no such secret. "
+    try:
+        with open('%s/%s.cred' % (store_path(), name), 'rb') as credfp:
+            blob = credfp.read()
+    except IOError:
+        return None
+    return decrypt(blob, data_key(keyfile))
+
+
+def forget_keys():
+    "Remove the cached data keys. "
+    try:
+        path = cache_path()
+    except OSError:
+        return
+    for name in os.listdir(path):
+        if name.startswith('datakey-'):
+            os.remove('%s/%s' % (path, name))
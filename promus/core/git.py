@@ -2,9 +2,12 @@
 from __future__ import print_function
 import os
 import sys
+import stat
+from subprocess import Popen, PIPE
 from os.path import dirname, exists, split, basename
 from fnmatch import fnmatch
-from promus.command import exec_cmd, error
+from promus.command import exec_cmd, error, import_mod
+from promus.core.metrics import timer
 PC = sys.modules['promus.core']
 
 
@@ -52,10 +55,82 @@ def remote_path():
     return PC.strip(out)
 
 
-def init(repo, directory=None):
+BARE_HOOKS = ['post-receive', 'update']
+CLIENT_HOOKS = ['commit-msg', 'post-checkout', 'post-commit', 'post-merge',
+                'pre-commit', 'pre-rebase', 'prepare-commit-msg']
+
+
+class BlobReader(object):
+    """Read objects from a repository through a single `git cat-file
+    --batch` process instead of forking `git show` for each of them.
+    The objects may be given by any name git understands, i.e.
+    `HEAD:.acl`, `:.acl` (the index) or a sha. """
+
+    def __init__(self, git_dir=None):
+        self.proc = Popen(['git', 'cat-file', '--batch'], cwd=git_dir,
+                          stdin=PIPE, stdout=PIPE)
+
+    def read(self, name):
+        """Return the sha and the contents of the object. Both are
+        None if the object does not exist. """
+        self.proc.stdin.write(('%s\n' % name).encode('utf-8'))
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().decode('utf-8').split()
+        if len(header) != 3 or header[-1] == 'missing':
+            return None, None
+        content = self.proc.stdout.read(int(header[2]) + 1)[:-1]
+        return header[0], content.decode('utf-8', 'replace')
+
+    def close(self):
+        "Terminate the `git cat-file` process. "
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+
+def object_ids(names, git_dir=None):
+    """Return the sha of each of the objects with a single call to
+    `git cat-file --batch-check`. The sha is None for missing objects. """
+    if not names:
+        return []
+    proc = Popen(['git', 'cat-file', '--batch-check'], cwd=git_dir,
+                 stdin=PIPE, stdout=PIPE)
+    data = ''.join(['%s\n' % name for name in names]).encode('utf-8')
+    out, _ = proc.communicate(data)
+    shas = list()
+    for line in out.decode('utf-8').split('\n')[:len(names)]:
+        tmp = line.split()
+        if len(tmp) != 3 or tmp[-1] == 'missing':
+            shas.append(None)
+        else:
+            shas.append(tmp[0])
+    return shas
+
+
+def staged_files(git_dir=None):
+    """Return a list of tuples with the path and the sha of the staged
+    version of each file that differs from HEAD. The sha is None for
+    deleted files. It uses a single `git diff-index -z` call. """
+    out, _, status = exec_cmd('%sgit diff-index --cached -z HEAD' %
+                              ('cd %s; ' % git_dir if git_dir else ''))
+    if status != 0:
+        return []
+    files = list()
+    tokens = out.split('\0')
+    for meta, path in zip(tokens[0::2], tokens[1::2]):
+        sha = meta.split()[3]
+        files.append((path, None if sha.strip('0') == '' else sha))
+    return files
+
+
+def init(repo, directory=None, template=None, hooks_path=None):
     """Create a bare git repository and create the `post-receive` and
     `update` hook. You may have to modify these two hooks depending
-    on how you want to treat the repository. """
+    on how you want to treat the repository. When `template` is given
+    it must be a directory created by `make_template`, in which case
+    the hooks are copied by `git init` instead of being rendered. If
+    `hooks_path` is given the repository uses the shared hooks in
+    that directory (see `make_shared_hooks`). """
     if not repo.endswith('.git'):
         repo += '.git'
     if directory is None:
@@ -64,39 +139,161 @@ def init(repo, directory=None):
     fullpath = '%s/%s' % (directory, repo)
     if os.path.exists(fullpath):
         error("INIT-ERROR>> Existing repository: '%s'\n" % fullpath)
-    exec_cmd("git init --bare %s" % fullpath, True)
-    hooks = ['post-receive', 'update']
-    for hook in hooks:
-        path = '%s/hooks' % fullpath
-        make_hook(hook, path)
+    if template is None and hooks_path is None:
+        exec_cmd("git init --bare %s" % fullpath, True)
+        for hook in BARE_HOOKS:
+            make_hook(hook, '%s/hooks' % fullpath)
+    else:
+        cmd = "git init -q --bare"
+        if template is not None:
+            cmd += " --template=%s" % template
+        exec_cmd("%s %s" % (cmd, fullpath), True)
+    if hooks_path is not None:
+        use_shared_hooks(fullpath, hooks_path)
     sys.stdout.write("INIT>> '%s' was created...\n" % fullpath)
+    return fullpath
+
+
+def make_template(path, hooks=None):
+    """Create a directory to be used with `git init --template`. The
+    directory only contains the rendered hooks, by default the ones
+    used in bare repositories. """
+    if hooks is None:
+        hooks = BARE_HOOKS
+    hook_dir = '%s/hooks' % path
+    PC.make_dir(hook_dir)
+    for hook in hooks:
+        make_hook(hook, hook_dir)
+    return path
+
+
+def init_many(repos, directory=None, hooks_path=None):
+    """Create several bare repositories sharing a single template.
+    Existing repositories are skipped with a warning instead of
+    terminating the program. Returns the list of created paths. """
+    from shutil import rmtree
+    from tempfile import mkdtemp
+    if directory is None:
+        directory = '%s/git' % os.environ['HOME']
+    created = list()
+    hooks = None if hooks_path is None else []
+    template = make_template(mkdtemp(prefix='promus-template-'), hooks)
+    try:
+        for repo in repos:
+            name = repo if repo.endswith('.git') else repo + '.git'
+            if exists('%s/%s' % (directory, name)):
+                sys.stderr.write("INIT-WARNING>> Existing repository: "
+                                 "'%s/%s'\n" % (directory, name))
+                continue
+            created.append(init(repo, directory, template, hooks_path))
+    finally:
+        rmtree(template)
+    return created
 
 
 HOOK_TEMPLATE = '''#!/usr/bin/env python
 """{hook} hook generated on {date}"""
 import promus.core as prc
 import promus.hooks.{hookpy} as hook
+from promus.core.profile import profile_call
 
 if __name__ == "__main__":
     PRS = prc.Promus()
-    hook.run(PRS)
+    profile_call('{hook}', hook.run, PRS)
     PRS.dismiss("{hook}>> done...", 0)
 
 '''
 
 
+def render_hook(hook):
+    "Return the contents of the script for the specified hook. "
+    hookpy = hook.replace('-', '_')
+    return HOOK_TEMPLATE.format(hook=hook, hookpy=hookpy, date=PC.date())
+
+
+def is_noop_hook(hook):
+    """Return True if the hook module is marked with `NOOP = True`, its
+    `run` function does nothing so there is no need to install the
+    hook and start python every time git calls it. """
+    module = import_mod('promus.hooks.%s' % hook.replace('-', '_'))
+    return getattr(module, 'NOOP', False)
+
+
 def make_hook(hook, path):
-    "Creates the specified hook. "
+    """Creates the specified hook and returns True. Hooks that do
+    nothing are not created, in which case it returns False. An
+    existing hook is kept as a timestamped backup. """
     hook_file = "%s/%s" % (path, hook)
     if exists(hook_file):
-        cmd = "mv %s %s.%s" % (hook_file, hook_file, PC.date(True))
-        exec_cmd(cmd, True)
-    hookpy = hook.replace('-', '_')
-    content = HOOK_TEMPLATE.format(hook=hook, hookpy=hookpy,
-                                   date=PC.date())
+        os.rename(hook_file, "%s.%s" % (hook_file, PC.date(True)))
+    if is_noop_hook(hook):
+        return False
     with open(hook_file, 'w') as hookfp:
-        hookfp.write(content)
-    exec_cmd('chmod +x %s' % hook_file, True)
+        hookfp.write(render_hook(hook))
+    mode = os.stat(hook_file).st_mode
+    os.chmod(hook_file, mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return True
+
+
+DISPATCHER_TEMPLATE = '''#!/usr/bin/env python
+"""promus hook dispatcher generated on {date}"""
+import os
+import sys
+import promus.core as prc
+from promus.command import import_mod
+from promus.core.profile import profile_call
+
+if __name__ == "__main__":
+    HOOK = os.path.basename(sys.argv[0])
+    hook = import_mod('promus.hooks.%s' % HOOK.replace('-', '_'))
+    PRS = prc.Promus()
+    profile_call(HOOK, hook.run, PRS)
+    PRS.dismiss("%s>> done..." % HOOK, 0)
+
+'''
+DISPATCHER = 'promus-hook'
+
+
+def shared_hooks_path():
+    "Return the path to the directory holding the shared hooks. "
+    return '%s/.promus/hooks' % os.environ['HOME']
+
+
+def make_shared_hooks(path=None):
+    """Create the shared hooks directory. It contains a single
+    dispatcher script and one symbolic link to it for each hook, the
+    dispatcher runs the `promus.hooks` module named after the link.
+    Hooks that do nothing are not linked. The dispatcher is replaced
+    atomically so that upgrading every repository using it only
+    requires calling this function again. """
+    if path is None:
+        path = shared_hooks_path()
+    PC.make_dir(path)
+    dispatcher = '%s/%s' % (path, DISPATCHER)
+    with open('%s.tmp' % dispatcher, 'w') as hookfp:
+        hookfp.write(DISPATCHER_TEMPLATE.format(date=PC.date()))
+    os.chmod('%s.tmp' % dispatcher, 0o755)
+    os.rename('%s.tmp' % dispatcher, dispatcher)
+    for hook in CLIENT_HOOKS + BARE_HOOKS:
+        link = '%s/%s' % (path, hook)
+        noop = is_noop_hook(hook)
+        if os.path.islink(link):
+            if noop:
+                os.remove(link)
+            continue
+        if exists(link):
+            os.rename(link, "%s.%s" % (link, PC.date(True)))
+        if not noop:
+            os.symlink(DISPATCHER, link)
+    return path
+
+
+def use_shared_hooks(repo_dir, path=None):
+    """Set `core.hooksPath` in the repository located at `repo_dir`
+    so that git runs the shared hooks. """
+    if path is None:
+        path = shared_hooks_path()
+    exec_cmd('cd %s; git config core.hooksPath %s' % (repo_dir, path), True)
 
 
 def parse_dir(string):
@@ -169,10 +366,11 @@ def read_acl(git_dir=None):
         cmd = 'cd %s; git show HEAD:.acl' % git_dir
     else:
         cmd = 'git show HEAD:.acl'
-    aclfile, err, _ = exec_cmd(cmd, False)
-    if err:
-        return "while executing `git show HEAD:.acl`: %s" % err[:-1]
-    return parse_acl(aclfile)
+    with timer('acl'):
+        aclfile, err, _ = exec_cmd(cmd, False)
+        if err:
+            return "while executing `git show HEAD:.acl`: %s" % err[:-1]
+        return parse_acl(aclfile)
 
 
 def parse_profile(profilestring):
@@ -232,11 +430,12 @@ def read_profile(user, git_dir=None):
         cmd = 'cd %s; git show HEAD:.%s.profile' % (git_dir, user)
     else:
         cmd = 'git show HEAD:.%s.profile' % user
-    profile, err, _ = exec_cmd(cmd, False)
-    if err:
-        return "while executing `git show HEAD:.%s.profile`: %s" % (user,
-                                                                    err[:-1])
-    return parse_profile(profile)
+    with timer('profile'):
+        profile, err, _ = exec_cmd(cmd, False)
+        if err:
+            return "while executing `git show HEAD:.%s.profile`: %s" % \
+                (user, err[:-1])
+        return parse_profile(profile)
 
 
 def file_in_path(file_name, paths):
@@ -278,8 +477,9 @@ def file_match(file_name, names):
     return False
 
 
-def clone(repo):
-    "Clone a repository. "
+def clone(repo, shared=False):
+    """Clone a repository. Set `shared` to True to use the shared
+    hooks instead of writing the hooks in the repository. """
     out, err, stat = exec_cmd("git clone %s" % repo)
     sys.stdout.write(out)
     if stat != 0:
@@ -290,15 +490,15 @@ def clone(repo):
         tmp = split(repo)
     repo = tmp[1].split('.')[0]
     if not exists("%s/.acl" % repo):
-        admin_setup(repo)
+        admin_setup(repo, shared)
     else:
-        user_setup(repo)
+        user_setup(repo, shared)
     if os.uname()[0] == 'Darwin':
         exec_cmd('open -a /Applications/GitHub.app "%s"' % repo, True)
     sys.stderr.write("CLONE>> Repository '%s' has been cloned ...\n" % repo)
 
 
-def admin_setup(repo):
+def admin_setup(repo, shared=False):
     "Set the acl list and create the hooks. "
     print("Setting up empty repository...")
     print("creating README.md")
@@ -330,21 +530,14 @@ def admin_setup(repo):
     with open('%s/.bashrc' % repo, 'w') as tmpf:
         tmpf.write('# Bash commands related to %s\n' % repo)
 
-    print("creating hooks:")
-    hooks = ['commit-msg', 'post-checkout', 'post-commit', 'post-merge',
-             'pre-commit', 'pre-rebase',
-             'prepare-commit-msg']
-    for hook in hooks:
-        print("  %s" % hook)
-        path = '%s/.git/hooks' % repo
-        make_hook(hook, path)
+    make_client_hooks(repo, shared)
 
     print("copying .gitignore\n")
     tmp = dirname(__file__)
     exec_cmd('cp %s/../paster/gitignore.txt %s/.gitignore' % (tmp, repo), True)
 
 
-def user_setup(repo):
+def user_setup(repo, shared=False):
     "Create the user profile"
     print("Setting up repository...")
     print("linking .description...")
@@ -363,10 +556,18 @@ def user_setup(repo):
             tmpf.write('notify: all\n')
             tmpf.write('track-files: \n')
 
+    make_client_hooks(repo, shared)
+
+
+def make_client_hooks(repo, shared=False):
+    "Create the hooks in a cloned repository. "
+    if shared:
+        print("using shared hooks in %s" % shared_hooks_path())
+        use_shared_hooks(repo, make_shared_hooks())
+        return
     print("creating hooks:")
-    hooks = ['commit-msg', 'post-checkout', 'post-commit', 'post-merge',
-             'pre-commit', 'pre-rebase', 'prepare-commit-msg']
-    for hook in hooks:
-        print("  %s" % hook)
-        path = '%s/.git/hooks' % repo
-        make_hook(hook, path)
+    for hook in CLIENT_HOOKS:
+        if make_hook(hook, '%s/.git/hooks' % repo):
+            print("  %s" % hook)
+        else:
+            print("  %s (skipped, it does nothing)" % hook)
@@ -0,0 +1,154 @@
+"""Inventory
+
+Summary of the repositories served by this account, cached in
+`~/.promus/inventory.json`. The entry of a repository is only
+recomputed when the modification times of its refs, `HEAD`,
+`description` or packs change, so that refreshing the inventory of
+thousands of repositories only takes a few `stat` calls for each one
+of them.
+
+The acl of an entry is None when it cannot be read, the reason is
+given by `acl_error`.
+
+"""
+
+import os
+import sys
+import json
+import time
+from promus.command import make_dir
+from promus.core.maintenance import find_repos, mtime
+PC = sys.modules['promus.core']
+
+DEFAULT_DESCRIPTION = 'Unnamed repository;'
+STAMP_FILES = ['HEAD', 'packed-refs', 'refs/heads', 'refs/tags',
+               'description', 'objects/pack']
+# Increased when the entries change, older inventories are rebuilt
+VERSION = 2
+
+
+def inventory_path():
+    "Return the path to the inventory cache. "
+    return '%s/.promus/inventory.json' % os.environ['HOME']
+
+
+def repos_path():
+    "Return the default directory holding the repositories. "
+    return '%s/git' % os.environ['HOME']
+
+
+def stamp(repo):
+    "Return the modification times identifying the state of a repo. "
+    return [mtime('%s/%s' % (repo, fname)) for fname in STAMP_FILES]
+
+
+def disk_usage(path):
+    "Return the number of bytes used by the files in a directory. "
+    total = 0
+    for root, _, fnames in os.walk(path):
+        for fname in fnames:
+            try:
+                total += os.lstat(os.path.join(root, fname)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def read_description(repo):
+    "Return the description of the repository. "
+    try:
+        with open('%s/description' % repo, 'r') as tmpf:
+            text = tmpf.read().strip()
+    except IOError:
+        return ''
+    if text.startswith(DEFAULT_DESCRIPTION):
+        return ''
+    return text
+
+
+def scan(repo):
+    """Return the inventory entry of a repository. The acl is read
+    from `HEAD` through a single `git cat-file` process. """
+    entry = {
+        'stamp': stamp(repo),
+        'size': disk_usage(repo),
+        'last_push': max(mtime('%s/packed-refs' % repo),
+                         mtime('%s/refs/heads' % repo)),
+        'description': read_description(repo),
+    }
+    reader = PC.BlobReader(repo)
+    try:
+        entry['head'], _ = reader.read('HEAD')
+        _, content = reader.read('HEAD:.acl')
+    finally:
+        reader.close()
+    acl = "`HEAD:.acl` not found"
+    if content is not None:
+        acl = PC.parse_acl(content)
+    # Kept apart since json gives back the error as `unicode` in
+    # python 2, which does not pass `isinstance(acl, str)`.
+    if isinstance(acl, dict):
+        entry['acl'], entry['acl_error'] = acl, None
+    else:
+        entry['acl'], entry['acl_error'] = None, acl
+    return entry
+
+
+def read_inventory():
+    "Return the cached inventory. "
+    try:
+        with open(inventory_path(), 'r') as tmpf:
+            return json.load(tmpf)
+    except (IOError, ValueError):
+        return {'version': VERSION, 'root': None, 'repos': {}}
+
+
+def write_inventory(inventory):
+    "Replace the cached inventory. "
+    make_dir(os.path.dirname(inventory_path()))
+    tmp = '%s.%d' % (inventory_path(), os.getpid())
+    with open(tmp, 'w') as tmpf:
+        json.dump(inventory, tmpf)
+    os.rename(tmp, inventory_path())
+
+
+def refresh(root=None, force=False):
+    """Return the inventory of the repositories in `root`, scanning
+    only the ones that changed since the last refresh. Also returns
+    the paths of the repositories that were scanned, removed or added.
+    """
+    if root is None:
+        root = repos_path()
+    root = os.path.realpath(root)
+    inventory = read_inventory()
+    if inventory['root'] != root or force or \
+            inventory.get('version') != VERSION:
+        inventory = {'version': VERSION, 'root': root, 'repos': {}}
+    old = inventory['repos']
+    repos = dict()
+    changed = list()
+    for repo in find_repos(root):
+        entry = old.get(repo)
+        if entry is None or entry['stamp'] != stamp(repo):
+            entry = scan(repo)
+            changed.append(repo)
+        repos[repo] = entry
+    removed = [repo for repo in old if repo not in repos]
+    inventory['repos'] = repos
+    if changed or removed or not os.path.exists(inventory_path()):
+        inventory['updated'] = time.time()
+        write_inventory(inventory)
+    return inventory, changed + removed
+
+
+def update_repo(repo):
+    """Rescan a single repository, i.e. from a hook, if it is in the
+    inventory. Returns the new entry or None. """
+    repo = os.path.realpath(repo)
+    inventory = read_inventory()
+    if repo not in inventory['repos']:
+        return None
+    entry = scan(repo)
+    inventory['repos'][repo] = entry
+    write_inventory(inventory)
+    return entry
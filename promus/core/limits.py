@@ -0,0 +1,109 @@
+"""Push limits
+
+Reject pushes bringing objects that would make the repository slow to
+clone. The limits are read from the configuration of the repository:
+
+    limits.maxblobsize   largest file that may be pushed
+    limits.maxpushsize   largest total size, on disk, of the objects
+                         brought by the push to a single ref
+    limits.exempt        patterns of the paths not subject to
+                         `maxblobsize`, may be given several times
+
+Sizes are in bytes and accept the `k`, `m` and `g` suffixes. No limit
+is enforced when they are not set or set to 0. For instance:
+
+    git config limits.maxblobsize 10m
+    git config --add limits.exempt 'data/*.csv'
+
+The new objects are listed by a single `git rev-list --objects` piped
+into `git cat-file --batch-check`, so that only the object headers are
+read.
+
+"""
+
+from fnmatch import fnmatch
+from subprocess import Popen, PIPE
+from promus.command import exec_cmd
+
+NULL_REV = '0' * 40
+UNITS = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+BATCH_FORMAT = '%(objecttype) %(objectsize) %(objectsize:disk) %(rest)'
+
+
+def parse_size(val):
+    "Return the number of bytes of a size such as `512k` or `10m`. "
+    val = val.strip().lower()
+    if val and val[-1] in UNITS:
+        return int(float(val[:-1]) * UNITS[val[-1]])
+    return int(val)
+
+
+def format_size(size):
+    "Return a size in bytes as a short string. "
+    if size < 1024:
+        return '%d B' % size
+    for unit in ['KB', 'MB', 'GB']:
+        size /= 1024.0
+        if size < 1024 or unit == 'GB':
+            return '%.1f %s' % (size, unit)
+
+
+def read_limits():
+    "Return the limits of the repository, read with one call to git. "
+    limits = {'maxblobsize': 0, 'maxpushsize': 0, 'exempt': []}
+    out, _, _ = exec_cmd("git config --get-regexp '^limits\\.'")
+    for line in out.splitlines():
+        try:
+            key, val = line.split(None, 1)
+        except ValueError:
+            continue
+        key = key.split('.', 1)[1].lower()
+        if key == 'exempt':
+            limits['exempt'].extend(val.replace(',', ' ').split())
+        elif key in limits:
+            try:
+                limits[key] = parse_size(val)
+            except ValueError:
+                continue
+    return limits
+
+
+def new_objects(newrev):
+    """Yield the type, size, size on disk and path (empty for commits)
+    of the objects reachable from `newrev` that are not in any ref. """
+    revs = Popen(['git', 'rev-list', '--objects', newrev, '--not',
+                  '--all'], stdout=PIPE)
+    check = Popen(['git', 'cat-file', '--batch-check=%s' % BATCH_FORMAT],
+                  stdin=revs.stdout, stdout=PIPE, universal_newlines=True)
+    revs.stdout.close()
+    try:
+        for line in check.stdout:
+            fields = line.rstrip('\n').split(' ', 3)
+            if len(fields) < 3 or fields[1] == 'missing':
+                continue
+            path = fields[3] if len(fields) > 3 else ''
+            yield fields[0], int(fields[1]), int(fields[2]), path
+    finally:
+        check.stdout.close()
+        check.wait()
+        revs.wait()
+
+
+def violations(newrev, limits):
+    """Return the paths and sizes of the blobs over the limit and the
+    total size of the push if it is over the limit, None otherwise. """
+    large = list()
+    total = 0
+    if newrev == NULL_REV:
+        return large, None
+    max_blob = limits['maxblobsize']
+    for kind, size, disk_size, path in new_objects(newrev):
+        total += disk_size
+        if kind != 'blob' or not max_blob or size <= max_blob:
+            continue
+        if any(fnmatch(path, pattern) for pattern in limits['exempt']):
+            continue
+        large.append((path, size))
+    if limits['maxpushsize'] and total > limits['maxpushsize']:
+        return large, total
+    return large, None
@@ -0,0 +1,255 @@
+"""Log index
+
+The promus log (`~/.promus/promus.log`) is only ever appended to. To
+search it without reading all of it we keep a sidecar index with one
+fixed width record per log entry:
+
+    offset, time, guest, command, repository, latest
+
+The guest, command and repository are numbers referring to the names
+stored in `promus.log.meta` along with the size of the log that has
+been indexed. Updating the index only reads what was appended since.
+The meta also keeps the inode of the log and a hash of its first line,
+the index is rebuilt when the log shrank or one of them changed.
+Log entries do not mention the command and repository they belong to,
+these are taken from the last `EXEC>>` entry of the same guest.
+
+Each process writes its entries when it is done, so the entries of
+processes running at the same time are not in time order. `latest` is
+the largest time of the entries up to and including the record, it
+never decreases and it is what the searches by time bisect.
+
+"""
+
+import os
+import re
+import json
+import hashlib
+import fcntl
+import time
+import struct
+from bisect import bisect_left
+
+RECORD = struct.Struct('<QIIIII')
+VERSION = 3
+RE_ENTRY = re.compile(r'^\[(?P<date>[\d-]{19}):~ (?P<guest>.*?)\]\$ '
+                      r'(?P<msg>.*)$')
+RE_EXEC = re.compile(r"^EXEC>> (?P<cmd>\S+)(\s+'?(?P<repo>[^'\s]*)'?)?")
+NONE = '-'
+
+
+def log_path():
+    "Return the path to the promus log. "
+    return '%s/.promus/promus.log' % os.environ['HOME']
+
+
+def index_path():
+    "Return the path to the index file. "
+    return '%s.idx' % log_path()
+
+
+def meta_path():
+    "Return the path to the names and state of the index. "
+    return '%s.meta' % log_path()
+
+
+def entry_time(date):
+    "Return the epoch time of a date written by `promus.command.date`. "
+    return int(time.mktime(time.strptime(date, '%Y-%m-%d-%H-%M-%S')))
+
+
+def repo_name(path):
+    "Return the name of a repository given its path. "
+    name = os.path.basename(path.rstrip('/'))
+    return name[:-4] if name.endswith('.git') else name
+
+
+def read_meta():
+    "Return the state of the index, a new one if there is none. "
+    try:
+        with open(meta_path(), 'r') as tmpf:
+            return json.load(tmpf)
+    except (IOError, ValueError):
+        return new_meta()
+
+
+def new_meta():
+    "Return the state of an empty index. "
+    return {'version': VERSION, 'offset': 0, 'latest': 0,
+            'inode': None, 'head': None, 'names': [NONE], 'sessions': {}}
+
+
+def log_head(logf):
+    "Return a hash of the first line of the log. "
+    logf.seek(0)
+    return hashlib.sha1(logf.readline()).hexdigest()
+
+
+def is_replaced(meta, logf, size):
+    """Return True if the indexed part of the log is no longer the
+    start of the log given by `logf`. """
+    if not meta['offset']:
+        return False
+    if size < meta['offset']:
+        return True
+    if meta.get('inode') != os.fstat(logf.fileno()).st_ino:
+        return True
+    return meta.get('head') != log_head(logf)
+
+
+def write_meta(meta):
+    "Replace the state of the index. "
+    tmp = '%s.%d' % (meta_path(), os.getpid())
+    with open(tmp, 'w') as tmpf:
+        json.dump(meta, tmpf)
+    os.rename(tmp, meta_path())
+
+
+def update_index():
+    """Index the entries appended to the log since the last update and
+    return the state of the index. The index is rebuilt if the log
+    was truncated or replaced, see `is_replaced`. """
+    try:
+        logf = open(log_path(), 'rb')
+    except IOError:
+        return read_meta()
+    with logf, open('%s.lock' % index_path(), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return _update_index(logf)
+
+
+def _update_index(logf):
+    "Index the log opened as `logf`, see `update_index`. "
+    meta = read_meta()
+    size = os.fstat(logf.fileno()).st_size
+    if meta.get('version') != VERSION or \
+            not os.path.exists(index_path()) or \
+            is_replaced(meta, logf, size):
+        meta = new_meta()
+        open(index_path(), 'wb').close()
+    if size == meta['offset']:
+        return meta
+    names = meta['names']
+    ids = dict((name, num) for num, name in enumerate(names))
+    sessions = meta['sessions']
+
+    def name_id(name):
+        "Return the number of a name, adding it if necessary. "
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    records = list()
+    offset = meta['offset']
+    latest = meta['latest']
+    logf.seek(offset)
+    for line in logf:
+        if not line.endswith(b'\n'):
+            break  # an entry that is still being written
+        start = offset
+        offset += len(line)
+        match = RE_ENTRY.match(line.decode('utf-8', 'replace'))
+        if not match:
+            continue  # continuation of a multi-line entry
+        guest = match.group('guest')
+        msg = match.group('msg')
+        if msg.startswith('GREET>> Connected'):
+            sessions[guest] = [NONE, NONE]
+        exe = RE_EXEC.match(msg)
+        if exe:
+            repo = exe.group('repo')
+            sessions[guest] = [exe.group('cmd'),
+                               repo_name(repo) if repo else NONE]
+        cmd, repo = sessions.get(guest, [NONE, NONE])
+        try:
+            stamp = entry_time(match.group('date'))
+        except ValueError:
+            continue
+        latest = max(latest, stamp)
+        records.append(RECORD.pack(start, stamp, name_id(guest),
+                                   name_id(cmd), name_id(repo), latest))
+    with open(index_path(), 'ab') as idxf:
+        idxf.write(b''.join(records))
+    meta['offset'] = offset
+    meta['latest'] = latest
+    if offset and meta['head'] is None:
+        meta['inode'] = os.fstat(logf.fileno()).st_ino
+        meta['head'] = log_head(logf)
+    write_meta(meta)
+    return meta
+
+
+class Index(object):
+    "Random access to the records of the index file. "
+
+    def __init__(self, idxf):
+        self.idxf = idxf
+        idxf.seek(0, os.SEEK_END)
+        self.size = idxf.tell() // RECORD.size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, num):
+        "Return the latest time up to the entry, for binary searches. "
+        return self.record(num)[5]
+
+    def record(self, num):
+        "Return the record `num`. "
+        self.idxf.seek(num * RECORD.size)
+        return RECORD.unpack(self.idxf.read(RECORD.size))
+
+    def records(self, start, chunk=4096):
+        "Yield the records from `start` to the end. "
+        self.idxf.seek(start * RECORD.size)
+        while True:
+            data = self.idxf.read(chunk * RECORD.size)
+            if not data:
+                return
+            for num in range(len(data) // RECORD.size):
+                yield RECORD.unpack_from(data, num * RECORD.size)
+
+
+def search(guest=None, cmd=None, repo=None, since=None, until=None):
+    """Yield the log entries matching the given guest, command,
+    repository and time range. Entries span multiple lines when the
+    logged message did. """
+    meta = update_index()
+    ids = dict((name, num) for num, name in enumerate(meta['names']))
+    wanted = list()
+    for pos, name in [(2, guest), (3, cmd), (4, repo)]:
+        if name is not None:
+            if name not in ids:
+                return
+            wanted.append((pos, ids[name]))
+    try:
+        idxf = open(index_path(), 'rb')
+    except IOError:
+        return
+    with idxf, open(log_path(), 'rb') as logf:
+        index = Index(idxf)
+        start = 0
+        if since is not None:
+            # Every entry before `start` is older than `since`
+            start = bisect_left(index, since)
+        for rec in index.records(start):
+            if since is not None and rec[1] < since:
+                continue
+            if until is not None and rec[1] > until:
+                continue
+            if any(rec[pos] != num for pos, num in wanted):
+                continue
+            yield read_entry(logf, rec[0])
+
+
+def read_entry(logf, offset):
+    "Return the log entry starting at `offset`. "
+    logf.seek(offset)
+    lines = [logf.readline()]
+    while True:
+        line = logf.readline()
+        if not line or RE_ENTRY.match(line.decode('utf-8', 'replace')):
+            break
+        lines.append(line)
+    return b''.join(lines).decode('utf-8', 'replace')
@@ -0,0 +1,148 @@
+"""Maintenance
+
+Keep the hosted bare repositories fast to fetch from and push to:
+consolidate the packs created by each push, write the commit-graph
+and reachability bitmaps and remove loose objects that are already
+packed. Repositories are maintained in order of activity since their
+last maintenance, recorded by the mtime of `promus-maintained` in the
+repository.
+
+"""
+
+import os
+import re
+import sys
+import time
+from promus.command import exec_cmd
+PC = sys.modules['promus.core']
+
+MARKER = 'promus-maintained'
+RE_VERSION = re.compile(r'(\d+)\.(\d+)')
+
+
+def find_repos(root):
+    "Return the paths of the bare repositories under `root`. "
+    repos = list()
+    for path, dirs, _ in os.walk(root):
+        if path.endswith('.git') and os.path.exists('%s/HEAD' % path) \
+                and os.path.isdir('%s/objects' % path):
+            repos.append(path)
+            del dirs[:]
+    return sorted(repos)
+
+
+def mtime(path, default=0):
+    "Return the modification time of a path. "
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return default
+
+
+def activity(repo):
+    """Return a score measuring the work waiting in the repository:
+    the packs added and an estimate of the loose objects written since
+    the last maintenance. Like `git gc --auto`, the loose objects are
+    estimated from a single object directory. """
+    since = mtime('%s/%s' % (repo, MARKER))
+    packs = 0
+    try:
+        for fname in os.listdir('%s/objects/pack' % repo):
+            if fname.endswith('.pack') and \
+                    mtime('%s/objects/pack/%s' % (repo, fname)) > since:
+                packs += 1
+    except OSError:
+        pass
+    try:
+        loose = len(os.listdir('%s/objects/17' % repo)) * 256
+    except OSError:
+        loose = 0
+    refs = max(mtime('%s/packed-refs' % repo),
+               mtime('%s/refs/heads' % repo))
+    if since == 0:
+        return packs + loose / 100.0 + 1
+    if refs <= since and not packs:
+        return 0
+    return packs + loose / 100.0 + (1 if refs > since else 0)
+
+
+def prioritize(repos, include_idle=False):
+    "Return the repositories and their score, busiest first. "
+    scored = [(activity(repo), repo) for repo in repos]
+    if not include_idle:
+        scored = [item for item in scored if item[0] > 0]
+    return [(repo, score) for score, repo in
+            sorted(scored, key=lambda item: -item[0])]
+
+
+def git_version():
+    "Return the version of git as a tuple of two integers. "
+    out, _, _ = exec_cmd('git --version')
+    match = RE_VERSION.search(out)
+    if match is None:
+        return (0, 0)
+    return (int(match.group(1)), int(match.group(2)))
+
+
+def niceness():
+    "Return the prefix that runs commands with low cpu and io priority. "
+    missing, _ = PC.external_executables(['nice', 'ionice'])
+    prefix = ''
+    if 'nice' not in missing:
+        prefix += 'nice -n 19 '
+    if 'ionice' not in missing:
+        prefix += 'ionice -c 3 '
+    return prefix
+
+
+def maintenance_steps(version):
+    "Return the git commands to run in each repository. "
+    if version >= (2, 34):
+        # Roll the small packs into larger ones, a multi-pack index
+        # lets the bitmap cover all of them.
+        repack = 'git repack -d -l -q --geometric=2 --write-midx ' \
+                 '--write-bitmap-index'
+    else:
+        repack = 'git repack -A -d -l -q -b'
+    steps = [repack]
+    if version >= (2, 24):
+        steps.append('git commit-graph write --reachable --split')
+    steps.append('git prune-packed -q')
+    steps.append('git prune --expire=2.weeks.ago')
+    return steps
+
+
+def maintain(repo, steps, prefix=''):
+    """Run the maintenance steps in a repository. Returns the elapsed
+    time and the errors of the steps that failed. """
+    start = time.time()
+    errors = list()
+    for step in steps:
+        _, err, status = exec_cmd('cd %s; %s%s' % (repo, prefix, step))
+        if status != 0:
+            errors.append('%s: %s' % (step, err.strip()))
+    if not errors:
+        with open('%s/%s' % (repo, MARKER), 'w') as tmpf:
+            tmpf.write('%s\n' % time.strftime('%Y-%m-%d %H:%M:%S'))
+    return time.time() - start, errors
+
+
+def crontab_line(schedule, args=''):
+    "Return the crontab entry running the maintenance. "
+    return '%s %s -m promus maintain %s# promus-maintain\n' % (
+        schedule, sys.executable, args)
+
+
+def schedule(spec, args=''):
+    """Install a crontab entry running `promus maintain` with the
+    given cron schedule (i.e. `0 3 * * *`), replacing the previous
+    one. An empty `spec` removes the entry. """
+    current, _, _ = exec_cmd('crontab -l')
+    lines = [line for line in current.splitlines(True)
+             if not line.rstrip().endswith('# promus-maintain')]
+    if spec:
+        lines.append(crontab_line(spec, args))
+    from subprocess import Popen, PIPE
+    proc = Popen(['crontab', '-'], stdin=PIPE, universal_newlines=True)
+    proc.communicate(''.join(lines))
+    return proc.returncode
@@ -0,0 +1,183 @@
+"""Metrics
+
+Durations of the phases of a request (greeting a guest, reading the
+acl, walking the pushed revisions, sending emails, running
+subprocesses...) are appended to `~/.promus/metrics.log`, one record
+per line:
+
+    <epoch> <phase> <milliseconds> <repo> <guest>
+
+Set the environment variable `PROMUS_STATSD` to `host:port` to also
+send each timing to a statsd daemon over UDP, or `PROMUS_METRICS` to
+`off` to disable the metrics. Once the file grows past `MAX_SIZE`
+bytes it is renamed to `metrics.log.1`, replacing the previous one, so
+that at most twice that space is used.
+
+"""
+
+import os
+import re
+import math
+import time
+from contextlib import contextmanager
+
+# The repository and guest the timings of this process belong to,
+# see `set_context`.
+CONTEXT = {'repo': '-', 'guest': '-'}
+_OUTPUT = {'file': None, 'statsd': None}
+RE_SPAN = re.compile(r'^(?P<num>\d+(\.\d*)?)(?P<unit>[smhdw])$')
+SPAN = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+MAX_SIZE = 8 << 20
+
+
+def metrics_path():
+    "Return the path to the metrics file. "
+    return '%s/.promus/metrics.log' % os.environ['HOME']
+
+
+def enabled():
+    "Return False if the metrics have been disabled. "
+    return os.environ.get('PROMUS_METRICS', 'on').lower() not in \
+        ['off', '0', 'false']
+
+
+def set_context(repo=None, guest=None):
+    "Set the repository or guest attached to the next records. "
+    if repo:
+        repo = os.path.basename(repo.rstrip('/'))
+        if repo.endswith('.git'):
+            repo = repo[:-4]
+        CONTEXT['repo'] = repo.replace(' ', '_')
+    if guest:
+        CONTEXT['guest'] = guest.replace(' ', '_')
+
+
+def _metrics_file():
+    "Open the metrics file the first time it is needed. "
+    if _OUTPUT['file'] is None:
+        path = metrics_path()
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # Unbuffered appends so that each record is a single write
+        metfd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                        0o600)
+        info = os.fstat(metfd)
+        if info.st_size > MAX_SIZE:
+            # Only rotate if another process has not done it already
+            if os.stat(path).st_ino == info.st_ino:
+                os.rename(path, '%s.1' % path)
+            os.close(metfd)
+            metfd = os.open(path, os.O_WRONLY | os.O_APPEND |
+                            os.O_CREAT, 0o600)
+        _OUTPUT['file'] = metfd
+    return _OUTPUT['file']
+
+
+def _statsd(phase, msec):
+    """Send the timing to the statsd daemon in `PROMUS_STATSD`. An
+    invalid address disables statsd for the rest of the process. """
+    import socket
+    if _OUTPUT['statsd'] is None:
+        try:
+            host, port = os.environ['PROMUS_STATSD'].rsplit(':', 1)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _OUTPUT['statsd'] = (sock, (host, int(port)))
+        except (ValueError, socket.error):
+            _OUTPUT['statsd'] = False
+    if not _OUTPUT['statsd']:
+        return
+    sock, address = _OUTPUT['statsd']
+    msg = 'promus.%s:%.3f|ms' % (phase.replace(':', '_'), msec)
+    try:
+        sock.sendto(msg.encode('ascii'), address)
+    except (socket.error, OverflowError):
+        pass
+
+
+def record(phase, msec, start=None):
+    "Append a timing to the metrics file. "
+    if not enabled():
+        return
+    if start is None:
+        start = time.time()
+    line = '%.3f %s %.3f %s %s\n' % (start, phase, msec,
+                                     CONTEXT['repo'], CONTEXT['guest'])
+    try:
+        os.write(_metrics_file(), line.encode('utf-8'))
+    except (IOError, OSError, KeyError):
+        pass
+    if 'PROMUS_STATSD' in os.environ:
+        _statsd(phase, msec)
+
+
+@contextmanager
+def timer(phase):
+    "Record the time spent in the body of a `with` statement. "
+    start = time.time()
+    try:
+        yield
+    finally:
+        record(phase, (time.time() - start) * 1e3, start)
+
+
+def parse_time(string, now=None):
+    """Return the epoch time of a relative span such as `30m`, `12h`
+    or `7d` (that long ago) or of a date such as `2015-03-20`. """
+    if now is None:
+        now = time.time()
+    match = RE_SPAN.match(string.strip())
+    if match:
+        return now - float(match.group('num')) * SPAN[match.group('unit')]
+    from dateutil import parser
+    return time.mktime(parser.parse(string).timetuple())
+
+
+def read_records(since=None, until=None):
+    """Yield the records in the metrics files as tuples `(epoch, phase,
+    msec, repo, guest)` within the given time range. """
+    for path in ['%s.1' % metrics_path(), metrics_path()]:
+        try:
+            metf = open(path, 'r')
+        except IOError:
+            continue
+        with metf:
+            for line in metf:
+                tmp = line.split()
+                if len(tmp) != 5:
+                    continue
+                try:
+                    epoch = float(tmp[0])
+                    msec = float(tmp[2])
+                except ValueError:
+                    continue
+                if since is not None and epoch < since:
+                    continue
+                if until is not None and epoch > until:
+                    continue
+                yield epoch, tmp[1], msec, tmp[3], tmp[4]
+
+
+def percentile(values, pct):
+    "Nearest rank percentile of a sorted list. "
+    if not values:
+        return 0.0
+    rank = int(math.ceil(pct * len(values) / 100.0)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summarize(records, by=None):
+    """Return a dictionary mapping `(phase, key)` to `(count, p50, p95,
+    p99, max)`. The key is the repository or the guest when `by` is
+    `repo` or `guest` and '-' otherwise. """
+    index = {'repo': 3, 'guest': 4}.get(by)
+    groups = dict()
+    for rec in records:
+        key = rec[index] if index else '-'
+        groups.setdefault((rec[1], key), []).append(rec[2])
+    summary = dict()
+    for group, values in groups.items():
+        values.sort()
+        summary[group] = (len(values), percentile(values, 50),
+                          percentile(values, 95), percentile(values, 99),
+                          values[-1])
+    return summary
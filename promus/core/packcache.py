@@ -0,0 +1,280 @@
+"""Pack cache
+
+Cache the packs sent by `git-upload-pack`. Git runs the command given
+by `uploadpack.packObjectsHook` instead of `git pack-objects`, passing
+the original command as arguments and the list of wanted and common
+objects on stdin:
+
+    python -m promus.core.packcache git pack-objects --revs ...
+
+The pack is cached under `~/.promus/packcache/<repo>/<key>.pack` where
+the key is the hash of the arguments and of stdin, so that many guests
+cloning or fetching the same refs after a push get the pack computed
+once. Concurrent identical requests wait for the first one to finish
+instead of computing the same pack. The cache of a repository is
+removed by the post-receive hook and the least recently used packs
+are removed when the cache grows larger than `packcache.maxsize`
+bytes (1 GiB by default).
+
+The cache is off by default, `promus packcache enable` turns it on.
+Git only honours `uploadpack.packObjectsHook` in the global
+configuration, so once it is set every fetch from any repository of the
+account starts this module. It runs plain `git pack-objects` for the
+repositories without `promus.packcache` set to true. `promus packcache
+disable` removes the hook.
+
+"""
+
+import os
+import sys
+import time
+import fcntl
+import shutil
+import hashlib
+from subprocess import Popen, PIPE
+from promus.command import exec_cmd, make_dir
+
+MAX_SIZE = 1 << 30
+CHUNK = 1 << 16
+
+
+def cache_path():
+    "Return the directory holding the cached packs. "
+    return '%s/.promus/packcache' % os.environ['HOME']
+
+
+def repo_dir():
+    "Return the path of the repository git is running the hook for. "
+    return os.path.realpath(os.environ.get('GIT_DIR', '.'))
+
+
+def repo_cache(git_dir):
+    "Return the directory holding the packs of a repository. "
+    name = hashlib.sha1(git_dir.encode('utf-8')).hexdigest()[:16]
+    return '%s/%s-%s' % (cache_path(), os.path.basename(git_dir), name)
+
+
+def hook_command():
+    "Return the command git should run instead of `pack-objects`. "
+    return '%s -m promus.core.packcache' % sys.executable
+
+
+def hook_installed():
+    "Return True if git runs this module instead of `pack-objects`. "
+    out, _, _ = exec_cmd('git config --global uploadpack.packObjectsHook')
+    return out.strip() == hook_command()
+
+
+def install_hook():
+    """Make git use the cache. The hook must be set in the global
+    configuration since git ignores it in the repository one. """
+    if not hook_installed():
+        exec_cmd('git config --global uploadpack.packObjectsHook "%s"' %
+                 hook_command())
+
+
+def remove_hook():
+    "Make git run `pack-objects` again and remove the cached packs. "
+    if hook_installed():
+        exec_cmd('git config --global --unset uploadpack.packObjectsHook')
+    shutil.rmtree(cache_path(), ignore_errors=True)
+
+
+def enable(git_dir):
+    "Cache the packs served from a repository. "
+    exec_cmd('cd %s; git config promus.packcache true' % git_dir)
+
+
+def disable(git_dir):
+    "Stop caching the packs of a repository and remove them. "
+    exec_cmd('cd %s; git config --unset promus.packcache' % git_dir)
+    invalidate(git_dir)
+
+
+def repo_enabled(git_dir):
+    "Return True if the packs of the repository are cached. "
+    out, _, _ = exec_cmd('cd %s; git config --bool promus.packcache' %
+                         git_dir)
+    return out.strip() == 'true'
+
+
+def invalidate(git_dir=None):
+    "Remove the cached packs of a repository. "
+    if git_dir is None:
+        git_dir = repo_dir()
+    path = repo_cache(git_dir)
+    if not os.path.exists(path):
+        return
+    # Rename first so that no new pack is added to the directory
+    tmp = '%s.%d.old' % (path, os.getpid())
+    try:
+        os.rename(path, tmp)
+    except OSError:
+        return
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def settings():
+    "Return True if the repository uses the cache and the size limit. "
+    out, _, _ = exec_cmd("git config --get-regexp "
+                         "'^(promus\\.packcache|packcache\\.maxsize)$'")
+    enabled = False
+    max_size = MAX_SIZE
+    for line in out.splitlines():
+        try:
+            key, val = line.split(None, 1)
+        except ValueError:
+            continue
+        if key == 'promus.packcache':
+            enabled = val.strip().lower() in ['true', 'yes', 'on', '1']
+        elif key == 'packcache.maxsize':
+            try:
+                max_size = int(val)
+            except ValueError:
+                pass
+    return enabled, max_size
+
+
+def request_key(args, request):
+    "Return the cache key of a `pack-objects` request. "
+    digest = hashlib.sha256()
+    digest.update('\0'.join(args).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(request)
+    return digest.hexdigest()
+
+
+def copy(src, dst):
+    "Copy a file object to another one. "
+    while True:
+        data = src.read(CHUNK)
+        if not data:
+            break
+        dst.write(data)
+    dst.flush()
+
+
+def compute(cmd, request, out, pack):
+    """Run `pack-objects` writing its output both to `out` and to the
+    file `pack`. Returns the exit status. """
+    proc = Popen(cmd, stdin=PIPE, stdout=PIPE)
+    proc.stdin.write(request)
+    proc.stdin.close()
+    with open(pack, 'wb') as packf:
+        while True:
+            data = proc.stdout.read(CHUNK)
+            if not data:
+                break
+            out.write(data)
+            packf.write(data)
+    out.flush()
+    return proc.wait()
+
+
+def evict(max_size):
+    "Remove the least recently used packs until the cache fits. "
+    packs = list()
+    total = 0
+    for root, _, fnames in os.walk(cache_path()):
+        for fname in fnames:
+            if not fname.endswith('.pack'):
+                continue
+            path = os.path.join(root, fname)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            packs.append((info.st_mtime, info.st_size, path))
+            total += info.st_size
+    for _, size, path in sorted(packs):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+def open_locked(path):
+    """Return the lock file `path` opened and locked. Identical
+    requests wait here for the first one to finish. The file is
+    removed by its holder before releasing it, so a process that was
+    waiting on a removed file tries again with the new one. """
+    while True:
+        # The directory is renamed when the cache is invalidated
+        make_dir(os.path.dirname(path))
+        lock = open(path, 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(lock.fileno()).st_ino:
+                return lock
+        except OSError:
+            pass
+        lock.close()
+
+
+def _serve(cmd, request, out, pack, max_size):
+    """Copy the cached pack to `out` and return None or compute it and
+    return the exit status of `pack-objects`. """
+    try:
+        packf = open(pack, 'rb')
+    except IOError:
+        packf = None
+    if packf is not None:
+        with packf:
+            copy(packf, out)
+        now = time.time()
+        os.utime(pack, (now, now))
+        return None
+    tmp = '%s.%d.tmp' % (pack, os.getpid())
+    try:
+        status = compute(cmd, request, out, tmp)
+        if status == 0 and os.path.getsize(tmp) <= max_size // 2:
+            os.rename(tmp, pack)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return status
+
+
+def serve(cmd, request, out, max_size):
+    """Write the pack for the request to `out`, from the cache if it
+    is there. Returns the exit status. """
+    cache = repo_cache(repo_dir())
+    make_dir(cache)
+    pack = '%s/%s.pack' % (cache, request_key(cmd[1:], request))
+    lock_path = '%s.lock' % pack[:-5]
+    with open_locked(lock_path):
+        try:
+            status = _serve(cmd, request, out, pack, max_size)
+        finally:
+            # Removed while locked, see `open_locked`
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+        if status is None:
+            return 0
+    if status == 0:
+        evict(max_size)
+    return status
+
+
+def main(cmd):
+    "Run the hook for the `pack-objects` command `cmd`. "
+    enabled, max_size = settings()
+    if not enabled:
+        os.execvp(cmd[0], cmd)
+    stdin = getattr(sys.stdin, 'buffer', sys.stdin)
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    request = stdin.read()
+    try:
+        return serve(cmd, request, out, max_size)
+    except (IOError, OSError) as exc:
+        sys.stderr.write('packcache: %s\n' % exc)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,175 @@
+"""Profiling
+
+Commands and hooks may be run under `cProfile` and, optionally,
+`tracemalloc` in order to find out where the time of real requests
+goes. Profiling is enabled with `promus profile on` or for a single
+process by setting the environment variable `PROMUS_PROFILE` to `cpu`
+or `memory` (`off` disables it). Each run writes its captures to
+
+    ~/.promus/profiles/<command>-<timestamp>-<pid>.prof
+    ~/.promus/profiles/<command>-<timestamp>-<pid>.mem
+
+"""
+
+import os
+import time
+from promus.command import make_dir
+
+MODES = ['cpu', 'memory']
+
+
+def profiles_path():
+    "Return the directory where the captures are written. "
+    return '%s/.promus/profiles' % os.environ['HOME']
+
+
+def switch_path():
+    "Return the file that enables profiling for every process. "
+    return '%s/enabled' % profiles_path()
+
+
+def profile_mode():
+    """Return `cpu`, `memory` or None when profiling is disabled. The
+    environment variable `PROMUS_PROFILE` takes precedence over the
+    switch file written by `enable`. """
+    mode = os.environ.get('PROMUS_PROFILE')
+    if mode is None:
+        try:
+            with open(switch_path(), 'r') as tmpf:
+                mode = tmpf.read().strip()
+        except (IOError, OSError, KeyError):
+            return None
+    mode = mode.lower()
+    if mode in MODES:
+        return mode
+    if mode in ['1', 'on', 'true']:
+        return 'cpu'
+    return None
+
+
+def enable(mode='cpu'):
+    "Profile every command and hook from now on. "
+    make_dir(profiles_path())
+    with open(switch_path(), 'w') as tmpf:
+        tmpf.write('%s\n' % mode)
+
+
+def disable():
+    "Stop profiling. The captures are kept. "
+    try:
+        os.remove(switch_path())
+    except OSError:
+        pass
+
+
+def capture_name(name):
+    "Return the path to the captures of this process without extension. "
+    stamp = time.strftime('%Y%m%d%H%M%S')
+    return '%s/%s-%s-%d' % (profiles_path(), name, stamp, os.getpid())
+
+
+def split_capture(fname):
+    """Return the command or hook name and the timestamp of a capture
+    given its file name. """
+    base = os.path.splitext(os.path.basename(fname))[0]
+    name, stamp, _ = base.rsplit('-', 2)
+    return name, stamp
+
+
+def profile_call(name, func, *args):
+    """Call `func` with the given arguments. If profiling is enabled
+    the call runs under `cProfile` and the captures are written even
+    if `func` exits the process. """
+    mode = profile_mode()
+    if mode is None:
+        return func(*args)
+    import cProfile
+    tracemalloc = None
+    if mode == 'memory':
+        try:
+            import tracemalloc
+            tracemalloc.start(25)
+        except ImportError:
+            tracemalloc = None
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        return func(*args)
+    finally:
+        prof.disable()
+        try:
+            make_dir(profiles_path())
+            base = capture_name(name)
+            prof.dump_stats('%s.prof' % base)
+            if tracemalloc is not None:
+                tracemalloc.take_snapshot().dump('%s.mem' % base)
+                tracemalloc.stop()
+        except (IOError, OSError):
+            pass
+
+
+def captures(name=None, since=None):
+    """Return a dictionary mapping command and hook names to the paths
+    of their captures without extension. Use `name` to select a single
+    command or hook and `since` (a `YYYYmmddHHMMSS` string) to skip
+    older captures. """
+    found = dict()
+    try:
+        fnames = os.listdir(profiles_path())
+    except OSError:
+        return found
+    for fname in sorted(fnames):
+        if not fname.endswith('.prof'):
+            continue
+        try:
+            cmd, stamp = split_capture(fname)
+        except ValueError:
+            continue
+        if name is not None and cmd != name:
+            continue
+        if since is not None and stamp < since:
+            continue
+        path = '%s/%s' % (profiles_path(), fname[:-5])
+        found.setdefault(cmd, []).append(path)
+    return found
+
+
+def cpu_stats(paths):
+    "Combine the cProfile captures into a single `pstats.Stats`. "
+    import pstats
+    stats = None
+    for path in paths:
+        try:
+            if stats is None:
+                stats = pstats.Stats('%s.prof' % path)
+            else:
+                stats.add('%s.prof' % path)
+        except (IOError, OSError, EOFError, TypeError, ValueError):
+            continue
+    return stats
+
+
+def memory_stats(paths, top=10):
+    """Return the `top` lines allocating the largest amount of memory
+    added over all the captures as a list of `(size, count, where)`. """
+    try:
+        import tracemalloc
+    except ImportError:
+        return []
+    # Leave out the allocations made while profiling
+    ignore = [tracemalloc.Filter(False, '%s.py' % os.path.splitext(fname)[0])
+              for fname in [__file__, tracemalloc.__file__]]
+    total = dict()
+    for path in paths:
+        if not os.path.exists('%s.mem' % path):
+            continue
+        snapshot = tracemalloc.Snapshot.load('%s.mem' % path)
+        snapshot = snapshot.filter_traces(ignore)
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            where = '%s:%d' % (frame.filename, frame.lineno)
+            size, count = total.get(where, (0, 0))
+            total[where] = (size + stat.size, count + stat.count)
+    entries = [(size, count, where)
+               for where, (size, count) in total.items()]
+    return sorted(entries, reverse=True)[:top]
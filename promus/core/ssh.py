@@ -3,9 +3,13 @@
 import os
 import re
 import sys
+import fcntl
+import base64
 import shutil
+import hashlib
 from os.path import exists
-from promus.command import exec_cmd, date, error
+from contextlib import contextmanager
+from promus.command import exec_cmd, date, error, make_dir
 PC = sys.modules['promus.core']
 
 RE_USER = re.compile('command="python -m promus greet '
@@ -17,43 +21,127 @@ RE_PENDING = re.compile('command="python -m promus add user '
                         '(?P<desc>.*)')
 
 
-def make_key(name, cmt=''):
-    """Creates a new key. """
+# Caches for the key material, see `get_keys`, `get_public_key` and
+# `fingerprint`.
+KEYS = dict()
+PUBLIC_KEYS = dict()
+FINGERPRINTS = dict()
+
+
+def generate_ed25519(name, cmt=''):
+    """Write an Ed25519 key pair to `name` and `name.pub` without
+    calling `ssh-keygen`. Returns False if the `cryptography` package
+    is not available. """
+    try:
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        from cryptography.hazmat.primitives import serialization as ser
+    except ImportError:
+        return False
+    key = ed25519.Ed25519PrivateKey.generate()
+    private = key.private_bytes(ser.Encoding.PEM, ser.PrivateFormat.OpenSSH,
+                                ser.NoEncryption())
+    public = key.public_key().public_bytes(ser.Encoding.OpenSSH,
+                                           ser.PublicFormat.OpenSSH)
+    keyfd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(keyfd, 'wb') as keyfp:
+        keyfp.write(private)
+    with open('%s.pub' % name, 'w') as keyfp:
+        keyfp.write('%s %s\n' % (public.decode('ascii'), cmt))
+    return True
+
+
+def make_key(name, cmt='', key_type='ed25519'):
+    """Creates a new key. Ed25519 keys are generated in-process when
+    the `cryptography` package is available. """
     if not exists(name):
-        cmd = "ssh-keygen -f %s -C '%s' -N '' -t rsa -q" % (name, cmt)
+        if key_type == 'ed25519' and generate_ed25519(name, cmt):
+            return name
+        cmd = "ssh-keygen -f %s -C '%s' -N '' -t %s -q" % (name, cmt,
+                                                           key_type)
         exec_cmd(cmd, True)
     return name
 
 
 def get_keys():
     """Verifies that the keys exist, if not it creates them. Returns
-    the path of the keys. """
+    the path of the keys. The paths are only computed once. """
+    if 'paths' in KEYS:
+        return KEYS['paths']
     alias = PC.config('host.alias')
     if alias == '':
         raise NameError("run `promus setup` to provide an alias")
     home = os.environ['HOME']
     master = os.environ['USER']
-    # DEFAULT KEY
+    # DEFAULT KEY: it must be an RSA key, it is used to encrypt the
+    # credentials stored by promus.
     idfname = '%s/.ssh/id_dsa' % home
     if not exists(idfname):
         idfname = '%s/.ssh/id_rsa' % home
         if not exists(idfname):
-            cmt = '%s-%s' % (master, alias)
-            cmd = "ssh-keygen -f %s -C '%s' -N '' -t rsa -q" % (idfname, cmt)
-            exec_cmd(cmd, True)
+            make_key(idfname, '%s-%s' % (master, alias), 'rsa')
     # GIT KEY
-    fname = '%s/.ssh/%s-%s-git' % (home, master, alias)
-    if not exists(fname):
-        cmt = '%s-%s-git' % (master, alias)
-        cmd = "ssh-keygen -f %s -C '%s' -N '' -t rsa -q" % (fname, cmt)
-        exec_cmd(cmd, True)
+    fname = make_key('%s/.ssh/%s-%s-git' % (home, master, alias),
+                     '%s-%s-git' % (master, alias))
+    KEYS['paths'] = (idfname, fname)
     return idfname, fname
 
 
+def derive_public_key(private):
+    """Return the public key of a private key file without calling
+    `ssh-keygen`, or None if the key cannot be loaded in-process. """
+    try:
+        from cryptography.hazmat.primitives import serialization as ser
+    except ImportError:
+        return None
+    try:
+        with open(private, 'rb') as keyfp:
+            data = keyfp.read()
+    except IOError:
+        return None
+    for load in [ser.load_ssh_private_key, ser.load_pem_private_key]:
+        try:
+            key = load(data, None)
+        except (ValueError, TypeError):
+            continue
+        public = key.public_key().public_bytes(ser.Encoding.OpenSSH,
+                                               ser.PublicFormat.OpenSSH)
+        return public.decode('ascii')
+    return None
+
+
 def get_public_key(private):
-    """Retrieve the public key belonging to the given private key. """
-    public, _, _ = exec_cmd('ssh-keygen -y -f %s' % private)
-    return public.strip()
+    """Retrieve the public key belonging to the given private key. It
+    reads the `.pub` file next to the key when present, otherwise it
+    derives the public key in-process and falls back to `ssh-keygen`.
+    Only the key type and the key are returned. """
+    try:
+        stamp = os.stat(private).st_mtime
+    except OSError:
+        stamp = None
+    if (private, stamp) in PUBLIC_KEYS:
+        return PUBLIC_KEYS[(private, stamp)]
+    public = None
+    try:
+        with open('%s.pub' % private, 'r') as keyfp:
+            public = keyfp.read()
+    except IOError:
+        public = derive_public_key(private)
+    if public is None:
+        public, _, _ = exec_cmd('ssh-keygen -y -f %s' % private)
+    public = ' '.join(public.split()[:2])
+    PUBLIC_KEYS[(private, stamp)] = public
+    return public
+
+
+def fingerprint(public):
+    """Return the SHA256 fingerprint of a public key as shown by
+    `ssh-keygen -l`. """
+    if public not in FINGERPRINTS:
+        blob = base64.b64decode(public.split()[1])
+        digest = base64.b64encode(hashlib.sha256(blob).digest())
+        digest = digest.decode('ascii').rstrip('=')
+        FINGERPRINTS[public] = 'SHA256:%s' % digest
+    return FINGERPRINTS[public]
 
 
 def read_config():
@@ -102,6 +190,60 @@ def write_config(config):
     exec_cmd('chmod 700 %s/.ssh/config' % os.environ['HOME'], True)
 
 
+def control_persist():
+    """Return the time the shared ssh connections to promus hosts stay
+    open (see `ControlPersist` in ssh_config). It is set with
+
+        git config --global host.controlpersist 10m
+
+    An empty string means that connection sharing is disabled. """
+    return PC.config('host.controlpersist')
+
+
+def control_path():
+    "Return the directory holding the sockets of the shared connections. "
+    path = '%s/.promus/ssh' % os.environ['HOME']
+    if PC.make_dir(path):
+        os.chmod(path, 0o700)
+    return path
+
+
+def multiplex(entry, persist):
+    """Add the options to share a single connection among all the ssh
+    sessions to a host to an entry of the ssh configuration. The
+    master connection stays open for `persist` after the last session
+    closes. """
+    entry['ControlMaster'] = 'auto'
+    entry['ControlPath'] = '%s/%%C' % control_path()
+    entry['ControlPersist'] = persist
+    return entry
+
+
+def shares_connections(alias):
+    "Return True if the ssh entry of the host enables `ControlMaster`. "
+    for entry, options in read_config().items():
+        if alias in entry.split():
+            return options.get('ControlMaster', 'no') in ['auto', 'yes',
+                                                          'autoask', 'ask']
+    return False
+
+
+def warm(alias):
+    """Open the master connection to a host unless it is already open.
+    Returns the exit status of ssh or None if the ssh entry of the host
+    does not share connections, in which case a background session
+    would only stay open forever. """
+    if not shares_connections(alias):
+        return None
+    _, _, status = exec_cmd('ssh -O check %s' % alias)
+    if status == 0:
+        return 0
+    _, err, status = exec_cmd('ssh -f -N %s' % alias)
+    if status != 0:
+        sys.stderr.write(err)
+    return status
+
+
 def read_authorized_keys():
     """Read the authorized keys file. """
     users = dict()
@@ -137,31 +279,98 @@ def read_authorized_keys():
     return users, pending, unknown
 
 
+def authorized_keys_path():
+    "Return the path to the authorized keys file. "
+    return '%s/.ssh/authorized_keys' % os.environ['HOME']
+
+
+@contextmanager
+def authorized_keys_lock():
+    """Serialize the changes to the authorized keys file. The lock is
+    not reentrant, do not nest it. """
+    make_dir('%s/.ssh' % os.environ['HOME'])
+    with open('%s.lock' % authorized_keys_path(), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def user_line(email, key, content):
+    "Return the authorized keys entry of a user. "
+    return 'command="python -m promus greet \'%s,%s,%s,%s\'" %s %s %s\n' % (
+        email, content[0], content[1], content[2], content[3], key,
+        content[4])
+
+
+def pending_line(key, content):
+    "Return the authorized keys entry of a pending request. "
+    return 'command="python -m promus add user %s" %s %s %s\n' % (
+        content[0], content[1], key, content[2])
+
+
 def write_authorized_keys(users, pending, unknown):
-    """Rewrite the authorized keys file. """
-    ak_file = '%s/.ssh/authorized_keys' % os.environ['HOME']
+    """Rewrite the authorized keys file. The new file is written next
+    to the old one and renamed over it so that sshd never reads a
+    partial file. Use `edit_authorized_keys` to make changes. """
+    ak_file = authorized_keys_path()
     backup = '%s/.ssh/authorized_keys.promus-backup' % os.environ['HOME']
-    if not os.path.exists(backup):
+    if not os.path.exists(backup) and os.path.exists(ak_file):
         shutil.copy(ak_file, backup)
-    akfp = open(ak_file, 'w')
-    akfp.write('# PROMUS: authorized_keys generated on %s\n' % date())
-    emails = sorted(users.keys())
-    for user in emails:
-        for key, content in users[user].items():
-            akfp.write('command="python -m promus greet \'%s,' % user)
-            akfp.write('%s,%s,%s\'" ' % (content[0], content[1], content[2]))
-            akfp.write('%s %s %s\n' % (content[3], key, content[4]))
-    keys = pending.keys()
-    if keys:
-        akfp.write('# pending requests:\n')
-        data = [(key, pending[key][0], pending[key][1]) for key in keys]
-        data = sorted(data, key=lambda x: x[1])
-        for item in data:
-            akfp.write('command="python -m promus add user %s"' % item[1])
-            akfp.write(' %s %s %s\n' % (item[2], item[0], item[1]))
+    lines = ['# PROMUS: authorized_keys generated on %s\n' % date()]
+    for email in sorted(users.keys()):
+        for key, content in users[email].items():
+            lines.append(user_line(email, key, content))
+    if pending:
+        lines.append('# pending requests:\n')
+        for key in sorted(pending, key=lambda x: pending[x][0]):
+            lines.append(pending_line(key, pending[key]))
     if unknown:
-        akfp.write('# unknown keys:\n')
-        for entry in unknown:
-            akfp.write('%s' % entry)
-    akfp.close()
-    exec_cmd('chmod 700 %s' % ak_file, True)
+        lines.append('# unknown keys:\n')
+        lines.extend(unknown)
+    tmp = '%s.%d.tmp' % (ak_file, os.getpid())
+    akfd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(akfd, 'w') as akfp:
+        akfp.write(''.join(lines))
+        akfp.flush()
+        os.fsync(akfp.fileno())
+    os.rename(tmp, ak_file)
+
+
+@contextmanager
+def edit_authorized_keys():
+    """Read, modify and write the authorized keys file while holding
+    the lock:
+
+        with edit_authorized_keys() as (users, pending, unknown):
+            del pending[key]
+
+    The file is not written if the block raises an exception. """
+    with authorized_keys_lock():
+        users, pending, unknown = read_authorized_keys()
+        yield users, pending, unknown
+        write_authorized_keys(users, pending, unknown)
+
+
+def add_pending(entries):
+    """Append pending requests, a dictionary mapping keys to the email,
+    the key type and the description, to the authorized keys file
+    without rewriting it. The entries are written with a single call
+    to `write`. """
+    ak_file = authorized_keys_path()
+    data = ''.join(pending_line(key, entries[key]) for key in entries)
+    with authorized_keys_lock():
+        try:
+            size = os.path.getsize(ak_file)
+        except OSError:
+            size = 0
+        if size == 0:
+            write_authorized_keys({}, entries, [])
+            return
+        akfd = os.open(ak_file, os.O_RDWR | os.O_APPEND)
+        try:
+            os.lseek(akfd, -1, os.SEEK_END)
+            if os.read(akfd, 1) != b'\n':
+                data = '\n' + data
+            os.write(akfd, data.encode('utf-8'))
+            os.fsync(akfd)
+        finally:
+            os.close(akfd)
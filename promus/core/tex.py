@@ -1,58 +1,242 @@
 """TeX utilities"""
 
 import os
-import promus.util as util
-import promus.git as git
+import re
+import sys
+import json
+import time
+import hashlib
+from shutil import rmtree
+from tempfile import mkdtemp
+from multiprocessing import Pool
+from promus.command import exec_cmd, make_dir
+from promus.core.git import BlobReader, object_ids
+from promus.core.util import external_executables
+
+RE_INCLUDE = re.compile(r'\\(input|include)\{(?P<name>[^}]*)\}')
+RE_COMMENT = re.compile(r'(?<!\\)%')
+RE_BIB = re.compile(r'\\bibliography\{(?P<names>[^}]*)\}')
+
+
+def tex_name(name):
+    "Append the `.tex` extension to a file name if it is missing. "
+    if name.endswith('.tex'):
+        return name
+    return '%s.tex' % name
+
+
+def blob_sha(content):
+    """Return the sha git would assign to a file with the given
+    contents. """
+    data = content.encode('utf-8')
+    header = ('blob %d\0' % len(data)).encode('utf-8')
+    return hashlib.sha1(header + data).hexdigest()
+
+
+class FileSource(object):
+    "Read tex files from the working directory. "
+
+    def read(self, path):
+        "Return the sha and the contents of a file. "
+        try:
+            with open(path, 'r') as texf:
+                content = texf.read()
+        except IOError:
+            return None, None
+        return blob_sha(content), content
+
+    def close(self):
+        "Nothing to release. "
+        pass
+
+
+class GitSource(object):
+    """Read tex files as they were `rev` commits ago. All the files go
+    through the same `git cat-file --batch` process. """
+
+    def __init__(self, rev, reader=None):
+        self.rev = rev
+        self.own_reader = reader is None
+        self.reader = BlobReader() if reader is None else reader
+
+    def name(self, path):
+        "Return the name git uses for the file. "
+        return 'HEAD~%s:./%s' % (self.rev, path)
+
+    def read(self, path):
+        "Return the sha and the contents of a file. "
+        return self.reader.read(self.name(path))
+
+    def close(self):
+        "Terminate the reader if it was created by this object. "
+        if self.own_reader:
+            self.reader.close()
+
+
+def flatten(texfile, source):
+    """Expand every `\\input` and `\\include` recursively. Returns the
+    flattened contents and a dictionary mapping each file used to its
+    sha. Comments are removed, missing files are replaced by nothing
+    and files including themselves are not expanded again. """
+    deps = dict()
+
+    def expand(path, stack):
+        "Return the expanded contents of a file. "
+        sha, content = source.read(path)
+        deps[path] = sha
+        if content is None:
+            return ''
+        lines = list()
+        for line in content.split('\n'):
+            match = RE_COMMENT.search(line)
+            if match:
+                line = line[:match.start()]
+                if line.strip() == '':
+                    continue
+            parts = list()
+            caret = 0
+            for match in RE_INCLUDE.finditer(line):
+                parts.append(line[caret:match.start()])
+                name = tex_name(match.group('name').strip())
+                if name not in stack:
+                    parts.append(expand(name, stack + [name]).rstrip('\n'))
+                caret = match.end()
+            parts.append(line[caret:])
+            lines.append(''.join(parts))
+        return '\n'.join(lines)
+
+    root = tex_name(texfile)
+    text = expand(root, [root])
+    if not text.endswith('\n'):
+        text += '\n'
+    return text, deps
+
+
+def cache_path():
+    "Return the directory where flattened files are stored. "
+    path = '%s/.promus/tex' % os.environ['HOME']
+    make_dir(path)
+    return path
+
+
+def cache_key(root_sha, deps):
+    """Key of a flattened file: the sha of the main file along with the
+    sha of each of its dependencies. """
+    items = ['%s %s' % (path, deps[path]) for path in sorted(deps)]
+    data = '\n'.join([root_sha] + items).encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def cached_flatten(texfile, rev, cache=None):
+    """Return the flattened file as it was `rev` commits ago. The
+    dependencies recorded for the main file are checked with a single
+    `git cat-file --batch-check` call, when none of them changed the
+    result is read from the cache. """
+    if cache is None:
+        cache = cache_path()
+    source = GitSource(rev)
+    root = tex_name(texfile)
+    try:
+        root_sha = object_ids([source.name(root)])[0]
+        if root_sha is not None:
+            text = cache_lookup(cache, source, root_sha)
+            if text is not None:
+                return text
+        text, deps = flatten(texfile, source)
+    finally:
+        source.close()
+    if root_sha is not None:
+        cache_store(cache, root_sha, deps, text)
+    return text
+
+
+def cache_lookup(cache, source, root_sha):
+    "Return the cached flattened file or None. "
+    try:
+        with open('%s/%s.deps' % (cache, root_sha), 'r') as depf:
+            paths = json.load(depf)
+    except (IOError, ValueError):
+        return None
+    shas = object_ids([source.name(path) for path in paths])
+    key = cache_key(root_sha, dict(zip(paths, shas)))
+    try:
+        with open('%s/%s.tex' % (cache, key), 'r') as texf:
+            return texf.read()
+    except IOError:
+        return None
+
+
+def cache_store(cache, root_sha, deps, text):
+    "Store a flattened file along with the list of its dependencies. "
+    key = cache_key(root_sha, deps)
+    with open('%s/%s.tex' % (cache, key), 'w') as texf:
+        texf.write(text)
+    with open('%s/%s.deps' % (cache, root_sha), 'w') as depf:
+        json.dump(sorted(deps), depf)
 
 
 def gen_from_file(texfile, fname):
     """Generates a single file with the contents of the texfile (no
     includes)"""
-    tmpf = open("%s.tex" % fname, 'w')
-    for line in open("%s.tex" % texfile, 'r'):
-        line = line.split('%')[0]
-        pattern = '\input{'
-        index = line.find(pattern)
-        if index == -1:
-            pattern = '\include{'
-            index = line.find(pattern)
-        if index != -1:
-            end = line.find('}', index+1)
-            inc_file = line[index+len(pattern):end]
-            tmpf.write(line[:index])
-            tmpf.write(open("%s.tex" % inc_file, 'r').read())
-            tmpf.write(line[end+1:-1]+'\n')
-        else:
-            if line != '':
-                tmpf.write(line)
-                if line[-1] != '\n':
-                    tmpf.write('\n')
+    text, _ = flatten(texfile, FileSource())
+    with open("%s.tex" % fname, 'w') as tmpf:
+        tmpf.write(text)
 
 
 def gen_from_git(texfile, fname, rev):
     """Generates a single tex file from the repository. """
-    tmpf = open("%s.tex" % fname, 'w')
-    lines, _, _ = util.exec_cmd("git show HEAD~%s:./%s.tex" % (rev,texfile))
-    for line in lines.split('\n'):
-        line = line.split('%')[0]
-        pattern = '\input{'
-        index = line.find(pattern)
-        if index == -1:
-            pattern = '\include{'
-            index = line.find(pattern)
-        if index != -1:
-            end = line.find('}', index+1)
-            inc_file = line[index+len(pattern):end]
-            cmd = "git show HEAD~%s:./%s.tex" % (rev, inc_file)
-            inc, _, _ = util.exec_cmd(cmd)
-            tmpf.write(line[:index])
-            tmpf.write(inc)
-            tmpf.write(line[end+1:-1]+'\n')
-        else:
-            if line != '':
-                tmpf.write(line)
-                if line[-1] != '\n':
-                    tmpf.write('\n')
+    text = cached_flatten(texfile, rev)
+    with open("%s.tex" % fname, 'w') as tmpf:
+        tmpf.write(text)
+
+
+def flatten_revision(texfile, rev):
+    """Return the flattened file for the given revision. The revision
+    `C` stands for the files in the working directory. """
+    if rev == 'C':
+        return flatten(texfile, FileSource())[0]
+    return cached_flatten(texfile, rev)
+
+
+def run_latexdiff(job):
+    """Run `latexdiff` on two files and write the result. `job` is a
+    tuple with the paths of the old and new files and the output file.
+    Returns the output file, the exit status and the errors. """
+    old, new, output = job
+    ans, err, status = exec_cmd("latexdiff '%s' '%s'" % (old, new))
+    if status == 0:
+        with open(output, 'w') as tmpf:
+            tmpf.write(ans)
+    return output, status, err
+
+
+def diff_revisions(texfile, pairs, processes=None):
+    """Generate the file `texfile-diff-A-B.tex` for each pair of
+    revisions (A, B). Every revision is flattened once into a private
+    temporary directory and the `latexdiff` jobs run in a pool of
+    `processes` processes (one per cpu by default). Returns a list of
+    tuples as described in `run_latexdiff`. """
+    tmpdir = mkdtemp(prefix='promus-latexdiff-')
+    try:
+        paths = dict()
+        for rev in set([rev for pair in pairs for rev in pair]):
+            paths[rev] = '%s/rev-%s.tex' % (tmpdir, rev)
+            with open(paths[rev], 'w') as tmpf:
+                tmpf.write(flatten_revision(texfile, rev))
+        jobs = [(paths[old], paths[new],
+                 '%s-diff-%s-%s.tex' % (texfile, old, new))
+                for old, new in pairs]
+        if len(jobs) == 1:
+            return [run_latexdiff(jobs[0])]
+        pool = Pool(processes)
+        try:
+            return pool.map(run_latexdiff, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        rmtree(tmpdir)
+
 
 def diff(prs, texfile):
     """Generates a pdf with the differences in the tex file texfile
@@ -65,7 +249,7 @@ def diff(prs, texfile):
         diff("mytexfile,2") # differences between the current file you
                                 # are editing and the version 2 states ago
         diff("mytexfile,3,4") # diff between 3 and 4
-    
+
     -1: current file
     0: file in latest commit
     n: file in the last nth commit
@@ -79,18 +263,138 @@ def diff(prs, texfile):
     elif len(tmp) == 3:
         version1 = tmp[1]
         version2 = tmp[2]
-    if version1 == "C":
-        gen_from_file(texfile, "texfile.tmp1")
-    else:
-        gen_from_git(texfile, "texfile.tmp1", version1)
-    if version2 == "C":
-        gen_from_file(texfile, "texfile.tmp2")
-    else:
-        gen_from_git(texfile, "texfile.tmp2", version2)
-    cmd = "latexdiff texfile.tmp1.tex texfile.tmp2.tex"
-    ans, err, _ = util.exec_cmd(cmd)
-    with open("%s-diff-%s-%s.tex" % (texfile, version1, version2), 'w') as tmpf:
-        tmpf.write(ans)
-    os.remove("texfile.tmp1.tex")
-    os.remove("texfile.tmp2.tex")
-    prs.dismiss("TEX.DIFF>> done...", 0)
\ No newline at end of file
+    diff_revisions(texfile, [(version1, version2)])
+    prs.dismiss("TEX.DIFF>> done...", 0)
+
+
+def file_sha(path):
+    "Return the git sha of a file in the working directory or None. "
+    return FileSource().read(path)[0]
+
+
+def dependencies(texfile):
+    """Return a dictionary mapping each file the document depends on
+    (tex files and bibliographies) to its sha. """
+    text, deps = flatten(texfile, FileSource())
+    for match in RE_BIB.finditer(text):
+        for name in match.group('names').split(','):
+            name = name.strip()
+            if not name.endswith('.bib'):
+                name += '.bib'
+            deps[name] = file_sha(name)
+    return deps
+
+
+def aux_citations(texfile):
+    """Return the sha of the lines bibtex reads from the aux file or
+    None if there is nothing to process by bibtex. """
+    try:
+        with open('%s.aux' % texfile, 'r') as auxf:
+            lines = [line for line in auxf if line.startswith(
+                ('\\citation', '\\bibdata', '\\bibstyle'))]
+    except IOError:
+        return None
+    if not lines:
+        return None
+    return hashlib.sha1(''.join(lines).encode('utf-8')).hexdigest()
+
+
+def build_state_path(texfile):
+    "Return the path of the file recording the last build. "
+    return '.%s.promus-build' % texfile
+
+
+def read_build_state(texfile):
+    "Return the recorded state of the last build. "
+    try:
+        with open(build_state_path(texfile), 'r') as statef:
+            return json.load(statef)
+    except (IOError, ValueError):
+        return dict()
+
+
+def write_build_state(texfile, state):
+    "Record the state of the build. "
+    with open(build_state_path(texfile), 'w') as statef:
+        json.dump(state, statef, sort_keys=True, indent=1)
+
+
+def compile_pass(texfile, compiler):
+    """Run the compiler once. Returns True when the aux file changed,
+    meaning that another pass may be needed. """
+    before = file_sha('%s.aux' % texfile)
+    cmd = '%s -interaction=nonstopmode -halt-on-error %s' % (compiler,
+                                                              texfile)
+    _, _, status = exec_cmd(cmd)
+    if status != 0:
+        raise RuntimeError("%s failed, see %s.log" % (compiler, texfile))
+    return file_sha('%s.aux' % texfile) != before
+
+
+def build(texfile, compiler='pdflatex', force=False, max_passes=5):
+    """Compile the document only if one of its dependencies changed.
+    The include graph and the sha of each file are recorded next to
+    the document. bibtex only runs when the citations or the
+    bibliographies changed and the compiler is only run again while
+    the aux file keeps changing. Returns the number of compiler
+    passes, 0 when the document was up to date. """
+    deps = dependencies(texfile)
+    state = read_build_state(texfile)
+    if not force and state.get('deps') == deps and \
+            os.path.exists('%s.pdf' % texfile):
+        return 0
+    passes = 1
+    changed = compile_pass(texfile, compiler)
+    cites = aux_citations(texfile)
+    bibs = [name for name in deps if name.endswith('.bib')]
+    old_deps = state.get('deps', dict())
+    if cites is not None and (
+            cites != state.get('cites') or
+            not os.path.exists('%s.bbl' % texfile) or
+            any(deps[name] != old_deps.get(name) for name in bibs)):
+        exec_cmd('bibtex %s' % texfile)
+        changed = True
+    while changed and passes < max_passes:
+        passes += 1
+        changed = compile_pass(texfile, compiler)
+    write_build_state(texfile, {'deps': deps, 'cites': cites})
+    return passes
+
+
+def wait_for_change(paths, interval=1.0):
+    """Block until one of the files is modified. It uses `inotifywait`
+    when it is available and otherwise polls the modification times
+    every `interval` seconds. """
+    dirs = sorted(set([os.path.dirname(path) or '.' for path in paths]))
+    missing, _ = external_executables(['inotifywait'])
+    if not missing:
+        cmd = 'inotifywait -qq -e close_write -e moved_to -e create %s'
+        exec_cmd(cmd % ' '.join(["'%s'" % name for name in dirs]))
+        return
+
+    def stamp():
+        "Return the modification times of the files. "
+        times = list()
+        for path in paths:
+            try:
+                times.append(os.stat(path).st_mtime)
+            except OSError:
+                times.append(None)
+        return times
+
+    start = stamp()
+    while stamp() == start:
+        time.sleep(interval)
+
+
+def watch(texfile, compiler='pdflatex', log=sys.stdout.write):
+    """Rebuild the document every time one of its dependencies
+    changes. It runs until interrupted. """
+    while True:
+        try:
+            passes = build(texfile, compiler)
+            if passes:
+                log('TEX>> %s.pdf built (%d passes)\n' % (texfile, passes))
+        except RuntimeError as exc:
+            log('TEX-ERROR>> %s\n' % exc)
+        wait_for_change(sorted(dependencies(texfile)))
@@ -1,18 +1,12 @@
 """Utility Functions"""
 
 import os
-import rsa
 import sys
 import socket
 from os.path import exists, basename
-from textwrap import TextWrapper
 from itertools import chain
-from smtplib import SMTP_SSL as SMTP
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.encoders import encode_base64
 from promus.command import error
+from promus.core.metrics import timer
 PC = sys.modules['promus.core']
 try:
     INPUT = raw_input
@@ -80,6 +74,7 @@ def user_input(prompt, default):
 def encrypt_to_file(msg, fname, keyfile):
     """Encrypt msg to file `fname` using the key given by the path
     `keyfile`."""
+    import rsa
     with open(keyfile, 'rb') as keyfp:
         keydata = keyfp.read()
     key = rsa.PrivateKey.load_pkcs1(keydata)
@@ -91,6 +86,7 @@ def encrypt_to_file(msg, fname, keyfile):
 def decrypt_from_file(fname, keyfile):
     """Decrypt a message in the file `fname` using the key given by
     the path `keyfile`"""
+    import rsa
     with open(keyfile, 'rb') as keyfp:
         keydata = keyfp.read()
     key = rsa.PrivateKey.load_pkcs1(keydata)
@@ -101,6 +97,7 @@ def decrypt_from_file(fname, keyfile):
 
 def wrap_msg(msg, width=70, tab=1):
     "wraps the msg to the specified width and tab indentation. "
+    from textwrap import TextWrapper
     width -= tab*4
     wrapper = TextWrapper(width=width, break_long_words=False)
     tab = '\n%s' % ('    '*tab)
@@ -146,13 +143,30 @@ def strip(string):
     return None
 
 
-def send_mail(send_to, subject, text, html, files=None):
-    """Send an email. `send_to` must be a list of email address to
-    which the email will be sent. You can email a `subject` as well
-    as two versions of the email: text and html. You may optionally
-    attach files by providing a list of them. """
-    if not send_to:
-        return
+def smtp_password():
+    """Return the password of the smtp server from the credential
+    store. A password stored by older versions of promus in
+    `~/.promus/password.pass` is moved to the credential store. """
+    id_key, _ = PC.get_keys()
+    password = PC.load_secret('password', id_key)
+    if password is None:
+        passfile = '%s/.promus/password.pass' % os.environ['HOME']
+        if not exists(passfile):
+            return ''
+        password = decrypt_from_file(passfile, id_key)
+        PC.store_secret('password', password, id_key)
+    return password
+
+
+def mail_message(send_to, subject, text, html, files=None):
+    """Return the email as a string. `send_to` is the list of email
+    addresses, `text` and `html` are the two versions of the email and
+    `files` an optional list of files to attach. """
+    # The mail modules are only needed here, see `promus.core`
+    from email.mime.text import MIMEText
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.encoders import encode_base64
     msg = MIMEMultipart('alternative')
     msg['Subject'] = subject
     msg['From'] = 'promus@%s' % socket.gethostname()
@@ -172,15 +186,72 @@ def send_mail(send_to, subject, text, html, files=None):
                         'attachment; filename="%s"' % basename(file_))
         htmlmsg.attach(part)
     msg.attach(htmlmsg)
-    server = PC.config('host.smtpserver')
-    conn = SMTP(server)
-    conn.set_debuglevel(False)
-    id_key, _ = PC.get_keys()
-    passfile = '%s/.promus/password.pass' % os.environ['HOME']
-    password = decrypt_from_file(passfile, id_key)
-    if password:
-        conn.login(PC.config('host.username'), password)
-    try:
-        conn.sendmail(PC.config('host.email'), send_to, msg.as_string())
-    finally:
-        conn.close()
+    return msg.as_string()
+
+
+class MailSession(object):
+    """A connection to the smtp server used to send several emails.
+    The connection is opened when the first email is sent:
+
+        with MailSession() as session:
+            for email in emails:
+                session.send([email], subject, text, html)
+
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.sender = None
+
+    def open(self):
+        "Connect and log in to the smtp server. "
+        from smtplib import SMTP, SMTP_SSL
+        server = PC.config('host.smtpserver')
+        # `host.smtpssl` may be set to false for servers that only speak
+        # plain smtp, a local relay for instance.
+        smtp = SMTP if PC.config('host.smtpssl') == 'false' else SMTP_SSL
+        self.sender = PC.config('host.email')
+        password = smtp_password()
+        if password:
+            username = PC.config('host.username')
+        with timer('smtp:connect'):
+            self.conn = smtp(server)
+            self.conn.set_debuglevel(False)
+            if password:
+                self.conn.login(username, password)
+
+    def send(self, send_to, subject, text, html, files=None):
+        "Send an email, see `mail_message`. "
+        if not send_to:
+            return
+        msg = mail_message(send_to, subject, text, html, files)
+        if self.conn is None:
+            self.open()
+        with timer('smtp'):
+            self.conn.sendmail(self.sender, send_to, msg)
+
+    def close(self):
+        "Close the connection. "
+        if self.conn is not None:
+            try:
+                self.conn.quit()
+            except Exception:
+                self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def send_mail(send_to, subject, text, html, files=None):
+    """Send an email. `send_to` must be a list of email address to
+    which the email will be sent. You can email a `subject` as well
+    as two versions of the email: text and html. You may optionally
+    attach files by providing a list of them. """
+    if not send_to:
+        return
+    with MailSession() as session:
+        session.send(send_to, subject, text, html, files)
@@ -31,6 +31,11 @@ working dir metadata properties.
 """
 
 
+# `run` does nothing, the hook is not installed (see
+# `promus.core.git.is_noop_hook`). Remove this when adding code.
+NOOP = True
+
+
 def run(_):
     """Function to execute when the post-checkout hook is called. """
     pass
@@ -25,6 +25,11 @@ outcome of git commit.
 #   git push origin --tags
 
 
+# `run` does nothing, the hook is not installed (see
+# `promus.core.git.is_noop_hook`). Remove this when adding code.
+NOOP = True
+
+
 def run(_):
     """Function to execute when the post-commit hook is called. """
     pass
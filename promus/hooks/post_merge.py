@@ -26,6 +26,11 @@ contrib/hooks/setgitperms.perl for an example of how to do this.
 """
 
 
+# `run` does nothing, the hook is not installed (see
+# `promus.core.git.is_noop_hook`). Remove this when adding code.
+NOOP = True
+
+
 def run(_):
     """Function to execute when the post-merge hook is called. """
     pass
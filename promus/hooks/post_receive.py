@@ -18,6 +18,8 @@ that may take a long time.
 
 from promus.command import exec_cmd
 import promus.core as prc
+from promus.core.metrics import timer
+from promus.core import packcache, access
 try:
     import cPickle as pickle
 except ImportError:
@@ -86,12 +88,16 @@ been modified.
 
 def run(prs):
     """Function to execute when the post-receive hook is called. """
+    # The packs served before this push are out of date
+    packcache.invalidate()
     try:
         with open('TMP_NOTIFY.p', 'rb') as tmpf:
             files = pickle.load(tmpf)
             acl = pickle.load(tmpf)
     except IOError as exc:
         prs.dismiss("POST_RECEIVE>> First time commiting?", 0)
+    if '.acl' in files:
+        access.update_repo(os.getcwd())
     destination = list()
     for user in acl['user']:
         profile = prc.read_profile(user)
@@ -108,6 +114,14 @@ def run(prs):
                     destination.append(profile['email'])
                     break
     prs.log("POST_RECEIVE>> Creating email")
+    with timer('render'):
+        subject, text, html = render(prs, files)
+    prc.send_mail(destination, subject, text, html)
+    os.remove("TMP_NOTIFY.p")
+
+
+def render(prs, files):
+    "Return the subject and the text and html versions of the email. "
     try:
         cmd = "git log -1 --pretty=format:'[%%s]: %aN - %s'"
         subject, _, _ = exec_cmd(cmd)
@@ -127,5 +141,4 @@ def run(prs):
         html_file += '<li><strong>%s</strong>: %s</li>\n' % (fname, commit)
     text = text % (prc.repo_name(False), text_file)
     html = html % (prc.repo_name(False), prc.date(date), html_file)
-    prc.send_mail(destination, subject, text, html)
-    os.remove("TMP_NOTIFY.p")
+    return subject, text, html
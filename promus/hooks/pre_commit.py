@@ -33,8 +33,8 @@ commit message.
 
 """
 
-from promus.command import exec_cmd
 import promus.core as prc
+from promus.core.metrics import timer
 
 
 ADMIN_FILES = ['.acl', '.description', '.bashrc', '.gitignore']
@@ -67,21 +67,49 @@ def check_paths(acl, user, mod_file):
     return has_access
 
 
+def read_acl(reader):
+    "Read the acl in HEAD, returns a string in case of an error. "
+    with timer('acl'):
+        _, content = reader.read('HEAD:.acl')
+        if content is None:
+            return "`HEAD:.acl` not found"
+        return prc.parse_acl(content)
+
+
+def check_staged(reader, sha, mod_file, parse):
+    """Parse the staged version of a file, returns a string in case of
+    an error. """
+    if sha is None:
+        return "no such file: '%s'" % mod_file
+    _, content = reader.read(sha)
+    return parse(content)
+
+
 def run(prs):
-    """Function to execute when the pre-commit hook is called. """
-    acl = prc.read_acl(prc.local_path())
+    """Function to execute when the pre-commit hook is called. Git
+    runs the hook from the root of the working tree, the acl and the
+    profiles are read from HEAD and the index through a single `git
+    cat-file` process. """
+    reader = prc.BlobReader()
+    try:
+        with timer('check'):
+            check(prs, reader)
+    finally:
+        reader.close()
+
+
+def check(prs, reader):
+    """Check the staged files against the acl. """
+    acl = read_acl(reader)
     if isinstance(acl, str):
         prs.dismiss("PRE-COMMIT>> Skipping due to acl error: %s" % acl, 0)
-    out, _, _ = exec_cmd("git diff-index --cached --name-only HEAD")
     user = prs.master
     user_files = ['.%s.profile' % usr for usr in acl['user']]
-    for mod_file in out.split('\n'):
-        if mod_file == '':
-            continue
+    for mod_file, sha in prc.staged_files():
         if mod_file in ADMIN_FILES:
             if user in acl['admin']:
                 if mod_file == '.acl':
-                    tmp = prc.check_acl("%s/.acl" % prc.local_path())
+                    tmp = check_staged(reader, sha, mod_file, prc.parse_acl)
                     if isinstance(tmp, str):
                         prs.dismiss("PRE-COMMIT>> acl error: %s" % tmp, 1)
                 continue
@@ -89,10 +117,11 @@ def run(prs):
                 prs.dismiss(MSG_ADMIN % mod_file, 1)
         if mod_file in user_files:
             if mod_file == '.%s.profile' % user or user in acl['admin']:
-                tmp = prc.check_profile("%s/.%s.profile" % (prc.local_path(),
-                                                            user))
-                if isinstance(tmp, str):
-                    prs.dismiss("PRE-COMMIT>> profile error: %s" % tmp, 1)
+                if sha is not None:
+                    tmp = check_staged(reader, sha, mod_file,
+                                       prc.parse_profile)
+                    if isinstance(tmp, str):
+                        prs.dismiss("PRE-COMMIT>> profile error: %s" % tmp, 1)
                 continue
             else:
                 prs.dismiss(MSG % mod_file, 1)
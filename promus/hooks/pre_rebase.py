@@ -13,6 +13,11 @@ It currently does nothing.
 """
 
 
+# `run` does nothing, the hook is not installed (see
+# `promus.core.git.is_noop_hook`). Remove this when adding code.
+NOOP = True
+
+
 def run(_):
     """Function to execute when the pre-rebase hook is called. """
     pass
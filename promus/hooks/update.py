@@ -1,6 +1,7 @@
 """update hook
 
-Check the acl and deny the push if necessary.
+Check the acl and the size limits (see `promus.core.limits`) and deny
+the push if necessary.
 
 <http://git-scm.com/book/en/Customizing-Git-Git-Hooks>:
 
@@ -63,6 +64,8 @@ import sys
 import promus.core as prc
 from promus.command import exec_cmd
 from promus.core import ssh
+from promus.core.metrics import timer
+from promus.core.limits import read_limits, violations, format_size
 try:
     import cPickle as pickle
 except ImportError:
@@ -72,6 +75,8 @@ ADMIN_FILES = ['.acl']
 MSG = 'update>> No access to push to "%s"'
 MSG_ADMIN = 'update>> Must be an admin to push to "%s"'
 MSG_USER = "update>> No access to push to another user's profile: %s"
+MSG_LIMIT = 'update>> Push rejected, it exceeds the size limits of ' \
+            'the repository:'
 
 
 def zip_list(acl, key):
@@ -124,9 +129,9 @@ def set_email(user_list, num, git_users):
 def map_acl(acl):
     """Changes the user names for email addresses. """
     git_users, _, _ = ssh.read_authorized_keys()
-    for i in xrange(0, len(acl['user'])):
+    for i in range(0, len(acl['user'])):
         set_email(acl['user'], i, git_users)
-    for i in xrange(0, len(acl['admin'])):
+    for i in range(0, len(acl['admin'])):
         set_email(acl['admin'], i, git_users)
     if len(acl['path']) == 2:
         for i in range(0, len(acl['path'][1])):
@@ -136,6 +141,46 @@ def map_acl(acl):
             set_email(acl['name'][1], i, git_users)
 
 
+def check_file(prs, acl, user, user_files, mod_file):
+    "Dismiss the push if the user may not modify the file. "
+    if mod_file in ADMIN_FILES:
+        if user in acl['admin']:
+            return
+        prs.dismiss(MSG_ADMIN % mod_file, 1)
+    if mod_file in user_files:
+        if mod_file == ('.%s.profile' % user) or user in acl['admin']:
+            return
+        prs.dismiss(MSG_USER % mod_file, 1)
+    has_access = check_names(acl, user, mod_file)
+    if has_access is True:
+        return
+    if has_access is False:
+        prs.dismiss(MSG % mod_file, 1)
+    has_access = check_paths(acl, user, mod_file)
+    if has_access in [True, None]:
+        return
+    prs.dismiss(MSG % mod_file, 1)
+
+
+def check_limits(prs, newrev):
+    "Dismiss the push if it brings objects over the size limits. "
+    limits = read_limits()
+    if not limits['maxblobsize'] and not limits['maxpushsize']:
+        return
+    with timer('limits'):
+        large, total = violations(newrev, limits)
+    if not large and total is None:
+        return
+    msg = [MSG_LIMIT]
+    for path, size in large:
+        msg.append('    %s: %s (limit %s)' % (
+            path, format_size(size), format_size(limits['maxblobsize'])))
+    if total is not None:
+        msg.append('    total size of the push: %s (limit %s)' % (
+            format_size(total), format_size(limits['maxpushsize'])))
+    prs.dismiss('\n'.join(msg), 1)
+
+
 def run(prs):
     """Function to execute when the update hook is called. """
     prs.attend_last()
@@ -149,11 +194,13 @@ def run(prs):
     oldrev = sys.argv[2]
     newrev = sys.argv[3]
     user = prs.guest_email
+    check_limits(prs, newrev)
     map_acl(acl)
     user_files = ['.%s.profile' % usr for usr in acl['user']]
     files = dict()
     cmd = "git log -1 --name-only --pretty=format:'' %s"
-    commits, _, _ = exec_cmd('git rev-list %s..%s' % (oldrev, newrev))
+    with timer('revwalk'):
+        commits, _, _ = exec_cmd('git rev-list %s..%s' % (oldrev, newrev))
     for rev in commits.split('\n')[:-1]:
         prs.log("update>> checking revision %s" % rev)
         files_modified, _, _ = exec_cmd(cmd % rev)
@@ -161,25 +208,8 @@ def run(prs):
             if mod_file == '':
                 continue
             add_file(mod_file, rev, files)
-            if mod_file in ADMIN_FILES:
-                if user in acl['admin']:
-                    continue
-                else:
-                    prs.dismiss(MSG_ADMIN % mod_file, 1)
-            if mod_file in user_files:
-                if mod_file == ('.%s.profile' % user) or user in acl['admin']:
-                    continue
-                else:
-                    prs.dismiss(MSG_USER % mod_file, 1)
-            has_access = check_names(acl, user, mod_file)
-            if has_access is True:
-                continue
-            if has_access is False:
-                prs.dismiss(MSG % mod_file, 1)
-            has_access = check_paths(acl, user, mod_file)
-            if has_access in [True, None]:
-                continue
-            prs.dismiss(MSG % mod_file, 1)
+            with timer('check'):
+                check_file(prs, acl, user, user_files, mod_file)
     with open('TMP_NOTIFY.p', 'wb') as tmpf:
         pickle.dump(files, tmpf)
         pickle.dump(acl, tmpf)
@@ -0,0 +1,43 @@
+"""Tests for the roles of the access index.
+
+The roles given to the users of the `path` and `name` rules must agree
+with `promus.core.git.has_access`, which the hooks use to enforce them.
+
+"""
+
+import unittest
+from promus.core.git import has_access
+from promus.core.access import rule_roles
+
+
+class RuleRolesTest(unittest.TestCase):
+    "Compare the roles with the access granted by the hooks. "
+
+    def test_mixed_keywords(self):
+        "The last keyword applies to all the users of the rule. "
+        users = ['user1', '!deny', 'user2', '!allow', 'user3']
+        roles = rule_roles('path', [['docs/'], users])
+        for user in ['user1', 'user2', 'user3']:
+            self.assertTrue(has_access(user, users))
+            self.assertEqual(roles[user], ['path:docs/:allow'])
+
+    def test_user_before_keyword(self):
+        "A user listed before the keyword is not merely `listed`. "
+        users = ['user1', '!deny', 'user2']
+        roles = rule_roles('name', [['*.pdf', '*.doc'], users])
+        self.assertFalse(has_access('user1', users))
+        self.assertEqual(roles['user1'], ['name:*.pdf:deny',
+                                          'name:*.doc:deny'])
+        self.assertEqual(roles['user2'], roles['user1'])
+
+    def test_no_keyword(self):
+        "Users of a rule without keyword are `listed`. "
+        roles = rule_roles('path', [['src/'], ['user1'],
+                                    ['docs/'], ['user1', '!deny']])
+        self.assertEqual(roles['user1'], ['path:src/:listed',
+                                          'path:docs/:deny'])
+        self.assertNotIn('!deny', roles)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Tests for the changes to the authorized keys file.
+
+Concurrent `promus add user` and `promus greet` processes edit the same
+file, `edit_authorized_keys` must not lose the changes of any of them.
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = """
+import sys
+import time
+import promus.core.ssh as ssh
+email = sys.argv[1]
+with ssh.edit_authorized_keys() as (users, pending, unknown):
+    time.sleep(0.5)  # let the other writer read the file meanwhile
+    users[email] = {'key-%s' % email: [email, 'name', 'alias',
+                                       'ssh-rsa', 'desc']}
+"""
+
+
+class EditAuthorizedKeysTest(unittest.TestCase):
+    "Run several writers at the same time. "
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='promus-test-')
+        self.env = dict(os.environ)
+        self.env.update({'HOME': self.home, 'PYTHONPATH': ROOT})
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def test_concurrent_writers(self):
+        "The entries of both writers survive. "
+        emails = ['a@example.com', 'b@example.com']
+        procs = [subprocess.Popen([sys.executable, '-c', SCRIPT, email],
+                                  env=self.env) for email in emails]
+        for proc in procs:
+            self.assertEqual(proc.wait(), 0)
+        with open('%s/.ssh/authorized_keys' % self.home) as tmpf:
+            lines = [line for line in tmpf if line.startswith('command=')]
+        self.assertEqual(len(lines), 2)
+        for email in emails:
+            self.assertIn(" ssh-rsa key-%s desc" % email, ''.join(lines))
+
+if __name__ == '__main__':
+    unittest.main()
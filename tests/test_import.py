@@ -0,0 +1,57 @@
+"""Import time of `promus.core`.
+
+`promus.core` is imported by `python -m promus greet` on every ssh
+login and by every hook. The modules needed to send emails, reach
+remote hosts or parse dates must only be imported when used.
+
+"""
+
+import os
+import sys
+import json
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Milliseconds allowed to `import promus.core` in a new interpreter
+BUDGET = 50.0
+HEAVY = ['smtplib', 'email.mime', 'pysftp', 'paramiko', 'dateutil',
+         'cryptography', 'Crypto', 'rsa', 'multiprocessing']
+SCRIPT = """
+import sys, time, json
+start = time.time()
+import promus.core
+elapsed = (time.time() - start) * 1e3
+print(json.dumps([elapsed, sorted(sys.modules)]))
+"""
+
+
+def import_core():
+    "Import `promus.core` in a new interpreter. "
+    env = dict(os.environ)
+    env['PYTHONPATH'] = ROOT
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env,
+                                  universal_newlines=True)
+    return json.loads(out)
+
+
+class ImportTest(unittest.TestCase):
+    "Keep `import promus.core` cheap. "
+
+    def test_budget(self):
+        "The fastest of three imports is within the budget. "
+        elapsed = min(import_core()[0] for _ in range(3))
+        self.assertLess(elapsed, BUDGET,
+                        'import promus.core took %.1f ms' % elapsed)
+
+    def test_heavy_modules(self):
+        "No heavy module is imported. "
+        modules = import_core()[1]
+        loaded = [name for name in modules
+                  if any(name == heavy or name.startswith(heavy + '.')
+                         for heavy in HEAVY)]
+        self.assertEqual(loaded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Regression tests for `promus list` and `promus access`.
+
+Both commands read the inventory cached by the previous run, the
+second run must not fail on repositories without an acl.
+
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ListTwiceTest(unittest.TestCase):
+    "Run the commands twice on an account with an empty repository. "
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp(prefix='promus-test-')
+        self.env = dict(os.environ)
+        self.env.update({'HOME': self.home, 'USER': 'master',
+                         'GIT_CONFIG_NOSYSTEM': '1', 'PYTHONPATH': ROOT})
+        os.makedirs('%s/git' % self.home)
+        subprocess.check_call(['git', 'init', '-q', '--bare',
+                               '%s/git/empty.git' % self.home])
+
+    def tearDown(self):
+        shutil.rmtree(self.home)
+
+    def promus(self, *args):
+        "Run promus and return its output, failing on errors. "
+        proc = subprocess.Popen((sys.executable, '-m', 'promus') + args,
+                                env=self.env, cwd=self.home,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True)
+        out, err = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        return out
+
+    def test_list(self):
+        "The cached acl error is displayed the second time. "
+        for _ in range(2):
+            out = self.promus('list')
+            self.assertIn('empty.git', out)
+            self.assertIn('`HEAD:.acl` not found', out)
+
+    def test_list_user(self):
+        "Repositories without an acl have no users. "
+        for _ in range(2):
+            self.assertEqual(self.promus('list', '--user', 'bob'), '')
+
+    def test_access(self):
+        "The access index is built from the cached inventory. "
+        self.promus('list')
+        for _ in range(2):
+            self.assertEqual(self.promus('access', 'bob'), '')
+
+
+if __name__ == '__main__':
+    unittest.main()